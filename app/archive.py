@@ -0,0 +1,235 @@
+"""
+app/archive.py
+Tramos antiguos de `sensor_data` exportados a Parquet (tiering).
+
+app/retention.py escribe cada tramo (un chunk de la hypertable) con `write`
+en RETENTION_TIER_DIR, lo registra en `sensor_data_archive` (migración
+0004) y lo borra de la tabla. Las consultas de datos crudos de la API
+(/measurements, /timeseries, /export) y los tramos crudos de las
+agregaciones (app/rollups.py) añaden con `read` las filas archivadas que
+caen en su rango, así que mover datos a disco no cambia las respuestas.
+
+Los ficheros van ordenados por (device_ref, key_ref, timestamp) en row
+groups con estadísticas: el filtro de pyarrow sólo lee los grupos de las
+series pedidas. La lista de tramos se cachea por proceso junto con su
+versión (número de tramos y último `created_at`), que se comprueba en cada
+consulta: un tiering o un borrado hecho por otro proceso se ve en la
+siguiente petición. Sin tramos que solapen el rango no se toca el disco. Requiere `pyarrow` y que
+todos los procesos de la API vean el directorio (volumen compartido).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import os
+import threading
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.rollups import as_utc
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:             # pragma: no cover
+    pa = pc = ds = pq = None
+
+ROW_GROUP_ROWS = 100_000
+
+COLUMNS = ("id", "device_ref", "key_ref", "timestamp", "value")
+
+
+class Segment(NamedTuple):
+    path: str
+    range_start: dt.datetime
+    range_end: dt.datetime      # exclusivo
+    rows: int
+    size: int
+
+
+def schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("device_ref", pa.int32()),
+        ("key_ref", pa.int32()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("value", pa.float64()),
+    ])
+
+
+# ─────────────────────────── Escritura ─────────────────────────── #
+
+def write(path: str, partitions: Iterable[Sequence[tuple]]) -> Tuple[int, int]:
+    """
+    Escribe en `path` las filas `COLUMNS` de `partitions` (ya ordenadas) y
+    devuelve (filas, bytes). El fichero aparece completo o no aparece: se
+    escribe a `path.tmp`, se sincroniza y se renombra. Sin filas no se crea.
+    """
+    tmp = path + ".tmp"
+    rows = 0
+    try:
+        with pq.ParquetWriter(tmp, schema(), compression="zstd") as writer:
+            for part in partitions:
+                ids, devices, keys, stamps, values = zip(*part)
+                writer.write_batch(pa.RecordBatch.from_arrays([
+                    pa.array(ids, pa.int64()),
+                    pa.array(devices, pa.int32()),
+                    pa.array(keys, pa.int32()),
+                    pa.array(stamps, pa.timestamp("us", tz="UTC")),
+                    pa.array(values, pa.float64()),
+                ], schema=schema()), row_group_size=ROW_GROUP_ROWS)
+                rows += len(part)
+        if not rows:
+            os.remove(tmp)
+            return 0, 0
+        with open(tmp, "rb") as fh:
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return rows, os.path.getsize(path)
+
+
+# ─────────────────────────── Lectura ─────────────────────────── #
+
+_lock = threading.Lock()
+_segments: Optional[Tuple[tuple, List[Segment]]] = None
+
+
+def segments(db: Session) -> List[Segment]:
+    """Tramos archivados (cacheados mientras no cambie la versión de la tabla)."""
+    global _segments
+    version = tuple(db.execute(text(
+        "SELECT count(*), max(created_at) FROM sensor_data_archive")).one())
+    with _lock:
+        cached = _segments
+    if cached and cached[0] == version:
+        return cached[1]
+    found = [Segment(*row) for row in db.execute(text(
+        "SELECT path, range_start, range_end, row_count, size_bytes "
+        "FROM sensor_data_archive ORDER BY range_start, created_at"))]
+    with _lock:
+        _segments = (version, found)
+    return found
+
+
+def invalidate() -> None:
+    """Olvida la lista cacheada (tras archivar o borrar tramos)."""
+    global _segments
+    with _lock:
+        _segments = None
+
+
+def overlapping(db: Session, start: Optional[dt.datetime],
+                end: Optional[dt.datetime]) -> List[Segment]:
+    """Tramos que solapan [start, end]; `None` = sin límite por ese lado."""
+    return [s for s in segments(db)
+            if (end is None or s.range_start <= end)
+            and (start is None or s.range_end > start)]
+
+
+async def read(db: AsyncSession,
+               device_refs: Optional[Sequence[int]],
+               key_refs: Optional[Sequence[int]],
+               start: Optional[dt.datetime],
+               end: Optional[dt.datetime],
+               columns: Sequence[str] = COLUMNS) -> List[tuple]:
+    """
+    Filas archivadas (tuplas con `columns`) de las series pedidas en
+    [start, end]; `None` en device_refs / key_refs = sin filtrar.
+    """
+    if pa is None or start is None or end is None:
+        return []
+    start, end = as_utc(start), as_utc(end)
+    found = await db.run_sync(overlapping, start, end)
+    if not found:
+        return []
+    return await asyncio.to_thread(_read, [s.path for s in found], device_refs,
+                                   key_refs, start, end, list(columns))
+
+
+async def read_page(db: AsyncSession,
+                    device_refs: Optional[Sequence[int]],
+                    key_refs: Optional[Sequence[int]],
+                    start: Optional[dt.datetime],
+                    end: Optional[dt.datetime],
+                    after: Optional[Tuple[dt.datetime, int]],
+                    limit: int,
+                    columns: Sequence[str] = COLUMNS,
+                    descending: bool = False) -> List[tuple]:
+    """
+    Como mucho `limit` filas archivadas de [start, end] (`None` = abierto)
+    en orden (timestamp, id), ascendente o descendente, estrictamente
+    después de `after`. Los tramos se leen uno a uno desde ese extremo y
+    Arrow ordena y recorta cada uno; se para en cuanto el siguiente ya no
+    puede entrar en la página, así que el coste depende de `limit` y no de
+    lo que quede del rango (paginación por keyset de app/pagination.py).
+    """
+    if pa is None:
+        return []
+    start = as_utc(start) if start is not None else None
+    end = as_utc(end) if end is not None else None
+    found = await db.run_sync(overlapping, start, end)
+    if not found:
+        return []
+    return await asyncio.to_thread(_read_page, found, device_refs, key_refs, start,
+                                   end, after, limit, list(columns), descending)
+
+
+def _filter(device_refs, key_refs, start, end):
+    ts_type = pa.timestamp("us", tz="UTC")
+    expr = pc.scalar(True)
+    if start is not None:
+        expr &= pc.field("timestamp") >= pa.scalar(start, ts_type)
+    if end is not None:
+        expr &= pc.field("timestamp") <= pa.scalar(end, ts_type)
+    if device_refs is not None:
+        expr &= pc.field("device_ref").isin(list(device_refs))
+    if key_refs is not None:
+        expr &= pc.field("key_ref").isin(list(key_refs))
+    return expr
+
+
+def _read(paths, device_refs, key_refs, start, end, columns) -> List[tuple]:
+    expr = _filter(device_refs, key_refs, start, end)
+    table = ds.dataset(paths, format="parquet").to_table(columns=columns, filter=expr)
+    return list(zip(*(table.column(c).to_pylist() for c in columns)))
+
+
+def _read_page(found, device_refs, key_refs, start, end, after, limit, columns,
+               descending) -> List[tuple]:
+    expr = _filter(device_refs, key_refs, start, end)
+    if after is not None:
+        ts = pa.scalar(as_utc(after[0]), pa.timestamp("us", tz="UTC"))
+        if descending:
+            expr &= ((pc.field("timestamp") < ts)
+                     | ((pc.field("timestamp") == ts) & (pc.field("id") < after[1])))
+        else:
+            expr &= ((pc.field("timestamp") > ts)
+                     | ((pc.field("timestamp") == ts) & (pc.field("id") > after[1])))
+    order = "descending" if descending else "ascending"
+    wanted = list(dict.fromkeys(columns + ["timestamp", "id"]))
+    found = sorted(found, key=lambda s: s.range_end if descending else s.range_start,
+                   reverse=descending)
+    best = None
+    for seg in found:
+        if best is not None and best.num_rows >= limit:
+            last = best.column("timestamp")[limit - 1].as_py()
+            if (seg.range_end <= last) if descending else (seg.range_start > last):
+                break
+        table = ds.dataset(seg.path, format="parquet").to_table(columns=wanted, filter=expr)
+        if table.num_rows:
+            if best is not None:
+                table = pa.concat_tables([best, table])
+            best = table.sort_by([("timestamp", order), ("id", order)]).slice(0, limit)
+    if best is None:
+        return []
+    return list(zip(*(best.column(c).to_pylist() for c in columns)))
@@ -0,0 +1,57 @@
+"""
+app/backfill.py
+Reinyecta uplinks capturados (un JSON de ChirpStack por línea) en
+`sensor_data` a través del mismo sink que usa la ingesta en vivo.
+
+    python -m app.backfill uplinks.ndjson [--sink copy|orm] [--batch 10000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+import time
+
+from app.decoder import extract_rows
+from app.sinks import SINK, SINKS, get_sink
+
+logger = logging.getLogger("backfill")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("path", help="Fichero NDJSON ('-' para stdin)")
+    parser.add_argument("--sink", default=SINK, choices=sorted(SINKS))
+    parser.add_argument("--batch", type=int, default=10_000,
+                        help="Filas por transacción")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s | %(levelname)s | %(message)s")
+
+    sink = get_sink(args.sink)
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    batch, total, started = [], 0, time.perf_counter()
+
+    with stream:
+        for lineno, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.extend(extract_rows(line))
+            except Exception as exc:
+                logger.warning("⚠️  Línea %d ignorada: %s", lineno, exc)
+                continue
+            if len(batch) >= args.batch:
+                total += sink.write(batch)
+                batch = []
+        total += sink.write(batch)
+
+    elapsed = time.perf_counter() - started
+    logger.info("✅ %d filas escritas con el sink '%s' en %.1f s",
+                total, sink.name, elapsed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
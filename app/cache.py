@@ -0,0 +1,456 @@
+"""
+app/cache.py
+Caché HTTP de los endpoints de consulta (GET) con ETag / If-None-Match.
+
+La clave es la ruta más sus parámetros normalizados (orden, fechas en UTC).
+Cada respuesta se guarda en un LRU en memoria (CACHE_MAX_BYTES) y, si
+CACHE_REDIS_URL está definido, en un backend compartido compatible con Redis
+(Redis, Valkey o KeyDB; en desarrollo el servicio `valkey` del compose) para
+que todos los workers y réplicas de la API lo aprovechen.
+
+Validez, según el rango pedido:
+
+    cerrado  → `end` anterior a now - CACHE_SETTLE: no caduca; sólo se
+               invalida si la ingesta confirma filas atrasadas (más viejas
+               que CACHE_SETTLE: spool, gateways con buffer) de sus
+               dispositivos
+    abierto  → el resto (latest, /data, rangos hasta "ahora"): se invalida
+               en cuanto la ingesta confirma filas de sus dispositivos y,
+               como tope, a los CACHE_TTL segundos
+
+Las marcas de agua (último commit por dispositivo) las publica el listener
+`on_commit` de la ingesta: en memoria si corre en este proceso
+(INGEST_MODE=lifespan) o vía el backend compartido si corre aparte. Sin
+ninguna de las dos la API no ve los commits y los rangos abiertos sólo
+viven CACHE_UNWATCHED_TTL segundos.
+
+Un acierto cuyo ETag coincide con If-None-Match responde 304 sin tocar la BD.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from app import metrics
+
+try:
+    import orjson
+except ImportError:             # pragma: no cover
+    orjson = None
+
+try:
+    import redis
+    import redis.asyncio as aioredis
+except ImportError:             # pragma: no cover
+    redis = aioredis = None
+
+CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_MAX_BYTES: int = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+CACHE_MAX_ENTRY_BYTES: int = int(os.getenv("CACHE_MAX_ENTRY_BYTES", str(4 * 1024 ** 2)))
+CACHE_TTL: float = float(os.getenv("CACHE_TTL", "60"))                 # rangos abiertos
+CACHE_UNWATCHED_TTL: float = float(os.getenv("CACHE_UNWATCHED_TTL", "5"))
+CACHE_SETTLE: float = float(os.getenv("CACHE_SETTLE", "300"))          # s hasta "cerrado"
+CACHE_REDIS_URL: str = os.getenv("CACHE_REDIS_URL", "")                # vacío → sólo local
+CACHE_PREFIX: str = os.getenv("CACHE_PREFIX", "chirpstack:")
+CACHE_SYNC_INTERVAL: float = float(os.getenv("CACHE_SYNC_INTERVAL", "0.5"))
+
+SHARED: bool = bool(CACHE_REDIS_URL) and redis is not None
+# ¿Llegan aquí las marcas de agua de la ingesta?
+WATCHED: bool = SHARED or os.getenv("INGEST_MODE", "standalone") == "lifespan"
+
+ROUTES = frozenset((
+    "/data/",
+    "/measurements/",
+    "/latest_measurements/",
+    "/latest_measurements_grouped/",
+    "/latest_measurements_all/",
+    "/latest_measurements_all_grouped/",
+    "/timeseries/",
+    "/timeseries/aggregated/",
+    "/timeseries/aggregated/full/",
+    "/timeseries/aggregated/multi/",
+))
+_DATES = ("start", "end")
+_ALL = "*"                      # marca de agua global (rutas sin dispositivo)
+
+logger = logging.getLogger("cache")
+
+requests_total = metrics.Counter("http_cache_requests_total",
+                                 "Peticiones cacheables por resultado",
+                                 ("route", "result"))
+
+
+# ─────────────────────────── Marcas de agua ─────────────────────────── #
+
+class Watermarks:
+    """
+    Por dispositivo: epoch del último commit (`commit`) y del último commit
+    con filas atrasadas (`backfill`). Escribe el hilo de ingesta, lee la API.
+    `purge` (global) marca el último borrado de datos antiguos (retención).
+    """
+
+    def __init__(self):
+        self.commit: Dict[str, float] = {}
+        self.backfill: Dict[str, float] = {}
+        self.purge: Dict[str, float] = {}
+        self._dirty: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, devices: Iterable[str], late: Iterable[str], now: float) -> None:
+        with self._lock:
+            for kind, names in (("commit", devices), ("backfill", late)):
+                marks = getattr(self, kind)
+                for name in names:
+                    marks[name] = now
+                    self._dirty[(kind, name)] = now
+
+    def mark_purge(self, now: float) -> None:
+        with self._lock:
+            self.purge[_ALL] = now
+            self._dirty[("purge", _ALL)] = now
+
+    def merge(self, kind: str, remote: Dict[str, float]) -> None:
+        marks = getattr(self, kind)
+        with self._lock:
+            for name, ts in remote.items():
+                if ts > marks.get(name, 0.0):
+                    marks[name] = ts
+
+    def take_dirty(self) -> Dict[Tuple[str, str], float]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def since(self, kind: str, devices: Sequence[str]) -> float:
+        """Último commit (o relleno) que afecta a `devices` (o a todo)."""
+        marks = getattr(self, kind)
+        if not devices:
+            return marks.get(_ALL, 0.0)
+        return max((marks.get(d, 0.0) for d in devices), default=0.0)
+
+
+watermarks = Watermarks()
+
+
+def on_commit(rows) -> None:
+    """Listener de app/ingest.py: actualiza las marcas con un lote confirmado."""
+    now = time.time()
+    settled = now - CACHE_SETTLE
+    devices, late = set(), set()
+    for device_id, _key, _value, ts in rows:
+        devices.add(device_id)
+        if ts.timestamp() < settled:
+            late.add(device_id)
+    if not devices:
+        return
+    devices.add(_ALL)
+    if late:
+        late.add(_ALL)
+    watermarks.mark(devices, late, now)
+
+
+def purge() -> None:
+    """Invalida también los rangos cerrados (app/retention.py borró o archivó datos)."""
+    watermarks.mark_purge(time.time())
+
+
+def _sync_loop(client) -> None:
+    """Publica las marcas locales y trae las de otros procesos."""
+    while True:
+        try:
+            dirty = watermarks.take_dirty()
+            if dirty:
+                pipe = client.pipeline(transaction=False)
+                for (kind, name), ts in dirty.items():
+                    pipe.hset(f"{CACHE_PREFIX}wm:{kind}", name, ts)
+                pipe.execute()
+            for kind in ("commit", "backfill", "purge"):
+                remote = client.hgetall(f"{CACHE_PREFIX}wm:{kind}")
+                watermarks.merge(kind, {k.decode(): float(v) for k, v in remote.items()})
+        except Exception as exc:
+            logger.warning("⚠️  Caché compartida no disponible (%s)", exc)
+        time.sleep(CACHE_SYNC_INTERVAL)
+
+
+_sync_thread: Optional[threading.Thread] = None
+
+
+def start() -> None:
+    """Arranca la sincronización de marcas con el backend compartido."""
+    global _sync_thread
+    if not SHARED or _sync_thread is not None:
+        return
+    client = redis.Redis.from_url(CACHE_REDIS_URL, socket_timeout=2)
+    _sync_thread = threading.Thread(target=_sync_loop, args=(client,),
+                                    name="cache-watermarks", daemon=True)
+    _sync_thread.start()
+    logger.info("🗃️  Caché compartida en %s", CACHE_REDIS_URL)
+
+
+# ─────────────────────────── Entradas ─────────────────────────── #
+
+class Entry:
+    __slots__ = ("body", "headers", "etag", "filled", "closed", "devices")
+
+    def __init__(self, body: bytes, headers: List[Tuple[bytes, bytes]],
+                 etag: bytes, filled: float, closed: bool, devices: Tuple[str, ...]):
+        self.body = body
+        self.headers = headers
+        self.etag = etag
+        self.filled = filled
+        self.closed = closed
+        self.devices = devices
+
+    def fresh(self, now: float) -> bool:
+        if self.closed:
+            return max(watermarks.since("backfill", self.devices),
+                       watermarks.since("purge", ())) <= self.filled
+        ttl = CACHE_TTL if WATCHED else CACHE_UNWATCHED_TTL
+        return (now - self.filled < ttl
+                and watermarks.since("commit", self.devices) <= self.filled)
+
+    def dump(self) -> bytes:
+        head = {"headers": [[k.decode("latin-1"), v.decode("latin-1")]
+                            for k, v in self.headers],
+                "etag": self.etag.decode(), "filled": self.filled,
+                "closed": self.closed, "devices": list(self.devices)}
+        return _dumps(head) + b"\n" + self.body
+
+    @classmethod
+    def load(cls, raw: bytes) -> "Entry":
+        head, body = raw.split(b"\n", 1)
+        head = _loads(head)
+        return cls(body,
+                   [(k.encode("latin-1"), v.encode("latin-1")) for k, v in head["headers"]],
+                   head["etag"].encode(), head["filled"], head["closed"],
+                   tuple(head["devices"]))
+
+
+if orjson is not None:
+    _dumps, _loads = orjson.dumps, orjson.loads
+else:                           # pragma: no cover
+    import json
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+    _loads = json.loads
+
+
+class LRU:
+    """Entradas por clave con límite de bytes; seguro entre hilos."""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Entry) -> None:
+        with self._lock:
+            self._drop(key)
+            self._items[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes and self._items:
+                self._drop(next(iter(self._items)))
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def _drop(self, key: str) -> None:
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old.body)
+
+
+local = LRU()
+_shared = None
+
+
+def _client():
+    global _shared
+    if _shared is None:
+        _shared = aioredis.Redis.from_url(CACHE_REDIS_URL, socket_timeout=2)
+    return _shared
+
+
+async def lookup(key: str, now: float) -> Optional[Entry]:
+    entry = local.get(key)
+    if entry is not None:
+        if entry.fresh(now):
+            return entry
+        local.discard(key)
+    if not SHARED:
+        return None
+    try:
+        raw = await _client().get(CACHE_PREFIX + "resp:" + key)
+    except Exception as exc:
+        logger.warning("⚠️  Caché compartida no disponible (%s)", exc)
+        return None
+    if raw is None:
+        return None
+    entry = Entry.load(raw)
+    if not entry.fresh(now):
+        return None
+    local.put(key, entry)
+    return entry
+
+
+async def store(key: str, entry: Entry) -> None:
+    local.put(key, entry)
+    if not SHARED:
+        return
+    try:
+        await _client().set(CACHE_PREFIX + "resp:" + key, entry.dump(),
+                            ex=None if entry.closed else max(1, int(CACHE_TTL)))
+    except Exception as exc:
+        logger.warning("⚠️  Caché compartida no disponible (%s)", exc)
+
+
+# ─────────────────────────── Peticiones ─────────────────────────── #
+
+def _utc(raw: str) -> Optional[dt.datetime]:
+    try:
+        ts = dt.datetime.fromisoformat(raw)
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=dt.timezone.utc)
+    return ts.astimezone(dt.timezone.utc)
+
+
+def describe(path: str, query: bytes,
+             now: float) -> Optional[Tuple[str, Tuple[str, ...], bool]]:
+    """(clave, dispositivos, ¿rango cerrado?); None si no es cacheable."""
+    params = []
+    end = None
+    for name, value in parse_qsl(query.decode("latin-1"), keep_blank_values=True):
+        if name == "stream":
+            return None
+        if name in _DATES:
+            ts = _utc(value)
+            if ts is not None:
+                value = ts.isoformat()
+                if name == "end":
+                    end = ts
+        params.append((name, value))
+    params.sort()
+    devices = tuple(sorted({v for k, v in params if k in ("device_id", "device_ids")}))
+    closed = end is not None and end.timestamp() < now - CACHE_SETTLE
+    key = hashlib.blake2b(f"{path}?{urlencode(params)}".encode(),
+                          digest_size=16).hexdigest()
+    return key, devices, closed
+
+
+def _etag(body: bytes) -> bytes:
+    return b'"' + hashlib.blake2b(body, digest_size=12).hexdigest().encode() + b'"'
+
+
+def _matches(header: Optional[bytes], etag: bytes) -> bool:
+    if not header:
+        return False
+    if header.strip() == b"*":
+        return True
+    return any(tag.strip().removeprefix(b"W/") == etag for tag in header.split(b","))
+
+
+class CacheMiddleware:
+    """Middleware ASGI: sirve y guarda respuestas de ROUTES; ETag y 304."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (not CACHE_ENABLED or scope["type"] != "http"
+                or scope["method"] != "GET" or scope["path"] not in ROUTES):
+            return await self.app(scope, receive, send)
+        now = time.time()
+        path = scope["path"]
+        described = describe(path, scope["query_string"], now)
+        if described is None:
+            return await self.app(scope, receive, send)
+
+        key, devices, closed = described
+        headers = dict(scope["headers"])
+        inm = headers.get(b"if-none-match")
+
+        if b"no-cache" not in headers.get(b"cache-control", b""):
+            entry = await lookup(key, now)
+            if entry is not None:
+                requests_total.inc(1, path, "hit")
+                scope["route"] = _route(scope)      # etiqueta de MetricsMiddleware
+                return await _reply(send, entry.headers, entry.body, entry.etag,
+                                    _matches(inm, entry.etag), b"HIT")
+
+        requests_total.inc(1, path, "miss")
+        await self._fill(scope, receive, send, key, devices, closed, now, inm)
+
+    async def _fill(self, scope, receive, send, key, devices, closed, filled, inm):
+        start = None
+        chunks: List[bytes] = []
+        size = 0
+        passthrough = False
+
+        async def capture(message):
+            nonlocal start, size, passthrough
+            if passthrough:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            more = message.get("more_body", False)
+            if start["status"] != 200 or size > CACHE_MAX_ENTRY_BYTES:
+                passthrough = True          # errores y respuestas enormes: tal cual
+                await send(start)
+                await send({"type": "http.response.body",
+                            "body": b"".join(chunks), "more_body": more})
+                return
+            if more:
+                return
+            body = b"".join(chunks)
+            etag = _etag(body)
+            kept = [(k, v) for k, v in start["headers"]
+                    if k.lower() not in (b"content-length", b"etag")]
+            await store(key, Entry(body, kept, etag, filled, closed, devices))
+            await _reply(send, kept, body, etag, _matches(inm, etag), b"MISS")
+
+        await self.app(scope, receive, capture)
+
+
+def _route(scope):
+    for route in getattr(scope.get("app"), "routes", ()):
+        if getattr(route, "path", None) == scope["path"]:
+            return route
+    return None
+
+
+async def _reply(send, headers, body: bytes, etag: bytes,
+                 not_modified: bool, state: bytes) -> None:
+    extra = [(b"etag", etag), (b"x-cache", state)]
+    if not_modified:
+        await send({"type": "http.response.start", "status": 304,
+                    "headers": [(k, v) for k, v in headers
+                                if k.lower() != b"content-type"] + extra})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send({"type": "http.response.start", "status": 200,
+                "headers": headers + extra
+                + [(b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
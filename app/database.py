@@ -1,5 +1,20 @@
+"""
+app/database.py
+Conexiones a PostgreSQL/TimescaleDB.
 
-from sqlalchemy import create_engine
+    engine        → síncrono (psycopg2): ingesta, sinks COPY y migraciones
+    async_engine  → asyncio (asyncpg) sobre el primario: escrituras de la API
+    read_engine   → asyncio sobre DB_READ_HOST (réplica) o el primario: lecturas
+
+Los endpoints son `async def` y reciben una `AsyncSession` de `get_read_db`
+(o `get_db` si escriben), así que una consulta lenta no ocupa un hilo del
+threadpool. Los pools de la API tienen tamaño configurable, pre-ping,
+reciclado y `statement_timeout` en el servidor (DB_STATEMENT_TIMEOUT_MS);
+`statement_timeout(conn, ms)` lo cambia para una transacción concreta.
+"""
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -11,24 +26,83 @@ DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
 ENV = os.getenv("ENV")
 
+# Réplica de lectura (vacío → las lecturas van al primario)
+DB_READ_HOST = os.getenv("DB_READ_HOST", "")
+DB_READ_PORT = os.getenv("DB_READ_PORT", DB_PORT)
+
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))     # s esperando conexión
+DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))       # s de vida
+DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # 0 → sin límite
+
 try:
     int(DB_PORT)
 except ValueError:
     DB_PORT = "5432"
 
 
-if ENV == 'production':
-    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
-else:
-    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+def _url(host: str, port: str, driver: str = "postgresql") -> str:
+    if ENV == 'production':
+        return f"{driver}://{DB_USER}:{DB_PASS}@{host}/{DB_NAME}"
+    return f"{driver}://{DB_USER}:{DB_PASS}@{host}:{port}/{DB_NAME}"
+
 
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = _url(DB_HOST, DB_PORT)
+ASYNC_DATABASE_URL = _url(DB_HOST, DB_PORT, "postgresql+asyncpg")
+READ_DATABASE_URL = (_url(DB_READ_HOST, DB_READ_PORT, "postgresql+asyncpg")
+                     if DB_READ_HOST else ASYNC_DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, pool_pre_ping=True,
+                       pool_recycle=DB_POOL_RECYCLE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+def _async_engine(url: str):
+    return create_async_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args={"server_settings": {
+            "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+            "application_name": "chirpstack-listener-api",
+        }},
+    )
+
+
+async_engine = _async_engine(ASYNC_DATABASE_URL)
+read_engine = _async_engine(READ_DATABASE_URL) if DB_READ_HOST else async_engine
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False,
+                                       expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(read_engine, autoflush=False,
+                                      expire_on_commit=False)
+
+
+async def get_db():
+    """Sesión asíncrona sobre el primario (endpoints que escriben)."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    """Sesión asíncrona sobre la réplica de lectura (o el primario)."""
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def statement_timeout(conn, ms: int) -> None:
+    """`statement_timeout` de la transacción en curso de `conn` (0 → sin límite)."""
+    await conn.execute(text("SELECT set_config('statement_timeout', :ms, true)"),
+                       {"ms": str(ms)})
+
+
+async def dispose() -> None:
+    """Cierra los pools asíncronos (apagado de la API)."""
+    await async_engine.dispose()
+    if read_engine is not async_engine:
+        await read_engine.dispose()
@@ -0,0 +1,202 @@
+"""
+app/decoder.py
+Decodificación rápida de uplinks de ChirpStack a filas de `sensor_data`.
+
+Se parsean directamente los bytes del mensaje con la librería más rápida
+disponible:
+
+    msgspec → esquemas v3/v4 precompilados: sólo se materializan los campos
+              que usamos (se ignoran rxInfo, txInfo…)
+    orjson  → dict completo + extracción por forma del evento
+    json    → igual que orjson, con la librería estándar
+
+La forma del evento (v4 con `deviceInfo.devEui` / v3 con `devEUI` y
+`objectJSON`) se elige en cada mensaje buscando la clave `"deviceInfo"` en
+los bytes (memmem en C, sin estado compartido entre hilos); sólo si el
+mensaje no encaja se prueba la otra forma.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import itertools
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Union
+
+from app.sinks import Row
+
+try:
+    import msgspec
+except ImportError:             # pragma: no cover
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:             # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger("decoder")
+
+# Con DEBUG se registra 1 de cada LOG_SAMPLE_EVERY uplinks
+LOG_SAMPLE_EVERY: int = max(1, int(os.getenv("INGEST_LOG_SAMPLE_EVERY", "100")))
+_sample = itertools.count()
+
+loads: Callable[[bytes], Any] = orjson.loads if orjson is not None else json.loads
+
+
+class Uplink(NamedTuple):
+    """Campos de un uplink que necesita la ingesta."""
+
+    dev_eui: Optional[str]
+    time: dt.datetime               # UTC (timestamptz)
+    f_cnt: Optional[int]
+    application_id: Optional[str]
+    object: Dict[str, Any]
+
+
+def parse_timestamp(ts: Union[str, dt.datetime]) -> dt.datetime:
+    """
+    Convierte la marca de tiempo ISO-8601 de ChirpStack en un datetime UTC
+    con zona (columna TIMESTAMPTZ). Sin offset se asume UTC. Trunca los
+    nanosegundos de v4.
+    """
+    if isinstance(ts, str):
+        try:
+            ts = dt.datetime.fromisoformat(ts)      # Python ≥ 3.11
+        except ValueError:
+            ts = dt.datetime.fromisoformat(_normalize_iso(ts))
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=dt.timezone.utc)
+    return ts.astimezone(dt.timezone.utc)
+
+
+def _normalize_iso(ts: str) -> str:
+    """'Z' → '+00:00' y fracción a 6 dígitos (fromisoformat < 3.11)."""
+    if ts.endswith("Z"):
+        ts = ts[:-1] + "+00:00"
+    head, sep, frac = ts.partition(".")
+    if sep:
+        digits = len(frac) - len(frac.lstrip("0123456789"))
+        ts = f"{head}.{frac[:min(digits, 6)].ljust(6, '0')}{frac[digits:]}"
+    return ts
+
+
+def _timestamp(ts: Optional[str]) -> dt.datetime:
+    if ts:
+        return parse_timestamp(ts)
+    return dt.datetime.now(dt.timezone.utc)
+
+
+def _object(obj: Union[str, Dict[str, Any], None]) -> Dict[str, Any]:
+    # En v3 `objectJSON` es un string con JSON dentro
+    if isinstance(obj, (str, bytes)):
+        return loads(obj) if obj else {}
+    return obj or {}
+
+
+# ─────────────────────── Formas de evento ─────────────────────── #
+
+def _from_dict_v4(d: Dict[str, Any]) -> Uplink:
+    info = d["deviceInfo"]
+    return Uplink(info.get("devEui"),
+                  _timestamp(d.get("time") or d.get("receivedAt")),
+                  d.get("fCnt"),
+                  info.get("applicationId"),
+                  _object(d.get("object")))
+
+
+def _from_dict_v3(d: Dict[str, Any]) -> Uplink:
+    return Uplink(d["devEUI"],
+                  _timestamp(d.get("receivedAt") or d.get("time")),
+                  d.get("fCnt"),
+                  d.get("applicationID"),
+                  _object(d.get("objectJSON") or d.get("object")))
+
+
+if msgspec is not None:
+
+    class _DeviceInfoV4(msgspec.Struct):
+        devEui: str
+        applicationId: Optional[str] = None
+
+    class _EventV4(msgspec.Struct):
+        deviceInfo: _DeviceInfoV4
+        time: Optional[str] = None
+        fCnt: Optional[int] = None
+        object: Optional[Dict[str, Any]] = None
+
+    class _EventV3(msgspec.Struct):
+        devEUI: str
+        applicationID: Optional[str] = None
+        receivedAt: Optional[str] = None
+        time: Optional[str] = None
+        fCnt: Optional[int] = None
+        objectJSON: Union[str, Dict[str, Any], None] = None
+        object: Optional[Dict[str, Any]] = None
+
+    _dec_v4 = msgspec.json.Decoder(_EventV4)
+    _dec_v3 = msgspec.json.Decoder(_EventV3)
+
+    def _decode_v4(raw: bytes) -> Uplink:
+        e = _dec_v4.decode(raw)
+        return Uplink(e.deviceInfo.devEui, _timestamp(e.time), e.fCnt,
+                      e.deviceInfo.applicationId, e.object or {})
+
+    def _decode_v3(raw: bytes) -> Uplink:
+        e = _dec_v3.decode(raw)
+        return Uplink(e.devEUI, _timestamp(e.receivedAt or e.time), e.fCnt,
+                      e.applicationID, _object(e.objectJSON or e.object))
+
+    _SHAPE_ERRORS = (msgspec.ValidationError,)
+
+else:                           # pragma: no cover
+
+    def _decode_v4(raw: bytes) -> Uplink:
+        return _from_dict_v4(loads(raw))
+
+    def _decode_v3(raw: bytes) -> Uplink:
+        return _from_dict_v3(loads(raw))
+
+    _SHAPE_ERRORS = (KeyError, TypeError)
+
+
+# Clave que sólo aparece (sin escapar) en los eventos v4
+_V4_MARKER = b'"deviceInfo"'
+
+
+def decode_uplink(raw: bytes) -> Uplink:
+    """Decodifica los bytes de un uplink (v3 o v4) en un `Uplink`."""
+    first, second = ((_decode_v4, _decode_v3) if _V4_MARKER in raw
+                     else (_decode_v3, _decode_v4))
+    try:
+        return first(raw)
+    except _SHAPE_ERRORS:
+        logger.debug("🔎 Uplink sin la forma %s; se prueba %s",
+                     first.__name__[-2:], second.__name__[-2:])
+        return second(raw)
+
+
+def extract_rows(raw: bytes) -> List[Row]:
+    """Convierte un uplink de ChirpStack en filas (device_id, key, value, ts)."""
+    return uplink_rows(decode_uplink(raw))
+
+
+def uplink_rows(up: Uplink, rules=None) -> List[Row]:
+    """
+    Filas numéricas de un uplink ya decodificado; con `rules` (un
+    `app.rules.Filter`) se aplican las reglas de su aplicación / dispositivo.
+    """
+    if rules is not None:
+        rows = rules.rows(up)
+    else:
+        rows = [
+            (up.dev_eui, key, value, up.time)
+            for key, value in up.object.items()
+            if isinstance(value, (int, float))
+        ]
+    if logger.isEnabledFor(logging.DEBUG) and next(_sample) % LOG_SAMPLE_EVERY == 0:
+        for row in rows:
+            logger.debug("[DB] %s %s %s = %s", *row)
+    return rows
@@ -0,0 +1,143 @@
+"""
+app/dictionary.py
+Diccionarios en memoria devEUI/key ↔ id compacto (tablas sensor_device y
+sensor_key, migración 0001).
+
+La ingesta traduce cada fila `(device_id, key, value, ts)` a
+`(device_ref, key_ref, value, ts)` con `to_refs`; sólo los nombres nuevos
+tocan la BD (INSERT … ON CONFLICT DO NOTHING + SELECT), siempre en una
+transacción propia que se confirma antes de escribir los datos: si la caché
+aprendiera ids dentro de la transacción del lote y ésta se deshiciera, se
+quedaría con ids que no existen: no hay FOREIGN KEY que lo impida, así que
+las filas siguientes se guardarían con refs huérfanas que `name` no puede
+resolver. La API usa `lookup` para convertir los filtros de las consultas y
+`name` para las respuestas.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from app.database import engine
+
+RefRow = Tuple[int, int, float, object]     # (device_ref, key_ref, value, ts)
+
+
+class Dictionary:
+    """Caché bidireccional nombre ↔ id de una tabla diccionario."""
+
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._select = (f"SELECT id, {column} FROM {table} "
+                        f"WHERE {column} = ANY(CAST(:names AS text[]))")
+        self._insert = (f"INSERT INTO {table} ({column}) "
+                        f"SELECT unnest(CAST(:names AS text[])) "
+                        f"ON CONFLICT ({column}) DO NOTHING")
+        self._select_async = (f"SELECT id, {column} FROM {table} "
+                              f"WHERE {column} = ANY($1::text[])")
+        self._insert_async = (f"INSERT INTO {table} ({column}) "
+                              f"SELECT unnest($1::text[]) "
+                              f"ON CONFLICT ({column}) DO NOTHING")
+
+    def _remember(self, pairs: Iterable[Tuple[int, str]]) -> None:
+        with self._lock:
+            for id_, name in pairs:
+                self._ids[name] = id_
+                self._names[id_] = name
+
+    def missing(self, names: Iterable[str]) -> List[str]:
+        ids = self._ids
+        return [n for n in set(names) if n is not None and n not in ids]
+
+    # ─────────────────────── Resolución (sync) ─────────────────────── #
+
+    def resolve(self, names: Iterable[str], create: bool = False,
+                conn=None) -> Dict[str, int]:
+        """
+        Garantiza en caché los ids de `names` (creándolos si `create`) y
+        devuelve el diccionario nombre → id de los que existen. Con `create`
+        se ignora `conn`: los nombres nuevos se crean y confirman en una
+        transacción propia antes de cachearlos.
+        """
+        names = list(names)
+        todo = self.missing(names)
+        if todo:
+            if conn is None or create:
+                with engine.begin() as own:
+                    self._fetch(own, todo, create)
+            else:
+                self._fetch(conn, todo, create)
+        ids = self._ids
+        return {n: ids[n] for n in names if n in ids}
+
+    def _fetch(self, conn, names: List[str], create: bool) -> None:
+        if create:
+            conn.execute(text(self._insert), {"names": names})
+        self._remember(conn.execute(text(self._select), {"names": names}))
+
+    def lookup(self, name: str, conn=None) -> Optional[int]:
+        """Id de un nombre existente (sin crearlo) o None."""
+        id_ = self._ids.get(name)
+        if id_ is None:
+            id_ = self.resolve([name], conn=conn).get(name)
+        return id_
+
+    def name(self, id_: int, conn=None) -> Optional[str]:
+        """Nombre de un id (consulta la BD si no está en caché)."""
+        name = self._names.get(id_)
+        if name is None:
+            sql = text(f"SELECT id, {self.column} FROM {self.table} WHERE id = :id")
+            if conn is None:
+                with engine.connect() as own:
+                    self._remember(own.execute(sql, {"id": id_}))
+            else:
+                self._remember(conn.execute(sql, {"id": id_}))
+            name = self._names.get(id_)
+        return name
+
+    # ─────────────────────── Resolución (asyncpg) ─────────────────────── #
+
+    async def resolve_async(self, conn, names: Iterable[str]) -> Dict[str, int]:
+        """Como `resolve(create=True)`; `conn` no debe tener una transacción abierta."""
+        names = list(names)
+        todo = self.missing(names)
+        if todo:
+            async with conn.transaction():
+                await conn.execute(self._insert_async, todo)
+                found = await conn.fetch(self._select_async, todo)
+            self._remember((r[0], r[1]) for r in found)
+        ids = self._ids
+        return {n: ids[n] for n in names if n in ids}
+
+
+devices = Dictionary("sensor_device", "dev_eui")
+keys = Dictionary("sensor_key", "name")
+
+
+def _map(rows, dev_ids: Dict[str, int], key_ids: Dict[str, int]) -> List[RefRow]:
+    return [(dev_ids[d], key_ids[k], v, ts) for d, k, v, ts in rows
+            if d in dev_ids and k in key_ids]
+
+
+def to_refs(rows: Sequence[tuple]) -> List[RefRow]:
+    """
+    Traduce filas con nombres a filas con ids, creando (y confirmando) los
+    que falten. Se llama antes de abrir la transacción de los datos.
+    """
+    dev_ids = devices.resolve((r[0] for r in rows), create=True)
+    key_ids = keys.resolve((r[1] for r in rows), create=True)
+    return _map(rows, dev_ids, key_ids)
+
+
+async def to_refs_async(conn, rows: Sequence[tuple]) -> List[RefRow]:
+    """`to_refs` con asyncpg; `conn` fuera de la transacción de los datos."""
+    dev_ids = await devices.resolve_async(conn, (r[0] for r in rows))
+    key_ids = await keys.resolve_async(conn, (r[1] for r in rows))
+    return _map(rows, dev_ids, key_ids)
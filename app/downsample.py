@@ -0,0 +1,149 @@
+"""
+app/downsample.py
+Reducción de `/timeseries/` a un número de puntos dibujable (`max_points`).
+
+    lttb   → Largest-Triangle-Three-Buckets: conserva la forma visual de la
+             serie eligiendo puntos reales (NumPy)
+    minmax → mínimo y máximo reales de cada bucket de tiempo (NumPy);
+             no pierde picos
+    avg    → media por bucket de tiempo en SQL; reutiliza los rollups de
+             app/rollups.py cuando el ancho es múltiplo de una hora
+
+lttb y minmax leen el cursor del servidor por particiones en arrays
+compactos (id, µs, value) sin crear objetos ORM ni dicts por fila, tras las
+filas archivadas en Parquet (app/archive.py); sin NumPy se usa `avg`.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import math
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import archive, models, rollups, streaming
+
+try:
+    import numpy as np
+except ImportError:             # pragma: no cover
+    np = None
+
+METHODS = ("lttb", "minmax", "avg")
+
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+Point = Tuple[int, float, dt.datetime]      # (id | None, value, timestamp)
+
+
+def bucket_interval(intervals: Dict[str, rollups.Interval],
+                    start: dt.datetime, end: dt.datetime,
+                    max_points: int) -> rollups.Interval:
+    """
+    Ancho de bucket para no superar `max_points`: múltiplo del mayor de
+    `intervals` que quepa (para poder leer de su rollup) o segundos enteros.
+    """
+    raw = (end - start) / max_points
+    base = max((iv.width for iv in intervals.values() if iv.width <= raw),
+               default=dt.timedelta(seconds=1))
+    width = base * max(1, math.ceil(raw / base))
+    return rollups.Interval(dt.timedelta(seconds=int(width.total_seconds())), None)
+
+
+# ─────────────────────────── Algoritmos ─────────────────────────── #
+
+def lttb(x, y, n: int):
+    """Índices de los `n` puntos LTTB de (x, y) ordenados por x."""
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    out = np.empty(n, dtype=np.intp)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (hi, edges[i + 2]) if i < n - 3 else (size - 1, size)
+        avg_x = x[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def minmax(x, y, n: int):
+    """Índices del mínimo y el máximo de cada uno de `n // 2` buckets de x."""
+    size = len(x)
+    buckets = max(1, n // 2)
+    if size <= n:
+        return np.arange(size)
+    span = float(x[-1] - x[0]) or 1.0
+    b = np.minimum(((x - x[0]) / span * buckets).astype(np.intp), buckets - 1)
+    order = np.lexsort((y, b))
+    sb = b[order]
+    firsts = np.flatnonzero(np.r_[True, sb[1:] != sb[:-1]])
+    lasts = np.r_[firsts[1:] - 1, size - 1]
+    return np.unique(np.r_[order[firsts], order[lasts]])
+
+
+# ─────────────────────────── Consulta ─────────────────────────── #
+
+async def _load(device_ref: int, key_ref: int, start, end, head=()):
+    """Arrays (id, µs desde epoch, value) de la serie, por particiones."""
+    sd = models.SensorData
+    stmt = (
+        select(sd.id, sd.timestamp, sd.value)
+        .where(sd.device_ref == device_ref,
+               sd.key_ref == key_ref,
+               sd.timestamp.between(start, end),
+               sd.value.isnot(None))
+        .order_by(sd.timestamp.asc())
+    )
+    ids, stamps, values = [], [], []
+    async for part in streaming.with_head(head, stmt):
+        i, ts, v = zip(*part)
+        ids.append(np.fromiter(i, np.int64, len(part)))
+        stamps.append(np.fromiter(((t - EPOCH) // dt.timedelta(microseconds=1)
+                                   for t in ts), np.int64, len(part)))
+        values.append(np.fromiter(v, np.float64, len(part)))
+    if not ids:
+        return (np.empty(0, np.int64), np.empty(0, np.int64),
+                np.empty(0, np.float64))
+    return np.concatenate(ids), np.concatenate(stamps), np.concatenate(values)
+
+
+async def downsample(db: AsyncSession,
+                     intervals: Dict[str, rollups.Interval],
+                     method: str,
+                     max_points: int,
+                     device_ref: int,
+                     key_ref: int,
+                     start: dt.datetime,
+                     end: dt.datetime) -> List[Point]:
+    """Como mucho ~`max_points` puntos (id, value, timestamp) de la serie."""
+    start, end = rollups.as_utc(start), rollups.as_utc(end)
+    if method == "avg" or np is None:
+        if end <= start:
+            return []
+        wanted = bucket_interval(intervals, start, end, max_points)
+        rows = await rollups.aggregate_async(db, intervals, wanted,
+                                             [device_ref], key_ref, start, end)
+        return [(None, avg, bucket) for _, bucket, avg, _, _ in rows]
+
+    archived = await archive.read(db, [device_ref], [key_ref], start, end,
+                                  ("id", "timestamp", "value"))
+    ids, stamps, values = await _load(device_ref, key_ref, start, end,
+                                      [row for row in archived if row[2] is not None])
+    if archived:                # filas atrasadas de un tramo ya archivado
+        order = np.argsort(stamps, kind="stable")
+        ids, stamps, values = ids[order], stamps[order], values[order]
+    pick = (lttb if method == "lttb" else minmax)(
+        stamps.astype(np.float64), values, max_points)
+    return [
+        (int(ids[i]), float(values[i]),
+         EPOCH + dt.timedelta(microseconds=int(stamps[i])))
+        for i in pick
+    ]
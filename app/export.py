@@ -0,0 +1,198 @@
+"""
+app/export.py
+Exportación columnar de series temporales (`GET /export/`).
+
+Formato largo (device_id, key, timestamp, value) para varios dispositivos
+y magnitudes en una sola petición:
+
+    arrow   → Arrow IPC stream (un RecordBatch por partición del cursor)
+    parquet → Parquet (un row group por partición; pie al final)
+    csv     → CSV, sin dependencias
+
+Las columnas se construyen directamente desde las particiones del cursor
+del servidor (app/streaming.py); device_id y key van como columnas
+diccionario indexadas por los ids compactos. Arrow y Parquet requieren
+`pyarrow`; sin él sólo está disponible `csv`.
+"""
+
+from __future__ import annotations
+
+import bisect
+import csv
+import heapq
+import io
+import operator
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.sql import Select
+
+from app import metrics, models, streaming
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:             # pragma: no cover
+    pa = pq = None
+
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "csv": ("text/csv", "csv"),
+}
+
+
+def query(device_refs: Sequence[int], key_refs: Sequence[int], start, end) -> Select:
+    sd = models.SensorData
+    return (
+        select(sd.device_ref, sd.key_ref, sd.timestamp, sd.value)
+        .where(sd.device_ref.in_(list(device_refs)),
+               sd.key_ref.in_(list(key_refs)),
+               sd.timestamp.between(start, end))
+        .order_by(sd.device_ref, sd.key_ref, sd.timestamp)
+    )
+
+
+class _ChunkSink:
+    """Fichero en memoria que el generador vacía tras cada escritura."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+_ORDER = operator.itemgetter(0, 1, 2)          # (device_ref, key_ref, timestamp)
+
+
+async def _merged(archived: Sequence[tuple],
+                  stmt: Optional[Select]) -> AsyncIterator[Sequence[tuple]]:
+    """
+    Particiones del cursor con las filas archivadas intercaladas en el
+    orden de `query`; `archived` ya viene ordenado. A cada partición se le
+    mezclan las archivadas que caen hasta su última fila; las que quedan
+    detrás de la última partición salen al final.
+    """
+    i = 0
+    async for part in streaming.partitions(stmt):
+        j = bisect.bisect_right(archived, _ORDER(part[-1]), lo=i, key=_ORDER)
+        if j > i:
+            part = list(heapq.merge(archived[i:j], part, key=_ORDER))
+            i = j
+        yield part
+    if i < len(archived):
+        yield archived[i:]
+
+
+# ─────────────────────────── Formatos ─────────────────────────── #
+
+def _schema():
+    return pa.schema([
+        ("device_id", pa.dictionary(pa.int32(), pa.string())),
+        ("key", pa.dictionary(pa.int32(), pa.string())),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("value", pa.float64()),
+    ])
+
+
+async def _batches(stmt: Select, devices: Dict[int, str], keys: Dict[int, str],
+                   head: Sequence[tuple] = ()):
+    """RecordBatches desde las particiones del cursor (con `head` intercalado)."""
+    dev_index = {ref: i for i, ref in enumerate(devices)}
+    key_index = {ref: i for i, ref in enumerate(keys)}
+    dev_names = pa.array(list(devices.values()), pa.string())
+    key_names = pa.array(list(keys.values()), pa.string())
+    schema = _schema()
+    async for part in _merged(head, stmt):
+        metrics.add_returned(len(part))
+        dev_refs, key_refs, stamps, values = zip(*part)
+        yield pa.RecordBatch.from_arrays([
+            pa.DictionaryArray.from_arrays(
+                pa.array([dev_index[r] for r in dev_refs], pa.int32()), dev_names),
+            pa.DictionaryArray.from_arrays(
+                pa.array([key_index[r] for r in key_refs], pa.int32()), key_names),
+            pa.array(stamps, pa.timestamp("us", tz="UTC")),
+            pa.array(values, pa.float64()),
+        ], schema=schema)
+
+
+async def _arrow(stmt, devices, keys, head) -> AsyncIterator[bytes]:
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, _schema()) as writer:
+        async for batch in _batches(stmt, devices, keys, head):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+async def _parquet(stmt, devices, keys, head) -> AsyncIterator[bytes]:
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, _schema(), compression="zstd") as writer:
+        async for batch in _batches(stmt, devices, keys, head):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+async def _csv(stmt, devices, keys, head) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    out.writerow(("device_id", "key", "timestamp", "value"))
+    async for part in _merged(head, stmt):
+        metrics.add_returned(len(part))
+        out.writerows((devices[d], keys[k], ts.isoformat(), v)
+                      for d, k, ts, v in part)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue().encode()
+
+
+_WRITERS = {"arrow": _arrow, "parquet": _parquet, "csv": _csv}
+
+
+def respond(fmt: str,
+            stmt: Optional[Select],
+            devices: Dict[int, str],
+            keys: Dict[int, str],
+            head: Sequence[tuple] = ()):
+    """
+    StreamingResponse con la exportación en `fmt`; `devices` y `keys` son
+    los diccionarios ref → nombre de los filtros (ya resueltos). `head`
+    son filas archivadas (app/archive.py), que se intercalan con las de la
+    BD en orden (device_ref, key_ref, timestamp).
+    """
+    if fmt not in FORMATS:
+        return JSONResponse(status_code=400, content={
+            "error": "Invalid format. Use one of: arrow, parquet, csv."})
+    if fmt != "csv" and pa is None:
+        return JSONResponse(status_code=501, content={
+            "error": "pyarrow no está instalado; usa format=csv."})
+    media_type, ext = FORMATS[fmt]
+    head = sorted(head, key=_ORDER)
+    return StreamingResponse(
+        _WRITERS[fmt](stmt, devices, keys, head),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="export.{ext}"'},
+    )
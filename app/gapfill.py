@@ -0,0 +1,238 @@
+"""
+app/gapfill.py
+Relleno de huecos: series crudas guardadas con banda muerta
+(`/timeseries/?fill=`) y buckets vacíos de `/timeseries/aggregated/*`.
+
+Con las reglas de app/rules.py (`on_change`, `deadband`, `heartbeat`) la
+ingesta sólo guarda una muestra cuando el valor cambia de verdad, así que
+entre dos filas el valor es el de la anterior. `fill` lo hace explícito:
+
+    previous → rejilla regular de `resolution` segundos entre start y end;
+               cada punto lleva el último valor guardado (forward-fill)
+    step     → las filas reales más los vértices de la escalera: el valor
+               anterior repetido en el instante de cada cambio y los
+               extremos start / end, para dibujar con líneas rectas
+
+El valor vigente en `start` es la última fila anterior (tabla o Parquet)
+dentro de FILL_LOOKBACK: con un `heartbeat` menor que ese margen siempre
+existe y la consulta es un único acceso al índice. Los puntos rellenados no
+tienen id y nunca van más allá del instante actual.
+
+En las agregaciones, `fill=null|previous|linear` devuelve todos los buckets
+del rango: con TimescaleDB lo hace la consulta (time_bucket_gapfill con
+locf / interpolate, ver app/rollups.py); en PostgreSQL sin la extensión la
+consulta agrupa con los mismos buckets que `rollups.floor_to` y
+`fill_buckets` rellena el resultado (con NumPy si está instalado). En ambos
+casos se incluyen también las series pedidas que no tienen ninguna fila en
+el rango, con todos sus buckets a None (`with_empty`).
+"""
+
+from __future__ import annotations
+
+import bisect
+import datetime as dt
+import itertools
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import archive, models, rollups
+from app.downsample import EPOCH, Point
+
+try:
+    import numpy as np
+except ImportError:             # pragma: no cover
+    np = None
+
+MODES = ("previous", "step")                    # /timeseries/
+FILLS = ("none", "null", "previous", "linear")  # /timeseries/aggregated/*
+
+FILL_LOOKBACK = dt.timedelta(seconds=float(os.getenv("FILL_LOOKBACK", "86400")))
+FILL_MAX_POINTS: int = int(os.getenv("FILL_MAX_POINTS", "100000"))
+
+
+def horizon(end: dt.datetime) -> dt.datetime:
+    """`end` sin pasar del instante actual."""
+    return min(rollups.as_utc(end), dt.datetime.now(dt.timezone.utc))
+
+
+def grid_size(start: dt.datetime, end: dt.datetime, resolution: int) -> int:
+    span = (horizon(end) - rollups.as_utc(start)).total_seconds()
+    return int(span // resolution) + 1 if span >= 0 else 0
+
+
+async def seed(db: AsyncSession, device_ref: int, key_ref: int,
+               start: dt.datetime) -> Optional[Tuple[float, dt.datetime]]:
+    """(value, timestamp) de la última fila antes de `start` (dentro del margen)."""
+    start = rollups.as_utc(start)
+    since = start - FILL_LOOKBACK
+    sd = models.SensorData
+    found = (await db.execute(
+        select(sd.value, sd.timestamp)
+        .where(sd.device_ref == device_ref,
+               sd.key_ref == key_ref,
+               sd.timestamp >= since,
+               sd.timestamp < start,
+               sd.value.isnot(None))
+        .order_by(sd.timestamp.desc())
+        .limit(1))).first()
+    archived = [row for row in await archive.read(db, [device_ref], [key_ref], since, start,
+                                                  ("value", "timestamp"))
+                if row[1] < start and row[0] is not None]
+    candidates = ([tuple(found)] if found else []) + archived
+    return max(candidates, key=lambda row: row[1]) if candidates else None
+
+
+def previous(points: Sequence[Point], initial: Optional[Tuple[float, dt.datetime]],
+             start: dt.datetime, end: dt.datetime, resolution: int) -> List[Point]:
+    """Forward-fill de `points` (ordenados) sobre la rejilla de `resolution` s."""
+    start = rollups.as_utc(start)
+    n = grid_size(start, end, resolution)
+    if n <= 0:
+        return []
+    head = [initial] if initial else []
+    values = [v for v, _ in head] + [p[1] for p in points]
+    stamps = [t for _, t in head] + [p[2] for p in points]
+    step = dt.timedelta(seconds=resolution)
+    if np is not None:
+        x = np.fromiter(((t - EPOCH) // dt.timedelta(microseconds=1) for t in stamps),
+                        np.int64, len(stamps))
+        base = (start - EPOCH) // dt.timedelta(microseconds=1)
+        grid = base + np.arange(n, dtype=np.int64) * (resolution * 1_000_000)
+        idx = np.searchsorted(x, grid, side="right") - 1
+        return [(None, values[i], start + step * k)
+                for k, i in enumerate(idx.tolist()) if i >= 0]
+    out = []
+    for k in range(n):
+        at = start + step * k
+        i = bisect.bisect_right(stamps, at) - 1
+        if i >= 0:
+            out.append((None, values[i], at))
+    return out
+
+
+def staircase(points: Sequence[Point], initial: Optional[Tuple[float, dt.datetime]],
+              start: dt.datetime, end: dt.datetime) -> List[Point]:
+    """Filas reales más los vértices de la escalera y los extremos."""
+    start, last_at = rollups.as_utc(start), horizon(end)
+    out: List[Point] = []
+    current = initial[0] if initial else None
+    if current is not None and (not points or points[0][2] > start):
+        out.append((None, current, start))
+    for point in points:
+        if current is not None and point[1] != current and out:
+            out.append((None, current, point[2]))
+        out.append(point)
+        current = point[1]
+    if out and out[-1][2] < last_at:
+        out.append((None, current, last_at))
+    return out
+
+
+# ─────────────────────── Buckets agregados ─────────────────────── #
+
+def bucket_count(start: dt.datetime, end: dt.datetime, width: dt.timedelta) -> int:
+    """Buckets de `width` que cubren [start, end]."""
+    start, end = rollups.as_utc(start), rollups.as_utc(end)
+    if end < start:
+        return 0
+    return (rollups.floor_to(end, width) - rollups.floor_to(start, width)) // width + 1
+
+
+def invalid(fill: str, start: Optional[dt.datetime], end: Optional[dt.datetime],
+            width: dt.timedelta, series: int = 1) -> Optional[dict]:
+    """Error de las agregaciones si `fill` no existe o el relleno es demasiado grande."""
+    if fill not in FILLS:
+        return {"error": "Invalid fill. Use one of: none, null, previous, linear."}
+    if (fill != "none" and start is not None and end is not None
+            and bucket_count(start, end, width) * series > FILL_MAX_POINTS):
+        return {"error": f"Too many buckets to fill; max {FILL_MAX_POINTS} per request."}
+    return None
+
+
+AGGREGATES = 3      # average, maximum, minimum
+
+
+def fill_buckets(rows: Sequence[tuple], series_columns: int,
+                 start: dt.datetime, end: dt.datetime,
+                 width: dt.timedelta, mode: str) -> List[tuple]:
+    """
+    Equivalente en Python de time_bucket_gapfill + locf / interpolate:
+    `rows` son (serie…, bucket, valores…) ordenadas por serie y bucket; se
+    devuelven todos los buckets de [start, end] de cada serie presente, con
+    None, el valor anterior (`previous`) o la interpolación lineal entre
+    vecinos (`linear`) en los que faltan.
+    """
+    first = rollups.floor_to(rollups.as_utc(start), width)
+    n = bucket_count(start, end, width)
+    out: List[tuple] = []
+    for series, group in itertools.groupby(rows, key=lambda row: row[:series_columns]):
+        slots, columns = [], []
+        for row in group:
+            slot = (row[series_columns] - first) // width
+            if 0 <= slot < n:
+                slots.append(slot)
+                columns.append(row[series_columns + 1:])
+        if not slots:
+            continue
+        filled = [_fill(slots, column, n, mode) for column in zip(*columns)]
+        out.extend(series + (first + width * i,) + tuple(column[i] for column in filled)
+                   for i in range(n))
+    return out
+
+
+def with_empty(rows: Sequence[tuple], series: Sequence[tuple], series_columns: int,
+               start: dt.datetime, end: dt.datetime,
+               width: dt.timedelta) -> Sequence[tuple]:
+    """
+    `rows` rellenas más todos los buckets a None de cada serie de `series`
+    (claves de `series_columns` valores) que no aparece, en el mismo orden.
+    """
+    present = {tuple(row[:series_columns]) for row in rows}
+    missing = [key for key in series if key not in present]
+    if not missing:
+        return rows
+    first = rollups.floor_to(rollups.as_utc(start), width)
+    n = bucket_count(start, end, width)
+    out = list(rows)
+    out.extend(key + (first + width * i,) + (None,) * AGGREGATES
+               for key in missing for i in range(n))
+    out.sort(key=lambda row: tuple(row[:series_columns + 1]))
+    return out
+
+
+def _fill(slots: Sequence[int], values: Sequence[Optional[float]], n: int,
+          mode: str) -> List[Optional[float]]:
+    if np is None:
+        return _fill_python(slots, values, n, mode)
+    y = np.full(n, np.nan)
+    y[np.asarray(slots, dtype=np.intp)] = np.array(values, dtype=np.float64)
+    valid = ~np.isnan(y)
+    if mode == "previous":
+        idx = np.where(valid, np.arange(n), -1)
+        np.maximum.accumulate(idx, out=idx)
+        y = np.where(idx >= 0, y[np.maximum(idx, 0)], np.nan)
+    elif mode == "linear":
+        known = np.flatnonzero(valid)
+        if len(known) > 1:
+            inner = np.arange(known[0], known[-1] + 1)
+            y[inner] = np.interp(inner, known, y[known])
+    return [None if v != v else v for v in y.tolist()]       # NaN → None
+
+
+def _fill_python(slots, values, n, mode):                    # pragma: no cover
+    y: List[Optional[float]] = [None] * n
+    for slot, value in zip(slots, values):
+        y[slot] = value
+    known = [i for i in range(n) if y[i] is not None]
+    if mode == "previous":
+        for i in range(1, n):
+            if y[i] is None:
+                y[i] = y[i - 1]
+    elif mode == "linear":
+        for a, b in zip(known, known[1:]):
+            for i in range(a + 1, b):
+                y[i] = y[a] + (y[b] - y[a]) * (i - a) / (b - a)
+    return y
@@ -0,0 +1,362 @@
+"""
+app/ingest.py
+Pipeline de ingesta *write-behind* entre los callbacks MQTT y TimescaleDB.
+
+Los callbacks sólo encolan las filas extraídas de cada uplink en una cola
+acotada; un hilo escritor las agrupa y las vuelca por lotes a través del
+sink configurado (app/sinks.py), cuando se alcanza INGEST_BATCH_SIZE filas o
+cuando han pasado INGEST_FLUSH_INTERVAL segundos desde la primera fila
+pendiente.
+
+Si la cola está llena, `submit` bloquea al productor hasta INGEST_PUT_TIMEOUT
+segundos (backpressure) y, si sigue llena, descarta el mensaje y lo contabiliza.
+
+Con SPOOL_DIR configurado (app/spool.py) no se pierde nada: lo que no cabe
+en la cola va directo al spool en disco sin bloquear al productor, los lotes
+cuyo volcado falla también, y un reproductor los vuelca cuando la BD
+responde.
+
+Tras cada volcado correcto se notifica a los *listeners* registrados con
+`add_listener` (caché de últimos valores, etc.) con las filas escritas.
+
+`AsyncIngestPipeline` es la variante asyncio (cola `asyncio.Queue` + tarea
+escritora) que usa el servicio de ingesta de app/ingest_service.py.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+from app.metrics import observe_commit
+from app.sinks import AsyncpgSink, Row, Sink, get_sink
+from app.spool import SPOOL_RETRY_MAX, Spool, get_spool, replay, replay_async
+from app.status import update_ingest
+
+# ───────────────────────── Config ────────────────────────── #
+
+QUEUE_SIZE: int = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))       # mensajes
+BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "5000"))        # filas
+FLUSH_INTERVAL: float = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+PUT_TIMEOUT: float = float(os.getenv("INGEST_PUT_TIMEOUT", "5"))
+
+logger = logging.getLogger("ingest")
+
+_STOP = object()
+
+_listeners: List[Callable[[Sequence[Row]], None]] = []
+
+
+def add_listener(fn: Callable[[Sequence[Row]], None]) -> None:
+    """Registra una función que recibe las filas de cada volcado confirmado."""
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def _notify(rows: Sequence[Row]) -> None:
+    for fn in _listeners:
+        try:
+            fn(rows)
+        except Exception as exc:
+            logger.exception("❌ Error en listener de ingesta %r: %s", fn, exc)
+
+
+class IngestPipeline:
+    """Cola acotada + hilo escritor que inserta por lotes en `sensor_data`."""
+
+    def __init__(self,
+                 sink: Optional[Sink] = None,
+                 queue_size: int = QUEUE_SIZE,
+                 batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 put_timeout: float = PUT_TIMEOUT,
+                 spool: Optional[Spool] = None):
+        self.sink = sink or get_sink()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spool = spool or get_spool()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._replayer: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    # ─────────────────────── Productores ─────────────────────── #
+
+    def submit(self, rows: Sequence[Row]) -> bool:
+        """
+        Encola las filas de un uplink. Devuelve False si la cola sigue llena
+        tras PUT_TIMEOUT segundos y el mensaje se descarta. Con spool no se
+        espera: si la cola está llena las filas van al disco.
+        """
+        if not rows:
+            return True
+        try:
+            if self.spool is not None:
+                self._queue.put_nowait(rows)
+            else:
+                self._queue.put(rows, timeout=self.put_timeout)
+        except queue.Full:
+            if self.spool is not None:
+                return self.spool.append(rows)
+            logger.warning("⚠️  Cola de ingesta llena: descartadas %d filas",
+                           len(rows))
+            update_ingest(dropped=len(rows))
+            return False
+        update_ingest(queue_depth=self._queue.qsize())
+        return True
+
+    # ──────────────────────── Escritor ───────────────────────── #
+
+    def start(self) -> "IngestPipeline":
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run,
+                                            name="ingest-writer",
+                                            daemon=True)
+            self._thread.start()
+        if self.spool is not None and (self._replayer is None
+                                       or not self._replayer.is_alive()):
+            self._stopping.clear()
+            self._replayer = threading.Thread(target=self._replay_loop,
+                                              name="ingest-replay",
+                                              daemon=True)
+            self._replayer.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Vacía la cola pendiente y detiene el hilo escritor."""
+        if self._replayer is not None:
+            self._stopping.set()
+            self._replayer.join(timeout)
+            self._replayer = None
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        if self.spool is not None:
+            self.spool.close()
+
+    def _run(self) -> None:
+        batch: List[Row] = []
+        deadline: Optional[float] = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+
+            if item:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.extend(item)
+
+            if batch and (len(batch) >= self.batch_size
+                          or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, batch: List[Row]) -> None:
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            self.sink.write(batch)
+        except Exception as exc:
+            logger.exception("❌ Error volcando lote de %d filas: %s",
+                             len(batch), exc)
+            update_ingest(errors=1, queue_depth=self._queue.qsize())
+            if self.spool is not None:
+                self.spool.append(batch)
+            return
+
+        elapsed = time.perf_counter() - started
+        update_ingest(rows=len(batch), flush_ms=elapsed * 1000,
+                      queue_depth=self._queue.qsize())
+        observe_commit(batch, elapsed)
+        _notify(batch)
+
+    # ─────────────────────── Reproductor ─────────────────────── #
+
+    def _write_replayed(self, rows: Sequence[Row]) -> None:
+        self.sink.write(rows)
+        _notify(rows)
+
+    def _replay_loop(self) -> None:
+        """Vacía el spool; reintenta con backoff exponencial si la BD falla."""
+        delay = 1.0
+        while not self._stopping.wait(delay):
+            if not self.spool.pending():
+                continue
+            try:
+                count = replay(self.spool, self._write_replayed)
+            except Exception as exc:
+                delay = min(delay * 2, SPOOL_RETRY_MAX)
+                logger.warning("💾 Spool pendiente; reintento en %.0fs (%s)",
+                               delay, exc)
+                continue
+            delay = 1.0
+            if count:
+                logger.info("💾 Reproducidas %d filas del spool", count)
+
+
+class AsyncIngestPipeline:
+    """Cola acotada + tarea escritora asyncio con las mismas reglas de volcado."""
+
+    def __init__(self,
+                 sink: AsyncpgSink,
+                 queue_size: int = QUEUE_SIZE,
+                 batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 put_timeout: float = PUT_TIMEOUT,
+                 spool: Optional[Spool] = None):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spool = spool or get_spool()
+        self._queue: "asyncio.Queue" = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._replayer: Optional[asyncio.Task] = None
+
+    async def submit(self, rows: Sequence[Row]) -> bool:
+        """
+        Encola las filas de un uplink esperando hasta PUT_TIMEOUT segundos
+        (con spool no se espera: si la cola está llena van al disco).
+        """
+        if not rows:
+            return True
+        try:
+            if self.spool is not None:
+                self._queue.put_nowait(rows)
+            else:
+                await asyncio.wait_for(self._queue.put(rows), self.put_timeout)
+        except (asyncio.TimeoutError, asyncio.QueueFull):
+            if self.spool is not None:
+                # append + fsync en un hilo: no bloquean el bucle
+                return await asyncio.to_thread(self.spool.append, rows)
+            logger.warning("⚠️  Cola de ingesta llena: descartadas %d filas",
+                           len(rows))
+            update_ingest(dropped=len(rows))
+            return False
+        update_ingest(queue_depth=self._queue.qsize())
+        return True
+
+    def start(self) -> "AsyncIngestPipeline":
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="ingest-writer")
+        if self.spool is not None and (self._replayer is None
+                                       or self._replayer.done()):
+            self._replayer = asyncio.create_task(self._replay_loop(),
+                                                 name="ingest-replay")
+        return self
+
+    async def stop(self) -> None:
+        """Vacía la cola pendiente y detiene la tarea escritora."""
+        if self._replayer is not None:
+            self._replayer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._replayer
+            self._replayer = None
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        if self.spool is not None:
+            await asyncio.to_thread(self.spool.close)
+
+    async def _run(self) -> None:
+        batch: List[Row] = []
+        deadline: Optional[float] = None
+        loop = asyncio.get_running_loop()
+
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is _STOP:
+                await self._flush(batch)
+                return
+
+            if item:
+                if not batch:
+                    deadline = loop.time() + self.flush_interval
+                batch.extend(item)
+
+            if batch and (len(batch) >= self.batch_size
+                          or loop.time() >= deadline):
+                await self._flush(batch)
+                batch = []
+                deadline = None
+
+    async def _flush(self, batch: List[Row]) -> None:
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            await self.sink.write(batch)
+        except Exception as exc:
+            logger.exception("❌ Error volcando lote de %d filas: %s",
+                             len(batch), exc)
+            update_ingest(errors=1, queue_depth=self._queue.qsize())
+            if self.spool is not None:
+                await asyncio.to_thread(self.spool.append, batch)
+            return
+
+        elapsed = time.perf_counter() - started
+        update_ingest(rows=len(batch), flush_ms=elapsed * 1000,
+                      queue_depth=self._queue.qsize())
+        observe_commit(batch, elapsed)
+        _notify(batch)
+
+    async def _write_replayed(self, rows: Sequence[Row]) -> None:
+        await self.sink.write(rows)
+        _notify(rows)
+
+    async def _replay_loop(self) -> None:
+        """Vacía el spool; reintenta con backoff exponencial si la BD falla."""
+        delay = 1.0
+        while True:
+            await asyncio.sleep(delay)
+            if not self.spool.pending():
+                continue
+            try:
+                count = await replay_async(self.spool, self._write_replayed)
+            except Exception as exc:
+                delay = min(delay * 2, SPOOL_RETRY_MAX)
+                logger.warning("💾 Spool pendiente; reintento en %.0fs (%s)",
+                               delay, exc)
+                continue
+            delay = 1.0
+            if count:
+                logger.info("💾 Reproducidas %d filas del spool", count)
+
+
+_pipeline: Optional[IngestPipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline() -> IngestPipeline:
+    """Devuelve el pipeline del proceso, arrancando el escritor la 1ª vez."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = IngestPipeline().start()
+        return _pipeline
@@ -0,0 +1,272 @@
+"""
+app/ingest_service.py
+Servicio único de ingesta MQTT → TimescaleDB.
+
+Se arranca en UN solo sitio, elegido con INGEST_MODE:
+
+    lifespan    → tarea del *lifespan* de FastAPI (app/main.py); sólo para
+                  despliegues con un único proceso de API (uvicorn en dev)
+    standalone  → proceso propio: `python -m app.ingest_service`
+    off         → no se ingiere nada desde este contenedor
+
+INGEST_BACKEND elige la implementación:
+
+    asyncio → cliente MQTT asíncrono (aiomqtt) + pool de asyncpg con COPY
+    paho    → cliente paho + workers + escritor por lotes (app/mqtt_client.py)
+
+Además, el backend asyncio toma un *advisory lock* de PostgreSQL antes de
+suscribirse: si por error hubiera dos instancias activas, la segunda espera
+en reserva en lugar de duplicar cada uplink.
+
+Escalado horizontal: con MQTT_SHARE_GROUP la suscripción es compartida
+(MQTT v5, `$share/<grupo>/…`) y el broker reparte los uplinks entre todas
+las instancias del grupo, así que no se toma el lock y pueden correr a la
+vez varios contenedores. INGEST_PROCESSES=N (requiere el grupo) hace de
+este proceso un supervisor *pre-fork*: lanza N procesos de ingesta, cada
+uno con su cliente MQTT, su pool de BD, su puerto de métricas
+(INGEST_METRICS_PORT + i) y su subdirectorio de spool, y los relanza si
+mueren. Los duplicados que el broker entregue a instancias distintas los
+descarta el índice único de la tabla (ON CONFLICT DO NOTHING).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+import ssl
+import subprocess
+import sys
+import threading
+import time
+
+import aiomqtt
+import asyncpg
+
+from app import cache, ingest, metrics, migrations, push, retention, rules
+from app.database import DATABASE_URL
+from app.decoder import decode_uplink, uplink_rows
+from app.dedup import new_window, uplink_key
+from app.ingest import AsyncIngestPipeline
+from app.mqtt_client import (
+    BROKER, CA_FILE, CERT_FILE, KEEPALIVE, KEY_FILE, MAX_DELAY, MQTT_PASSWORD,
+    MQTT_SHARE_GROUP, MQTT_USER, PORT, RETRY_DELAY, run as mqtt_run, subscription,
+)
+from app.sinks import AsyncpgSink
+from app.status import update as update_status
+from app.status import update_ingest
+
+# ───────────────────────── Config ────────────────────────── #
+
+INGEST_MODE: str = os.getenv("INGEST_MODE", "standalone")   # lifespan|standalone|off
+INGEST_BACKEND: str = os.getenv("INGEST_BACKEND", "asyncio")  # asyncio|paho
+
+DB_POOL_MIN: int = int(os.getenv("INGEST_DB_POOL_MIN", "1"))
+DB_POOL_MAX: int = int(os.getenv("INGEST_DB_POOL_MAX", "4"))
+LOCK_ID: int = int(os.getenv("INGEST_LOCK_ID", "7310421"))
+INGEST_PROCESSES: int = int(os.getenv("INGEST_PROCESSES", "1"))     # >1 → supervisor pre-fork
+WORKER_INDEX: int = int(os.getenv("INGEST_WORKER_INDEX", "0"))      # lo fija el supervisor
+
+logger = logging.getLogger("ingest_service")
+
+
+class IngestService:
+    """Bucle asyncio: aiomqtt → decoder → AsyncIngestPipeline → asyncpg."""
+
+    def __init__(self):
+        self._pool = None
+        self._pipeline = None
+        self._lock_conn = None
+        self._dedup = new_window()
+        self._rules = rules.new_filter()
+
+    def _tls_params(self):
+        if all(os.path.exists(p) for p in (CA_FILE, CERT_FILE, KEY_FILE)):
+            logger.info("🔐 TLS habilitado (CA=%s)", CA_FILE)
+            return aiomqtt.TLSParameters(ca_certs=CA_FILE,
+                                         certfile=CERT_FILE,
+                                         keyfile=KEY_FILE,
+                                         tls_version=ssl.PROTOCOL_TLSv1_2)
+        logger.warning("⚠️  TLS deshabilitado: no se encontraron todos los ficheros")
+        return None
+
+    async def _acquire_lock(self) -> None:
+        """Espera hasta ser la única instancia de ingesta activa."""
+        self._lock_conn = await self._pool.acquire()
+        while not await self._lock_conn.fetchval(
+                "SELECT pg_try_advisory_lock($1)", LOCK_ID):
+            logger.warning("⏸️  Otra instancia de ingesta está activa; en reserva…")
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def run(self) -> None:
+        self._pool = await asyncpg.create_pool(DATABASE_URL,
+                                               min_size=DB_POOL_MIN,
+                                               max_size=DB_POOL_MAX)
+        self._pipeline = AsyncIngestPipeline(AsyncpgSink(self._pool)).start()
+        try:
+            if not MQTT_SHARE_GROUP:        # con grupo, el broker reparte
+                await self._acquire_lock()
+            await self._consume()
+        finally:
+            await self._pipeline.stop()
+            if self._lock_conn is not None:
+                await self._pool.release(self._lock_conn)
+            await self._pool.close()
+
+    async def _consume(self) -> None:
+        delay = RETRY_DELAY
+        tls_params = self._tls_params()
+        connected_once = False
+
+        while True:
+            try:
+                logger.info("🌐 Conectando a %s:%s …", BROKER, PORT)
+                async with aiomqtt.Client(BROKER, PORT,
+                                          username=MQTT_USER or None,
+                                          password=MQTT_PASSWORD or None,
+                                          keepalive=KEEPALIVE,
+                                          tls_params=tls_params,
+                                          protocol=(aiomqtt.ProtocolVersion.V5
+                                                    if MQTT_SHARE_GROUP else
+                                                    aiomqtt.ProtocolVersion.V311),
+                                          logger=logger) as client:
+                    logger.info("🟢 Conectado al broker")
+                    update_status(connected=True, rc=0)
+                    if connected_once:
+                        metrics.mqtt_reconnects.inc()
+                    connected_once = True
+                    delay = RETRY_DELAY
+                    await client.subscribe(subscription())
+                    logger.info("📡 Subscrito a ‘%s’", subscription())
+
+                    async for message in client.messages:
+                        metrics.messages_received.inc(
+                            1, metrics.application(message.topic.value))
+                        await self._handle(message.topic.value, message.payload)
+            except aiomqtt.MqttError as exc:
+                logger.error("❌ Conexión perdida: %s", exc)
+                update_status(connected=False, rc=getattr(exc, "rc", None))
+                logger.info("↻ Reintentando en %s s…", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_DELAY)     # back-off exponencial
+
+    async def _handle(self, topic: str, payload: bytes) -> None:
+        try:
+            with metrics.parse_seconds.time():
+                up = decode_uplink(payload)
+            metrics.messages_parsed.inc(1, metrics.application(topic))
+            if (self._dedup is not None
+                    and self._dedup.seen(uplink_key(up, payload), up.time)):
+                update_ingest(duplicates=1)
+                return
+            rows = uplink_rows(up, self._rules)
+        except Exception as exc:
+            metrics.parse_errors.inc()
+            logger.exception("❌ Error procesando mensaje: %s", exc)
+            return
+        await self._pipeline.submit(rows)
+
+
+# ──────────────────────── Arranque ─────────────────────────── #
+
+def start_background() -> tuple:
+    """
+    Arranca la ingesta dentro del proceso actual (modo lifespan).
+    Devuelve (tarea asyncio | hilo paho) para poder pararla.
+    """
+    if INGEST_BACKEND == "paho":
+        thread = threading.Thread(target=mqtt_run, name="mqtt", daemon=True)
+        thread.start()
+        return None, thread
+    return asyncio.create_task(IngestService().run(), name="ingest"), None
+
+
+def _spawn(index: int) -> subprocess.Popen:
+    env = dict(os.environ, INGEST_PROCESSES="1", INGEST_WORKER_INDEX=str(index))
+    if metrics.METRICS_PORT:
+        env["INGEST_METRICS_PORT"] = str(metrics.METRICS_PORT + index)
+    if os.getenv("SPOOL_DIR"):
+        env["SPOOL_DIR"] = os.path.join(os.environ["SPOOL_DIR"], str(index))
+    return subprocess.Popen([sys.executable, "-m", "app.ingest_service"], env=env)
+
+
+def supervise(processes: int) -> int:
+    """
+    Supervisor pre-fork: N procesos de ingesta independientes (intérpretes
+    nuevos, sin heredar hilos ni bucles), relanzados si terminan. SIGTERM o
+    SIGINT los paran a todos.
+    """
+    stopping = threading.Event()
+
+    def stop(signum, _frame):
+        logger.info("⏹️  Señal %s – parando %d procesos de ingesta…", signum, processes)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    children = {i: _spawn(i) for i in range(processes)}
+    logger.info("👥 %d procesos de ingesta en el grupo ‘%s’ (pids %s)", processes,
+                MQTT_SHARE_GROUP, ", ".join(str(p.pid) for p in children.values()))
+    while not stopping.wait(1.0):
+        for i, child in children.items():
+            if child.poll() is not None:
+                logger.error("❌ Proceso de ingesta %d terminó (rc=%s); relanzando en %s s",
+                             i, child.returncode, RETRY_DELAY)
+                time.sleep(RETRY_DELAY)
+                children[i] = _spawn(i)
+
+    for child in children.values():
+        child.terminate()
+    for child in children.values():
+        try:
+            child.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            child.kill()
+    return 0
+
+
+def main() -> int:
+    if INGEST_MODE != "standalone":
+        logger.error("⛔ INGEST_MODE=%s: la ingesta no se ejecuta como proceso "
+                     "independiente (evita ingerir cada uplink dos veces)",
+                     INGEST_MODE)
+        return 1
+    if INGEST_PROCESSES > 1 and not MQTT_SHARE_GROUP:
+        logger.error("⛔ INGEST_PROCESSES=%d requiere MQTT_SHARE_GROUP (si no, "
+                     "cada proceso recibiría todos los uplinks)", INGEST_PROCESSES)
+        return 1
+    try:
+        rules.ruleset()             # fallar al arrancar, no en cada worker
+    except (OSError, ValueError) as exc:
+        logger.error("⛔ Reglas de ingesta no válidas: %s", exc)
+        return 1
+
+    migrations.upgrade()
+    if INGEST_PROCESSES > 1:
+        return supervise(INGEST_PROCESSES)
+
+    logger.info("🚀 Servicio de ingesta (backend=%s%s)", INGEST_BACKEND,
+                f", grupo={MQTT_SHARE_GROUP} #{WORKER_INDEX}" if MQTT_SHARE_GROUP else "")
+    if metrics.serve():
+        logger.info("📈 Métricas en :%d/metrics", metrics.METRICS_PORT)
+    if cache.SHARED:                # marcas de agua para la caché de la API
+        ingest.add_listener(cache.on_commit)
+        cache.start()
+    if push.SHARED:                 # filas nuevas para /subscribe/* de la API
+        ingest.add_listener(push.Publisher())
+    if WORKER_INDEX == 0:           # con pre-fork basta un planificador
+        retention.start()
+    if INGEST_BACKEND == "paho":
+        mqtt_run()
+        return 0
+    try:
+        asyncio.run(IngestService().run())
+    except KeyboardInterrupt:
+        logger.info("⏹️  CTRL-C – cerrando servicio de ingesta…")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,5 @@
-from app.database import engine
-from app.models import Base
+from app.migrations import upgrade
 
-print("🛠️ Creando tablas en la base de datos...")
-Base.metadata.create_all(bind=engine)
-print("✅ Tablas creadas correctamente.")
+print("🛠️ Aplicando migraciones en la base de datos...")
+upgrade()
+print("✅ Esquema actualizado correctamente.")
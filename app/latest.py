@@ -0,0 +1,171 @@
+"""
+app/latest.py
+Últimos valores por (device_id, key) para los endpoints `latest_measurements*`.
+
+LATEST_CACHE elige de dónde se sirven:
+
+    memory → diccionario en memoria que actualiza la ingesta tras cada
+             volcado (listener de app/ingest.py). La consulta GROUP BY sobre
+             `sensor_data` sólo se usa una vez, para calentar la caché.
+             Requiere que la ingesta corra en este proceso (INGEST_MODE=lifespan).
+    table  → la ingesta hace UPSERT en `sensor_latest` dentro de la misma
+             transacción del lote; la API lee esa tabla por clave primaria.
+             Sobrevive a reinicios y se comparte entre workers.
+
+Por defecto: `memory` si la ingesta va en el lifespan de la API, `table` si no.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import threading
+from typing import Dict, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app import dictionary, models
+
+LATEST_CACHE: str = os.getenv(
+    "LATEST_CACHE",
+    "memory" if os.getenv("INGEST_MODE", "standalone") == "lifespan" else "table",
+)
+
+logger = logging.getLogger("latest")
+
+Latest = Tuple[float, dt.datetime]          # (value, timestamp)
+Row = Tuple[str, str, float, dt.datetime]   # igual que app.sinks.Row
+
+
+def reduce_latest(rows: Sequence[Row]) -> Dict[Tuple[str, str], Latest]:
+    """Último (value, ts) de cada (device_id, key) dentro de un lote."""
+    out: Dict[Tuple[str, str], Latest] = {}
+    for device_id, key, value, ts in rows:
+        cur = out.get((device_id, key))
+        if cur is None or ts >= cur[1]:
+            out[(device_id, key)] = (value, ts)
+    return out
+
+
+# ──────────────────────── Caché en memoria ──────────────────────── #
+
+class LatestCache:
+    """`{device_id: {key: (value, timestamp)}}` protegido por un lock."""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Latest]] = {}
+        self._lock = threading.Lock()
+        self._warm = False
+
+    def update(self, rows: Sequence[Row]) -> None:
+        """Listener de ingesta: aplica sólo valores iguales o más recientes."""
+        latest = reduce_latest(rows)
+        with self._lock:
+            for (device_id, key), (value, ts) in latest.items():
+                keys = self._data.setdefault(device_id, {})
+                cur = keys.get(key)
+                if cur is None or ts >= cur[1]:
+                    keys[key] = (value, ts)
+
+    def warmup(self, db: Session) -> None:
+        """Carga en frío desde `sensor_data` (una sola vez por proceso)."""
+        if self._warm:
+            return
+        sd = models.SensorData
+        subq = (
+            db.query(sd.device_ref, sd.key_ref,
+                     func.max(sd.timestamp).label("max_ts"))
+            .group_by(sd.device_ref, sd.key_ref)
+            .subquery()
+        )
+        rows = (
+            db.query(models.SensorDevice.dev_eui, models.SensorKey.name,
+                     sd.value, sd.timestamp)
+            .join(subq,
+                  (sd.device_ref == subq.c.device_ref)
+                  & (sd.key_ref == subq.c.key_ref)
+                  & (sd.timestamp == subq.c.max_ts))
+            .join(models.SensorDevice, models.SensorDevice.id == sd.device_ref)
+            .join(models.SensorKey, models.SensorKey.id == sd.key_ref)
+            .all()
+        )
+        self.update(rows)
+        self._warm = True
+        logger.info("🔥 Caché de últimos valores calentada (%d series)", len(rows))
+
+    def device(self, device_id: str) -> Dict[str, Latest]:
+        with self._lock:
+            return dict(self._data.get(device_id, {}))
+
+    def all(self) -> Dict[str, Dict[str, Latest]]:
+        with self._lock:
+            return {d: dict(keys) for d, keys in self._data.items()}
+
+
+cache = LatestCache()
+
+
+# ──────────────────────── Lectura para la API ──────────────────────── #
+
+def for_device(db: Session, device_id: str) -> Dict[str, Latest]:
+    """Último valor de cada key de un dispositivo."""
+    if LATEST_CACHE == "memory":
+        cache.warmup(db)
+        return cache.device(device_id)
+    device_ref = dictionary.devices.lookup(device_id, conn=db)
+    if device_ref is None:
+        return {}
+    sl = models.SensorLatest
+    rows = (
+        db.query(sl.key_ref, sl.value, sl.timestamp)
+        .filter(sl.device_ref == device_ref)
+        .all()
+    )
+    return {dictionary.keys.name(k, conn=db): (value, ts) for k, value, ts in rows}
+
+
+def for_all(db: Session) -> Dict[str, Dict[str, Latest]]:
+    """Último valor de cada (device_id, key) de toda la tabla."""
+    if LATEST_CACHE == "memory":
+        cache.warmup(db)
+        return cache.all()
+    sl = models.SensorLatest
+    out: Dict[str, Dict[str, Latest]] = {}
+    for device_id, key, value, ts in (
+            db.query(models.SensorDevice.dev_eui, models.SensorKey.name,
+                     sl.value, sl.timestamp)
+            .join(models.SensorDevice, models.SensorDevice.id == sl.device_ref)
+            .join(models.SensorKey, models.SensorKey.id == sl.key_ref)):
+        out.setdefault(device_id, {})[key] = (value, ts)
+    return out
+
+
+# ─────────────────────── UPSERT desde los sinks ─────────────────────── #
+
+PERSIST: bool = LATEST_CACHE == "table"
+
+_UPSERT = """
+    INSERT INTO sensor_latest (device_ref, key_ref, value, timestamp)
+    SELECT * FROM unnest(CAST({devices} AS int[]), CAST({keys} AS int[]),
+                         CAST({values} AS float8[]), CAST({stamps} AS timestamptz[]))
+    ON CONFLICT (device_ref, key_ref) DO UPDATE
+        SET value = EXCLUDED.value, timestamp = EXCLUDED.timestamp
+        WHERE sensor_latest.timestamp <= EXCLUDED.timestamp
+"""
+UPSERT_ORM = _UPSERT.format(devices=":devices", keys=":keys",
+                            values=":values", stamps=":stamps")
+UPSERT_PSYCOPG = _UPSERT.format(devices="%s", keys="%s", values="%s", stamps="%s")
+UPSERT_ASYNCPG = _UPSERT.format(devices="$1", keys="$2", values="$3", stamps="$4")
+
+
+def upsert_params(refs: Sequence[tuple]) -> Tuple[list, list, list, list]:
+    """Arrays columnares (device_refs, key_refs, values, stamps) para `unnest`."""
+    latest = reduce_latest(refs)
+    return (
+        [d for d, _ in latest],
+        [k for _, k in latest],
+        [float(v) for v, _ in latest.values()],
+        [ts for _, ts in latest.values()],
+    )
@@ -1,36 +1,99 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import operator
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
-from fastapi import Depends, FastAPI, Query
+from fastapi import Depends, FastAPI, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy import exc as sa_exc
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
 
-from app import models
-from app.database import Base, engine, get_db
-from app.schemas import SensorDataResponse
-from app.status import mqtt_status
+from app import (
+    archive, cache, database, dictionary, downsample, export, gapfill, ingest,
+    ingest_service, latest, metrics, migrations, models, pagination, push,
+    retention, rollups, streaming,
+)
+from app.database import get_read_db
+from app.schemas import (
+    BatchAggregateRequest, SensorDataResponse, SensorLatestResponse, SensorSeriesResponse,
+)
+from app.status import ingest_status, mqtt_status
 
 # --------------------------------------------------------------------------- #
 #  Preparación de la base de datos
 # --------------------------------------------------------------------------- #
 
-Base.metadata.create_all(bind=engine)
+migrations.upgrade()
 
 # --------------------------------------------------------------------------- #
 #  FastAPI
 # --------------------------------------------------------------------------- #
 
-app = FastAPI(title="ChirpStack Listener API", version="1.0.0")
-
+@contextlib.asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Arranca la ingesta MQTT dentro del proceso de la API sólo si
+    INGEST_MODE=lifespan; en modo standalone la ejecuta
+    `python -m app.ingest_service` y aquí no se lanza nada.
+    """
+    task = thread = None
+    cache.start()
+    retention.start()
+    relay = push.start()
+    if ingest_service.INGEST_MODE == "lifespan":
+        if latest.LATEST_CACHE == "memory":
+            ingest.add_listener(latest.cache.update)
+        ingest.add_listener(cache.on_commit)
+        ingest.add_listener(push.on_commit)
+        task, thread = ingest_service.start_background()
+    try:
+        yield
+    finally:
+        retention.stop()
+        push.hub.close()
+        for background in (task, relay):
+            if background is not None:
+                background.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await background
+        await database.dispose()
+
+
+app = FastAPI(title="ChirpStack Listener API", version="1.0.0",
+              lifespan=lifespan)
+
+app.add_middleware(cache.CacheMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_HEADER],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.exception_handler(sa_exc.TimeoutError)
+async def pool_exhausted(_request, _exc):
+    """Sin conexiones libres en el pool tras DB_POOL_TIMEOUT segundos."""
+    return JSONResponse(status_code=503,
+                        content={"error": "Database busy, retry later."})
+
+
+@app.exception_handler(sa_exc.DBAPIError)
+async def database_error(_request, exc):
+    """`statement_timeout` superado → 504; el resto sigue siendo un 500."""
+    if getattr(exc.orig, "pgcode", None) == "57014":       # query_canceled
+        return JSONResponse(status_code=504,
+                            content={"error": "Query timed out."})
+    raise exc
 
 # --------------------------------------------------------------------------- #
 #  Endpoints básicos
@@ -38,13 +101,13 @@ app.add_middleware(
 
 
 @app.get("/health")
-def health():
+async def health():
     """Comprueba que el servicio FastAPI está vivo."""
     return {"status": "running"}
 
 
 @app.get("/mqtt_status")
-def mqtt_state():
+async def mqtt_state():
     """
     Devuelve el estado del cliente MQTT.
     connected : bool
@@ -54,242 +117,395 @@ def mqtt_state():
     return mqtt_status
 
 
+@app.get("/ingest_status")
+async def ingest_state():
+    """
+    Devuelve las métricas del pipeline de ingesta por lotes.
+    queue_depth   : int   (mensajes pendientes de volcar)
+    rows_written  : int
+    flushes       : int
+    last_flush_ms : float (latencia del último volcado)
+    max_flush_ms  : float
+    dropped_rows  : int   (descartadas por cola o spool llenos)
+    flush_errors  : int
+    spooled_rows  : int   (filas desviadas al spool en disco)
+    replayed_rows : int   (filas del spool ya volcadas)
+    spool_bytes   : int   (tamaño pendiente del spool)
+    duplicates_dropped : int (uplinks/filas duplicados descartados)
+    """
+    return ingest_status
+
+
+@app.get("/retention_status")
+async def retention_state(db: AsyncSession = Depends(get_read_db)):
+    """
+    Políticas de retención (app/retention.py), última pasada y almacenamiento:
+    tamaño de la tabla, chunks comprimidos y tramos archivados en Parquet.
+    """
+    return await db.run_sync(retention.status)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas en formato Prometheus (app/metrics.py)."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # --------------------------------------------------------------------------- #
 #  Endpoints de mediciones simples
 # --------------------------------------------------------------------------- #
 
 
+def _lookup_refs(db: Session, device_id: str, key: Optional[str] = None):
+    device_ref = dictionary.devices.lookup(device_id, conn=db)
+    if key is None:
+        return device_ref, None
+    key_ref = dictionary.keys.lookup(key, conn=db)
+    return device_ref, key_ref
+
+
+async def _series_refs(db: AsyncSession, device_id: str, key: Optional[str] = None):
+    """(device_ref, key_ref) de los filtros; None si alguno no existe."""
+    return await db.run_sync(_lookup_refs, device_id, key)
+
+
 @app.get("/data/", response_model=List[SensorDataResponse])
-def read_sensor_data(limit: int = 100, db: Session = Depends(get_db)):
-    """Devuelve las N últimas filas de sensor_data."""
-    return (
-        db.query(models.SensorData)
-        .order_by(models.SensorData.timestamp.desc())
-        .limit(limit)
-        .all()
+async def read_sensor_data(
+    response: Response,
+    limit: int = Query(100, ge=1, le=pagination.PAGE_MAX_ROWS),
+    cursor: Optional[str] = None,
+    stream: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Devuelve las N últimas filas de sensor_data (`stream=ndjson|array`, sólo
+    de la tabla). Las más antiguas se piden con el `cursor` de la cabecera
+    X-Next-Cursor (ver app/pagination.py); al acabarse la tabla las páginas
+    siguen por los tramos archivados en Parquet.
+    """
+    if (error := streaming.invalid(stream)) is not None:
+        return error
+    if (error := pagination.invalid(cursor)) is not None:
+        return error
+    sd = models.SensorData
+    stmt = (
+        select(sd.id,
+               models.SensorDevice.dev_eui.label("device_id"),
+               models.SensorKey.name.label("key"),
+               sd.value, sd.timestamp)
+        .join(models.SensorDevice, models.SensorDevice.id == sd.device_ref)
+        .join(models.SensorKey, models.SensorKey.id == sd.key_ref)
+        .order_by(sd.timestamp.desc(), sd.id.desc())
     )
+    after = pagination.decode(cursor) if cursor is not None else None
+    if after is not None:
+        stmt = stmt.where(tuple_(sd.timestamp, sd.id) < tuple_(after.timestamp, after.id))
+    if stream:
+        return streaming.respond(stream, stmt.limit(limit), lambda row: row._asdict())
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    # Del archivo sólo puede entrar lo posterior a la última fila de la tabla
+    archived = await archive.read_page(
+        db, None, None, rows[-1].timestamp if len(rows) > limit else None,
+        after.timestamp if after else None, after, limit + 1,
+        ("id", "device_ref", "key_ref", "value", "timestamp"), descending=True)
+    if archived:
+        devices, keys = await db.run_sync(lambda conn: (
+            {ref: dictionary.devices.name(ref, conn=conn) for ref in {r[1] for r in archived}},
+            {ref: dictionary.keys.name(ref, conn=conn) for ref in {r[2] for r in archived}}))
+        key = operator.itemgetter("timestamp", "id")
+        rows = itertools.islice(heapq.merge(
+            [row._asdict() for row in rows],
+            [{"id": id_, "device_id": devices[d], "key": keys[k], "value": value,
+              "timestamp": ts} for id_, d, k, value, ts in archived],
+            key=key, reverse=True), limit + 1)
+    else:
+        key = operator.attrgetter("timestamp", "id")
+    rows, token = pagination.page(rows, limit, key)
+    if token is not None:
+        response.headers[pagination.NEXT_HEADER] = token
+    return metrics.returned(rows)
 
 
 @app.get("/measurements/", response_model=List[SensorDataResponse])
-def get_measurements(
+async def get_measurements(
+    response: Response,
     device_id: str,
     start: datetime,
     end: datetime,
-    db: Session = Depends(get_db),
+    stream: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.PAGE_MAX_ROWS),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """Filtra mediciones de un dispositivo entre dos fechas."""
-    return (
-        db.query(models.SensorData)
-        .filter(models.SensorData.device_id == device_id)
-        .filter(models.SensorData.timestamp.between(start, end))
-        .all()
-    )
-
-
-@app.get("/latest_measurements/", response_model=List[SensorDataResponse])
-def get_latest_measurements(device_id: str, db: Session = Depends(get_db)):
-    """Último valor de cada ‘key’ de un dispositivo."""
-    subq = (
-        db.query(
-            models.SensorData.key,
-            func.max(models.SensorData.timestamp).label("max_ts"),
-        )
-        .filter(models.SensorData.device_id == device_id)
-        .group_by(models.SensorData.key)
-        .subquery()
-    )
-
-    return (
-        db.query(models.SensorData)
-        .join(
-            subq,
-            (models.SensorData.key == subq.c.key)
-            & (models.SensorData.timestamp == subq.c.max_ts),
-        )
-        .filter(models.SensorData.device_id == device_id)
-        .all()
+    """
+    Mediciones de un dispositivo entre dos fechas, en orden cronológico y
+    por páginas de `limit` filas (PAGE_MAX_ROWS como mucho); la siguiente se
+    pide con el `cursor` de la cabecera X-Next-Cursor. `stream=ndjson|array`
+    entrega el rango completo sin paginar.
+    """
+    if (error := streaming.invalid(stream)) is not None:
+        return error
+    if (error := pagination.invalid(cursor)) is not None:
+        return error
+    if stream and (limit is not None or cursor is not None):
+        return JSONResponse(status_code=400, content={
+            "error": "limit and cursor cannot be combined with stream."})
+
+    def to_dict(row):
+        id_, key, value, ts = row
+        return {"id": id_, "device_id": device_id, "key": key,
+                "value": value, "timestamp": ts}
+
+    device_ref, _ = await _series_refs(db, device_id)
+    if device_ref is None:
+        return streaming.respond(stream, None, to_dict) if stream else []
+    sd = models.SensorData
+    stmt = (
+        select(sd.id, models.SensorKey.name, sd.value, sd.timestamp)
+        .join(models.SensorKey, models.SensorKey.id == sd.key_ref)
+        .where(sd.device_ref == device_ref)
+        .where(sd.timestamp.between(start, end))
     )
+    async def names(archived):
+        if not archived:
+            return archived
+        keys = await db.run_sync(lambda conn: {
+            ref: dictionary.keys.name(ref, conn=conn) for ref in {r[1] for r in archived}})
+        return [(id_, keys[ref], value, ts) for id_, ref, value, ts in archived]
+
+    columns = ("id", "key_ref", "value", "timestamp")
+    if stream:
+        archived = await names(await archive.read(db, [device_ref], None, start, end,
+                                                  columns))
+        return streaming.respond(stream, stmt, to_dict, archived)
+
+    def order(row):
+        return row[3], row[0]               # (timestamp, id)
+
+    after = pagination.decode(cursor) if cursor is not None else None
+    size = limit or pagination.PAGE_MAX_ROWS
+    if after is not None:
+        stmt = stmt.where(tuple_(sd.timestamp, sd.id) > tuple_(after.timestamp, after.id))
+    stmt = stmt.order_by(sd.timestamp.asc(), sd.id.asc()).limit(size + 1)
+    rows = (await db.execute(stmt)).all()
+    # Página del archivo con orden y límite; no más allá de la última fila de la tabla
+    archived = await names(await archive.read_page(
+        db, [device_ref], None,
+        max(rollups.as_utc(start), after.timestamp) if after else start,
+        rows[-1].timestamp if len(rows) > size else end, after, size + 1, columns))
+    if archived:
+        rows = heapq.merge(archived, rows, key=order)
+    rows, token = pagination.page(itertools.islice(rows, size + 1), size, order)
+    if token is not None:
+        response.headers[pagination.NEXT_HEADER] = token
+    return metrics.returned([to_dict(row) for row in rows])
+
+
+@app.get("/latest_measurements/", response_model=List[SensorLatestResponse])
+async def get_latest_measurements(device_id: str,
+                                  db: AsyncSession = Depends(get_read_db)):
+    """Último valor de cada ‘key’ de un dispositivo (caché app/latest.py)."""
+    values = await db.run_sync(latest.for_device, device_id)
+    return [
+        {"device_id": device_id, "key": key, "value": value, "timestamp": ts}
+        for key, (value, ts) in values.items()
+    ]
 
 
 @app.get("/latest_measurements_grouped/")
-def get_latest_measurements_grouped(device_id: str, db: Session = Depends(get_db)):
+async def get_latest_measurements_grouped(device_id: str,
+                                          db: AsyncSession = Depends(get_read_db)):
     """Último valor de cada ‘key’, agrupado por clave en el JSON."""
-    subq = (
-        db.query(
-            models.SensorData.key,
-            func.max(models.SensorData.timestamp).label("max_ts"),
-        )
-        .filter(models.SensorData.device_id == device_id)
-        .group_by(models.SensorData.key)
-        .subquery()
-    )
-
-    rows = (
-        db.query(models.SensorData)
-        .join(
-            subq,
-            (models.SensorData.key == subq.c.key)
-            & (models.SensorData.timestamp == subq.c.max_ts),
-        )
-        .filter(models.SensorData.device_id == device_id)
-        .all()
-    )
-
+    values = await db.run_sync(latest.for_device, device_id)
     return JSONResponse(
         content={
-            r.key: {"value": r.value, "timestamp": r.timestamp.isoformat()}
-            for r in rows
+            key: {"value": value, "timestamp": ts.isoformat()}
+            for key, (value, ts) in values.items()
         }
     )
 
 
-@app.get("/timeseries/", response_model=List[SensorDataResponse])
-def get_timeseries(
+@app.get("/timeseries/", response_model=List[SensorSeriesResponse])
+async def get_timeseries(
     device_id: str,
     key: str,
     start: datetime,
     end: datetime,
-    db: Session = Depends(get_db),
+    stream: Optional[str] = None,
+    max_points: Optional[int] = Query(None, ge=3),
+    method: str = "lttb",
+    fill: Optional[str] = None,
+    resolution: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """Serie temporal cruda de un sensor (sin agregación)."""
-    return (
-        db.query(models.SensorData)
-        .filter(
-            models.SensorData.device_id == device_id,
-            models.SensorData.key == key,
-            models.SensorData.timestamp.between(start, end),
+    """
+    Serie temporal cruda de un sensor (sin agregación). Con `max_points`
+    se reduce en el servidor (`method=lttb|minmax|avg`, ver app/downsample.py).
+    `fill=previous` (rejilla de `resolution` s) o `fill=step` reconstruyen
+    las series guardadas con banda muerta (ver app/gapfill.py).
+    """
+    if (error := streaming.invalid(stream)) is not None:
+        return error
+    if method not in downsample.METHODS:
+        return JSONResponse(status_code=400, content={
+            "error": "Invalid method. Use one of: lttb, minmax, avg."})
+    if fill is not None:
+        if fill not in gapfill.MODES:
+            return JSONResponse(status_code=400, content={
+                "error": "Invalid fill. Use one of: previous, step."})
+        if stream or max_points is not None:
+            return JSONResponse(status_code=400, content={
+                "error": "fill cannot be combined with stream or max_points."})
+        if fill == "previous" and resolution is None:
+            return JSONResponse(status_code=400, content={
+                "error": "fill=previous requires resolution (seconds)."})
+        if (fill == "previous"
+                and gapfill.grid_size(start, end, resolution) > gapfill.FILL_MAX_POINTS):
+            return JSONResponse(status_code=400, content={
+                "error": f"Too many points; max {gapfill.FILL_MAX_POINTS} per request."})
+
+    def to_dict(row):
+        id_, value, ts = row
+        return {"id": id_, "device_id": device_id, "key": key,
+                "value": value, "timestamp": ts}
+
+    device_ref, key_ref = await _series_refs(db, device_id, key)
+    if device_ref is None or key_ref is None:
+        return streaming.respond(stream, None, to_dict) if stream else []
+    if max_points is not None:
+        points = await downsample.downsample(
+            db, _INTERVALS, method, max_points, device_ref, key_ref, start, end)
+        return metrics.returned([to_dict(point) for point in points])
+    sd = models.SensorData
+    stmt = (
+        select(sd.id, sd.value, sd.timestamp)
+        .where(
+            sd.device_ref == device_ref,
+            sd.key_ref == key_ref,
+            sd.timestamp.between(start, end),
         )
-        .order_by(models.SensorData.timestamp.asc())
-        .all()
+        .order_by(sd.timestamp.asc())
     )
+    archived = await archive.read(db, [device_ref], [key_ref], start, end,
+                                  ("id", "value", "timestamp"))
+    if stream:
+        return streaming.respond(stream, stmt, to_dict, archived)
+    rows = (await db.execute(stmt)).all()
+    if archived:
+        # Filas atrasadas de un tramo ya archivado pueden quedar en la tabla
+        rows = heapq.merge(archived, rows, key=lambda row: row[2])
+    if fill is not None:
+        initial = await gapfill.seed(db, device_ref, key_ref, start)
+        rows = (gapfill.previous(list(rows), initial, start, end, resolution)
+                if fill == "previous" else
+                gapfill.staircase(list(rows), initial, start, end))
+    return metrics.returned([to_dict(row) for row in rows])
 
 # --------------------------------------------------------------------------- #
-#  Agregaciones con time-bucket (TimescaleDB)
+#  Agregaciones con time-bucket (rollups de TimescaleDB, ver app/rollups.py)
 # --------------------------------------------------------------------------- #
 
-_INTERVALS = {"hour": "1 hour", "day": "1 day", "week": "1 week"}
+_INTERVALS = rollups.INTERVALS
 
 
 @app.get("/timeseries/aggregated/")
-def get_aggregated_timeseries(
+async def get_aggregated_timeseries(
     device_id: str,
     key: str,
     start: datetime,
     end: datetime,
     interval: str = "hour",
-    db: Session = Depends(get_db),
+    fill: str = "none",
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """Media por intervalo (hour/day/week)."""
+    """Media por intervalo (hour/day/week); `fill` rellena los buckets vacíos."""
     if interval not in _INTERVALS:
         return {"error": "Invalid interval. Use one of: hour, day, week."}
-
-    sql = text("""
-        SELECT 
-            time_bucket(:interval, timestamp) AS bucket,
-            AVG(value) AS average
-        FROM sensor_data
-        WHERE device_id = :device_id AND key = :key AND timestamp BETWEEN :start AND :end
-        GROUP BY bucket
-        ORDER BY bucket
-    """)
-    result = db.execute(
-        sql,
-        {
-            "interval": _INTERVALS[interval],
-            "device_id": device_id,
-            "key": key,
-            "start": start,
-            "end": end,
-        }
-    )
+    if (error := gapfill.invalid(fill, start, end, _INTERVALS[interval].width)) is not None:
+        return error
+    device_ref, key_ref = await _series_refs(db, device_id, key)
+    if device_ref is None or key_ref is None:
+        return []
+
+    result = await rollups.aggregate_async(db, _INTERVALS, _INTERVALS[interval],
+                                          [device_ref], key_ref, start, end, fill)
+    metrics.add_returned(len(result))
     return [
-        {"timestamp": row[0].isoformat(), "average": row[1]} for row in result
+        {"timestamp": row[1].isoformat(), "average": row[2]} for row in result
     ]
 
 @app.get("/timeseries/aggregated/full/")
-def get_full_aggregated_timeseries(
+async def get_full_aggregated_timeseries(
     device_id: str,
     key: str,
     start: datetime,
     end: datetime,
     interval: str = "hour",
-    db: Session = Depends(get_db),
+    fill: str = "none",
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """Media, máximo y mínimo por intervalo."""
+    """Media, máximo y mínimo por intervalo; `fill` rellena los buckets vacíos."""
     if interval not in _INTERVALS:
         return {"error": "Invalid interval. Use one of: hour, day, week."}
-
-    sql = text("""
-        SELECT 
-            time_bucket(:interval, timestamp) AS bucket,
-            AVG(value) AS average,
-            MAX(value) AS maximum,
-            MIN(value) AS minimum
-        FROM sensor_data
-        WHERE device_id = :device_id AND key = :key AND timestamp BETWEEN :start AND :end
-        GROUP BY bucket
-        ORDER BY bucket
-    """)
-    result = db.execute(
-        sql,
-        {
-            "interval": _INTERVALS[interval],
-            "device_id": device_id,
-            "key": key,
-            "start": start,
-            "end": end,
-        }
-    )
+    if (error := gapfill.invalid(fill, start, end, _INTERVALS[interval].width)) is not None:
+        return error
+    device_ref, key_ref = await _series_refs(db, device_id, key)
+    if device_ref is None or key_ref is None:
+        return []
+
+    result = await rollups.aggregate_async(db, _INTERVALS, _INTERVALS[interval],
+                                          [device_ref], key_ref, start, end, fill)
+    metrics.add_returned(len(result))
     return [
         {
-            "timestamp": row[0].isoformat(),
-            "average": row[1],
-            "maximum": row[2],
-            "minimum": row[3],
+            "timestamp": row[1].isoformat(),
+            "average": row[2],
+            "maximum": row[3],
+            "minimum": row[4],
         }
         for row in result
     ]
 
 
 @app.get("/timeseries/aggregated/multi/")
-def get_multi_sensor_aggregated(
+async def get_multi_sensor_aggregated(
     device_ids: List[str] = Query(...),
     key: str = "",
     start: datetime = None,
     end: datetime = None,
     interval: str = "hour",
-    db: Session = Depends(get_db),
+    fill: str = "none",
+    layout: str = "rows",
+    db: AsyncSession = Depends(get_read_db),
 ):
+    """
+    Media, máximo y mínimo por intervalo de varios dispositivos. Con
+    `layout=columns` los buckets van alineados en columnas:
+    `{"timestamps": [...], "values": {device_id: {"average": [...], …}}}`.
+    """
     if interval not in _INTERVALS:
         return {"error": "Invalid interval. Use one of: hour, day, week."}
-
-    sql = text("""
-        SELECT 
-            device_id,
-            time_bucket(:interval, timestamp) AS bucket,
-            AVG(value) AS average,
-            MAX(value) AS maximum,
-            MIN(value) AS minimum
-        FROM sensor_data
-        WHERE device_id = ANY(:device_ids) AND key = :key AND timestamp BETWEEN :start AND :end
-        GROUP BY device_id, bucket
-        ORDER BY device_id, bucket
-    """)
-
-    result = db.execute(
-        sql,
-        {
-            "interval": _INTERVALS[interval],
-            "device_ids": device_ids,
-            "key": key,
-            "start": start,
-            "end": end,
-        }
-    )
-
+    if layout not in ("rows", "columns"):
+        return {"error": "Invalid layout. Use one of: rows, columns."}
+    if (error := gapfill.invalid(fill, start, end, _INTERVALS[interval].width,
+                                 len(device_ids))) is not None:
+        return error
+    device_refs, key_ref = await db.run_sync(
+        lambda conn: (dictionary.devices.resolve(device_ids, conn=conn),
+                      dictionary.keys.lookup(key, conn=conn)))
+    if not device_refs or key_ref is None:
+        return {"timestamps": [], "values": {}} if layout == "columns" else {}
+
+    result = await rollups.aggregate_async(db, _INTERVALS, _INTERVALS[interval],
+                                          list(device_refs.values()), key_ref, start, end, fill)
+    metrics.add_returned(len(result))
+
+    names = {ref: name for name, ref in device_refs.items()}
+    if layout == "columns":
+        return _columns(result, names)
     grouped = {}
     for row in result:
-        device = row[0]
+        device = names[row[0]]
         grouped.setdefault(device, []).append(
             {
                 "timestamp": row[1].isoformat(),
@@ -300,79 +516,170 @@ def get_multi_sensor_aggregated(
         )
     return grouped
 
-@app.get("/latest_measurements_all/", response_model=List[SensorDataResponse])
-def get_latest_measurements_all(db: Session = Depends(get_db)):
+
+def _columns(result, names):
+    """Filas (device_ref, bucket, avg, max, min) → buckets alineados por dispositivo."""
+    stamps = sorted({row[1] for row in result})
+    slot = {ts: i for i, ts in enumerate(stamps)}
+    # Todos los dispositivos resueltos, aunque no tengan filas en el rango
+    values = {
+        device: {name: [None] * len(stamps) for name in ("average", "maximum", "minimum")}
+        for device in names.values()
+    }
+    for device_ref, bucket, average, maximum, minimum in result:
+        columns = values[names[device_ref]]
+        i = slot[bucket]
+        columns["average"][i] = average
+        columns["maximum"][i] = maximum
+        columns["minimum"][i] = minimum
+    return {"timestamps": [ts.isoformat() for ts in stamps], "values": values}
+
+
+@app.post("/timeseries/aggregated/batch/")
+async def get_batch_aggregated(
+    request: BatchAggregateRequest,
+    db: AsyncSession = Depends(get_read_db),
+):
     """
-    Último valor de cada (device_id, key) en toda la tabla.
+    Media, máximo y mínimo por intervalo de varias series (device_id, key)
+    con un único rango, en una sola consulta. Responde
+    `{device_id: {key: [...]}}` con todas las series pedidas (lista vacía
+    si no existen o no tienen datos en el rango).
     """
-    subq = (
-        db.query(
-            models.SensorData.device_id,
-            models.SensorData.key,
-            func.max(models.SensorData.timestamp).label("max_ts"),
-        )
-        .group_by(models.SensorData.device_id, models.SensorData.key)
-        .subquery()
-    )
+    if request.interval not in _INTERVALS:
+        return {"error": "Invalid interval. Use one of: hour, day, week."}
+    if (error := gapfill.invalid(request.fill, request.start, request.end,
+                                 _INTERVALS[request.interval].width,
+                                 len(request.series))) is not None:
+        return error
+    device_refs, key_refs = await db.run_sync(
+        lambda conn: (
+            dictionary.devices.resolve({s.device_id for s in request.series}, conn=conn),
+            dictionary.keys.resolve({s.key for s in request.series}, conn=conn),
+        ))
 
-    return (
-        db.query(models.SensorData)
-        .join(
-            subq,
-            (models.SensorData.device_id == subq.c.device_id)
-            & (models.SensorData.key == subq.c.key)
-            & (models.SensorData.timestamp == subq.c.max_ts),
+    grouped = {}
+    points = {}     # (device_ref, key_ref) → lista de la respuesta
+    for s in request.series:
+        target = grouped.setdefault(s.device_id, {}).setdefault(s.key, [])
+        device_ref, key_ref = device_refs.get(s.device_id), key_refs.get(s.key)
+        if device_ref is not None and key_ref is not None:
+            points[device_ref, key_ref] = target
+
+    result = await rollups.aggregate_series_async(db, _INTERVALS,
+                                                  _INTERVALS[request.interval], list(points),
+                                                  request.start, request.end, request.fill)
+    metrics.add_returned(len(result))
+    for row in result:
+        points[row[0], row[1]].append(
+            {
+                "timestamp": row[2].isoformat(),
+                "average": row[3],
+                "maximum": row[4],
+                "minimum": row[5],
+            }
         )
-        .all()
-    )
+    return grouped
 
 
-@app.get("/latest_measurements_all_grouped/")
-def get_latest_measurements_all_grouped(db: Session = Depends(get_db)):
-    """
-    Último valor de cada key, agrupado por device_id.
-    """
-    subq = (
-        db.query(
-            models.SensorData.device_id,
-            models.SensorData.key,
-            func.max(models.SensorData.timestamp).label("max_ts"),
-        )
-        .group_by(models.SensorData.device_id, models.SensorData.key)
-        .subquery()
-    )
-
-    rows = (
-        db.query(models.SensorData)
-        .join(
-            subq,
-            (models.SensorData.device_id == subq.c.device_id)
-            & (models.SensorData.key == subq.c.key)
-            & (models.SensorData.timestamp == subq.c.max_ts),
-        )
-        .all()
-    )
+# --------------------------------------------------------------------------- #
+#  Envío en vivo (WebSocket / SSE, ver app/push.py)
+# --------------------------------------------------------------------------- #
 
-    # Construimos un dict de la forma { device_id: { key: { value, timestamp } } }
-    result = {}
-    for r in rows:
-        result.setdefault(r.device_id, {})[r.key] = {
-            "value": r.value,
-            "timestamp": r.timestamp.isoformat(),
-        }
+@app.get("/subscribe/sse")
+async def subscribe_sse(
+    device_id: List[str] = Query(None),
+    key: List[str] = Query(None),
+    policy: str = "drop",
+    buffer: int = Query(push.PUSH_BUFFER, ge=1),
+):
+    """Mediciones nuevas como Server-Sent Events (`data:` = array JSON)."""
+    if (error := push.invalid(policy)) is not None:
+        return error
+    sub = push.Subscriber(push.parse_filter(device_id), push.parse_filter(key),
+                          policy, buffer)
+    return StreamingResponse(push.sse(sub), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/subscribe/ws")
+async def subscribe_ws(
+    ws: WebSocket,
+    device_id: List[str] = Query(None),
+    key: List[str] = Query(None),
+    policy: str = "drop",
+    buffer: int = Query(push.PUSH_BUFFER, ge=1),
+):
+    """Mediciones nuevas por WebSocket (un array JSON por mensaje)."""
+    if (error := push.invalid(policy)) is not None:
+        await ws.close(code=1008 if error.status_code == 400 else 1013,
+                       reason=error.body.decode())
+        return
+    await ws.accept()
+    sub = push.Subscriber(push.parse_filter(device_id), push.parse_filter(key),
+                          policy, buffer)
+    await push.websocket(ws, sub)
 
-    return JSONResponse(content=result)
 
+# --------------------------------------------------------------------------- #
+#  Exportación columnar (Arrow IPC / Parquet / CSV)
+# --------------------------------------------------------------------------- #
 
+@app.get("/export/")
+async def export_timeseries(
+    device_ids: List[str] = Query(...),
+    keys: List[str] = Query(...),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    format: str = "arrow",
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Series crudas de varios dispositivos/keys en formato columnar."""
+    device_refs, key_refs = await db.run_sync(
+        lambda conn: (dictionary.devices.resolve(device_ids, conn=conn),
+                      dictionary.keys.resolve(keys, conn=conn)))
+    stmt, archived = None, []
+    if device_refs and key_refs:
+        stmt = export.query(device_refs.values(), key_refs.values(), start, end)
+        archived = await archive.read(db, device_refs.values(), key_refs.values(),
+                                      start, end,
+                                      ("device_ref", "key_ref", "timestamp", "value"))
+    return export.respond(
+        format,
+        stmt,
+        {ref: name for name, ref in device_refs.items()},
+        {ref: name for name, ref in key_refs.items()},
+        archived,
+    )
 
 
+@app.get("/latest_measurements_all/", response_model=List[SensorLatestResponse])
+async def get_latest_measurements_all(db: AsyncSession = Depends(get_read_db)):
+    """
+    Último valor de cada (device_id, key) en toda la tabla.
+    """
+    values = await db.run_sync(latest.for_all)
+    return [
+        {"device_id": device_id, "key": key, "value": value, "timestamp": ts}
+        for device_id, keys in values.items()
+        for key, (value, ts) in keys.items()
+    ]
 
-# --------------------------------------------------------------------------- #
-#  Lanzar el cliente MQTT en un hilo “daemon”
-# --------------------------------------------------------------------------- #
 
-import threading
-from app.mqtt_client import run as mqtt_run
+@app.get("/latest_measurements_all_grouped/")
+async def get_latest_measurements_all_grouped(db: AsyncSession = Depends(get_read_db)):
+    """
+    Último valor de cada key, agrupado por device_id.
+    """
+    values = await db.run_sync(latest.for_all)
+    # Construimos un dict de la forma { device_id: { key: { value, timestamp } } }
+    result = {
+        device_id: {
+            key: {"value": value, "timestamp": ts.isoformat()}
+            for key, (value, ts) in keys.items()
+        }
+        for device_id, keys in values.items()
+    }
 
-mqtt_thread = threading.Thread(target=mqtt_run, daemon=True)
-mqtt_thread.start()
+    return JSONResponse(content=result)
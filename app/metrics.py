@@ -0,0 +1,330 @@
+"""
+app/metrics.py
+Métricas Prometheus (formato de texto 0.0.4) sin dependencias.
+
+Los contadores e histogramas guardan un *shard* por hilo: cada hilo sólo
+escribe en su propio diccionario, sin locks en el camino caliente, y
+`render()` suma los shards al servir `/metrics`. Las métricas que ya existen
+en app/status.py se exponen como *gauges* calculados en el momento.
+
+    API           → GET /metrics (app/main.py), incluye la ingesta si corre
+                    en el lifespan
+    ingesta       → `serve(METRICS_PORT)` en `python -m app.ingest_service`
+
+Con varios workers de Gunicorn cada proceso expone sólo lo suyo. Los
+workers de parseo en modo proceso (app/workers.py) sí llegan al padre:
+envían periódicamente `drain()` (lo acumulado por su hilo desde el último
+envío) y el colector lo suma con `merge()`.
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import http.server
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app import status
+
+METRICS_PORT: int = int(os.getenv("INGEST_METRICS_PORT", "9108"))   # 0 → sin servidor
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+E2E_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+_registry: List["_Metric"] = []
+_by_name: Dict[str, "_Metric"] = {}
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        _registry.append(self)
+        _by_name[name] = self
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            self._shards.append(shard)      # list.append es atómico
+        return shard
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def drain(self) -> dict:
+        """Vacía y devuelve el shard del hilo actual."""
+        shard = self._shard()
+        data = dict(shard)
+        shard.clear()
+        return data
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def merge(self, data: dict) -> None:
+        for labels, amount in data.items():
+            self.inc(amount, *labels)
+
+    def render(self) -> List[str]:
+        totals: Dict[tuple, float] = {}
+        for shard in list(self._shards):
+            for labels, value in dict(shard).items():
+                totals[labels] = totals.get(labels, 0) + value
+        return self._header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {value}"
+            for labels, value in sorted(totals.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            state = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def merge(self, data: dict) -> None:
+        shard = self._shard()
+        for labels, (counts, total, n) in data.items():
+            state = shard.get(labels)
+            if state is None:
+                state = shard[labels] = [[0] * len(counts), 0.0, 0]
+            state[0] = [a + c for a, c in zip(state[0], counts)]
+            state[1] += total
+            state[2] += n
+
+    def render(self) -> List[str]:
+        totals: Dict[tuple, list] = {}
+        for shard in list(self._shards):
+            for labels, (counts, total, n) in dict(shard).items():
+                acc = totals.setdefault(labels, [[0] * len(counts), 0.0, 0])
+                acc[0] = [a + c for a, c in zip(acc[0], counts)]
+                acc[1] += total
+                acc[2] += n
+        lines = self._header()
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, n) in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (le,))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {n}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist: Histogram, labels: tuple):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Gauge(_Metric):
+    """Valor calculado al servir (`fn`) o fijado con `set`."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str,
+                 fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> List[str]:
+        value = self.fn() if self.fn is not None else self.value
+        return self._header() + [f"{self.name} {value if value is not None else 'NaN'}"]
+
+
+def render() -> bytes:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+
+def drain() -> Dict[str, dict]:
+    """Contadores e histogramas acumulados por este hilo desde la última vez."""
+    deltas = {}
+    for metric in _registry:
+        if isinstance(metric, (Counter, Histogram)):
+            data = metric.drain()
+            if data:
+                deltas[metric.name] = data
+    return deltas
+
+
+def merge(deltas: Dict[str, dict]) -> None:
+    """Suma en este proceso lo devuelto por `drain()` en otro."""
+    for name, data in deltas.items():
+        metric = _by_name.get(name)
+        if metric is not None:
+            metric.merge(data)
+
+
+# ───────────────────────────── Ingesta ───────────────────────────── #
+
+def application(topic: str) -> str:
+    """Id de aplicación de `application/<app>/device/…` (etiqueta acotada)."""
+    parts = topic.split("/", 2)
+    return parts[1] if len(parts) > 1 and parts[0] == "application" else "other"
+
+
+messages_received = Counter("ingest_messages_received_total",
+                            "Uplinks recibidos del broker", ("application",))
+messages_parsed = Counter("ingest_messages_parsed_total",
+                          "Uplinks decodificados correctamente", ("application",))
+parse_errors = Counter("ingest_parse_errors_total", "Uplinks que no se pudieron decodificar")
+rows_written = Counter("ingest_rows_written_total", "Filas confirmadas en sensor_data")
+mqtt_reconnects = Counter("mqtt_reconnects_total", "Reconexiones al broker MQTT")
+
+parse_seconds = Histogram("ingest_parse_seconds", "Tiempo de decodificación por uplink")
+commit_seconds = Histogram("ingest_commit_seconds", "Tiempo de volcado por lote")
+end_to_end_seconds = Histogram("ingest_end_to_end_seconds",
+                               "Desde el instante del uplink hasta su commit",
+                               buckets=E2E_BUCKETS)
+
+Gauge("mqtt_connected", "1 si el cliente MQTT está conectado",
+      lambda: int(bool(status.mqtt_status["connected"])))
+for _key in ("queue_depth", "dropped_rows", "dropped_messages", "flush_errors",
+             "spooled_rows", "replayed_rows", "spool_bytes", "duplicates_dropped",
+             "dead_lettered_rows"):
+    Gauge(f"ingest_{_key}", f"ingest_status['{_key}'] (app/status.py)",
+          lambda k=_key: status.ingest_status[k])
+
+
+def observe_commit(rows: Sequence[tuple], seconds: float) -> None:
+    """Métricas de un lote confirmado: filas, latencia y extremo a extremo."""
+    rows_written.inc(len(rows))
+    commit_seconds.observe(seconds)
+    now = time.time()
+    last = None
+    for row in rows:
+        ts = row[3]
+        if ts is not last:             # filas del mismo uplink comparten ts
+            last = ts
+            lag = now - ts.timestamp()
+        end_to_end_seconds.observe(lag)
+
+
+# ─────────────────────────────── API ─────────────────────────────── #
+
+request_seconds = Histogram("http_request_duration_seconds",
+                            "Latencia de los endpoints (cuerpo incluido)",
+                            ("method", "route"))
+response_rows = Histogram("http_response_rows", "Filas devueltas por petición",
+                          ("route",), buckets=ROWS_BUCKETS)
+
+_rows: contextvars.ContextVar = contextvars.ContextVar("metrics_rows", default=None)
+
+
+def add_returned(count: int) -> None:
+    """Anota filas devueltas por la petición en curso."""
+    holder = _rows.get()
+    if holder is not None:
+        holder[0] = (holder[0] or 0) + count
+
+
+def returned(rows):
+    """Anota `len(rows)` y devuelve `rows` (para `return metrics.returned(...)`)."""
+    add_returned(len(rows))
+    return rows
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia por ruta y filas anotadas con `returned`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        holder = [None]
+        token = _rows.set(holder)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _rows.reset(token)
+            route = getattr(scope.get("route"), "path", "other")
+            request_seconds.observe(time.perf_counter() - start,
+                                    scope["method"], route)
+            if holder[0] is not None:
+                response_rows.observe(holder[0], route)
+
+
+# ──────────────────────── Servidor standalone ──────────────────────── #
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = METRICS_PORT) -> Optional[Tuple[http.server.HTTPServer, threading.Thread]]:
+    """Expone `/metrics` en un hilo para la ingesta standalone."""
+    if not port:
+        return None
+    server = http.server.ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics",
+                              daemon=True)
+    thread.start()
+    return server, thread
@@ -0,0 +1,85 @@
+-- 0001 · sensor_data como hypertable con diccionarios de device/key
+--
+--  * device_id / key (VARCHAR repetido en cada fila) → device_ref / key_ref
+--    (INTEGER) contra los diccionarios sensor_device / sensor_key
+--  * timestamp → TIMESTAMPTZ (los valores antiguos se guardaban en UTC)
+--  * id deja de ser PRIMARY KEY (una hypertable no admite índices únicos
+--    sin la columna de tiempo); se conserva como IDENTITY para la API
+--  * índice compuesto (device_ref, key_ref, timestamp DESC), que es el
+--    filtro de todas las consultas de app/main.py
+--  * sensor_latest pasa también a usar las referencias
+
+-- Esquema original (lo creaba Base.metadata.create_all) para BDs vacías
+CREATE TABLE IF NOT EXISTS sensor_data (
+    id        SERIAL PRIMARY KEY,
+    device_id VARCHAR,
+    key       VARCHAR,
+    value     DOUBLE PRECISION,
+    timestamp TIMESTAMP
+);
+
+CREATE TABLE sensor_device (
+    id      SERIAL PRIMARY KEY,
+    dev_eui TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE sensor_key (
+    id   SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+INSERT INTO sensor_device (dev_eui)
+SELECT DISTINCT device_id FROM sensor_data WHERE device_id IS NOT NULL;
+
+INSERT INTO sensor_key (name)
+SELECT DISTINCT key FROM sensor_data WHERE key IS NOT NULL;
+
+ALTER TABLE sensor_data RENAME TO sensor_data_legacy;
+
+CREATE TABLE sensor_data (
+    id         BIGINT GENERATED BY DEFAULT AS IDENTITY,
+    device_ref INTEGER          NOT NULL,
+    key_ref    INTEGER          NOT NULL,
+    value      DOUBLE PRECISION,
+    timestamp  TIMESTAMPTZ      NOT NULL
+);
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb') THEN
+        CREATE EXTENSION IF NOT EXISTS timescaledb;
+        PERFORM create_hypertable('sensor_data', 'timestamp',
+                                  chunk_time_interval => INTERVAL '7 days');
+    END IF;
+END
+$$;
+
+INSERT INTO sensor_data (id, device_ref, key_ref, value, timestamp)
+SELECT l.id, d.id, k.id, l.value,
+       COALESCE(l.timestamp, now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+FROM sensor_data_legacy l
+JOIN sensor_device d ON d.dev_eui = l.device_id
+JOIN sensor_key    k ON k.name    = l.key;
+
+SELECT setval(pg_get_serial_sequence('sensor_data', 'id'),
+              COALESCE((SELECT max(id) FROM sensor_data), 0) + 1, false);
+
+DROP TABLE sensor_data_legacy;
+
+CREATE INDEX sensor_data_series_ts_idx
+    ON sensor_data (device_ref, key_ref, timestamp DESC);
+
+DROP TABLE IF EXISTS sensor_latest;
+
+CREATE TABLE sensor_latest (
+    device_ref INTEGER          NOT NULL,
+    key_ref    INTEGER          NOT NULL,
+    value      DOUBLE PRECISION,
+    timestamp  TIMESTAMPTZ      NOT NULL,
+    PRIMARY KEY (device_ref, key_ref)
+);
+
+INSERT INTO sensor_latest (device_ref, key_ref, value, timestamp)
+SELECT DISTINCT ON (device_ref, key_ref) device_ref, key_ref, value, timestamp
+FROM sensor_data
+ORDER BY device_ref, key_ref, timestamp DESC;
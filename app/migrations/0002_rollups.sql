@@ -0,0 +1,53 @@
+-- 0002: agregados continuos por hora, día y semana (TimescaleDB).
+--
+-- Cada vista guarda (total, samples, maximum, minimum) por
+-- (device_ref, key_ref, bucket); app/rollups.py recompone AVG como
+-- sum(total) / sum(samples) y completa con datos crudos la cola que aún no
+-- se ha materializado. Sin TimescaleDB no se crea nada y la API sigue
+-- agregando sobre `sensor_data`.
+--
+-- WITH NO DATA permite crearlas dentro de la transacción de la migración;
+-- la política (start_offset NULL) materializa todo el histórico en su
+-- primera ejecución y después sólo las regiones invalidadas.
+
+DO $$
+DECLARE
+    r RECORD;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb') THEN
+        RAISE NOTICE 'timescaledb no disponible: se omiten los rollups';
+        RETURN;
+    END IF;
+
+    FOR r IN SELECT * FROM (VALUES
+            ('sensor_data_hourly', INTERVAL '1 hour', INTERVAL '15 minutes'),
+            ('sensor_data_daily',  INTERVAL '1 day',  INTERVAL '1 hour'),
+            ('sensor_data_weekly', INTERVAL '1 week', INTERVAL '6 hours')
+        ) AS v(view_name, width, schedule)
+    LOOP
+        EXECUTE format($sql$
+            CREATE MATERIALIZED VIEW %I
+            WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+            SELECT device_ref,
+                   key_ref,
+                   time_bucket(%L::interval, timestamp) AS bucket,
+                   sum(value)   AS total,
+                   count(value) AS samples,
+                   max(value)   AS maximum,
+                   min(value)   AS minimum
+            FROM sensor_data
+            GROUP BY device_ref, key_ref, bucket
+            WITH NO DATA
+        $sql$, r.view_name, r.width);
+
+        EXECUTE format('CREATE INDEX %I ON %I (device_ref, key_ref, bucket)',
+                       r.view_name || '_series_idx', r.view_name);
+
+        PERFORM add_continuous_aggregate_policy(
+            r.view_name::regclass,
+            start_offset      => NULL,
+            end_offset        => r.width,
+            schedule_interval => r.schedule);
+    END LOOP;
+END
+$$;
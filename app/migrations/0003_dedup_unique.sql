@@ -0,0 +1,18 @@
+-- 0003: una sola fila por (device_ref, key_ref, timestamp).
+--
+-- Elimina los duplicados ya insertados (se conserva el id más bajo) y
+-- sustituye el índice de series por uno único equivalente, que permite a
+-- los sinks insertar con ON CONFLICT DO NOTHING. Incluye la columna de
+-- partición (timestamp), como exige una hypertable.
+
+DELETE FROM sensor_data a
+USING sensor_data b
+WHERE a.device_ref = b.device_ref
+  AND a.key_ref    = b.key_ref
+  AND a.timestamp  = b.timestamp
+  AND a.id > b.id;
+
+CREATE UNIQUE INDEX sensor_data_series_ts_uniq
+    ON sensor_data (device_ref, key_ref, timestamp DESC);
+
+DROP INDEX sensor_data_series_ts_idx;
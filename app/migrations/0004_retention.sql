@@ -0,0 +1,27 @@
+-- 0004: registro del ciclo de vida de sensor_data (app/retention.py).
+--
+--  * sensor_data_archive: un fichero Parquet por tramo archivado (tiering);
+--    app/archive.py lo consulta para leer de disco los rangos que ya no
+--    están en la tabla. Un mismo tramo puede tener varios ficheros si
+--    llegaron filas atrasadas después de archivarlo.
+--  * retention_runs: resultado de cada pasada del planificador, para
+--    GET /retention_status desde cualquier proceso.
+
+CREATE TABLE sensor_data_archive (
+    path        TEXT PRIMARY KEY,
+    range_start TIMESTAMPTZ NOT NULL,
+    range_end   TIMESTAMPTZ NOT NULL,
+    row_count   BIGINT      NOT NULL,
+    size_bytes  BIGINT      NOT NULL,
+    created_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX sensor_data_archive_range_idx
+    ON sensor_data_archive (range_start, range_end);
+
+CREATE TABLE retention_runs (
+    id          BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    started_at  TIMESTAMPTZ      NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    result      JSONB            NOT NULL
+);
@@ -0,0 +1,15 @@
+-- 0005: índices para la paginación por keyset (app/pagination.py).
+--
+--  * /data/: (timestamp DESC, id DESC) recorre las filas más recientes en
+--    el orden de la página; sustituye al índice por defecto de la
+--    hypertable (sólo timestamp), del que es un superconjunto.
+--  * /measurements/: (device_ref, timestamp, id) da el orden cronológico
+--    de todas las claves de un dispositivo sin ordenar en memoria.
+
+CREATE INDEX IF NOT EXISTS sensor_data_ts_id_idx
+    ON sensor_data (timestamp DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS sensor_data_device_ts_id_idx
+    ON sensor_data (device_ref, timestamp, id);
+
+DROP INDEX IF EXISTS sensor_data_timestamp_idx;
@@ -0,0 +1,44 @@
+-- 0006: ventana de refresco finita para los rollups (TimescaleDB).
+--
+-- Con start_offset NULL (0002) cualquier fila atrasada invalida su bucket
+-- y la política lo recalcula desde `sensor_data`, aunque ese rango ya se
+-- haya archivado (tiering) o borrado: el bucket se rehace con los pocos
+-- datos que quedan en la tabla y se pierde la historia. Con un
+-- start_offset finito la política no vuelve a tocar lo más viejo, y
+-- app/retention.py se niega a archivar o borrar por encima de esa ventana
+-- (más un bucket). Las filas que lleguen con más retraso que la ventana no
+-- se reflejan en los rollups.
+--
+-- Si ya había histórico sin materializar (la política NULL nunca llegó a
+-- ejecutarse), hay que hacerlo una vez a mano antes de activar tier/drop:
+--
+--     CALL refresh_continuous_aggregate('sensor_data_hourly', NULL, now() - INTERVAL '7 days');
+--     (ídem daily con 14 días y weekly con 21)
+
+DO $$
+DECLARE
+    r RECORD;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb') THEN
+        RETURN;
+    END IF;
+
+    -- La ventana [start_offset, end_offset] debe cubrir al menos 2 buckets
+    FOR r IN SELECT * FROM (VALUES
+            ('sensor_data_hourly', INTERVAL '7 days',  INTERVAL '1 hour', INTERVAL '15 minutes'),
+            ('sensor_data_daily',  INTERVAL '14 days', INTERVAL '1 day',  INTERVAL '1 hour'),
+            ('sensor_data_weekly', INTERVAL '21 days', INTERVAL '1 week', INTERVAL '6 hours')
+        ) AS v(view_name, start_offset, width, schedule)
+    LOOP
+        IF to_regclass(r.view_name) IS NULL THEN
+            CONTINUE;
+        END IF;
+        PERFORM remove_continuous_aggregate_policy(r.view_name::regclass, if_exists => true);
+        PERFORM add_continuous_aggregate_policy(
+            r.view_name::regclass,
+            start_offset      => r.start_offset,
+            end_offset        => r.width,
+            schedule_interval => r.schedule);
+    END LOOP;
+END
+$$;
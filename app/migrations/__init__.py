@@ -0,0 +1,62 @@
+"""
+app/migrations
+Migraciones versionadas del esquema (ficheros NNNN_descripcion.sql).
+
+`upgrade()` aplica, en orden y dentro de una única transacción, las que no
+figuran todavía en `schema_migrations`. Un advisory lock evita que varios
+procesos (workers de Gunicorn + servicio de ingesta) migren a la vez.
+
+    python -m app.migrations
+"""
+
+from __future__ import annotations
+
+import logging
+import pathlib
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.database import engine as default_engine
+
+MIGRATIONS_DIR = pathlib.Path(__file__).parent
+LOCK_ID = 7310420
+
+logger = logging.getLogger("migrations")
+
+
+def pending_files() -> List[pathlib.Path]:
+    return sorted(MIGRATIONS_DIR.glob("[0-9][0-9][0-9][0-9]_*.sql"))
+
+
+def upgrade(engine: Engine = default_engine) -> List[str]:
+    """Aplica las migraciones pendientes y devuelve sus nombres."""
+    applied_now = []
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": LOCK_ID})
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version    INTEGER PRIMARY KEY,
+                name       TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+        applied = {v for (v,) in conn.execute(
+            text("SELECT version FROM schema_migrations"))}
+
+        for path in pending_files():
+            version = int(path.name[:4])
+            if version in applied:
+                continue
+            logger.info("🛠️  Aplicando migración %s", path.name)
+            # Cursor DBAPI sin parámetros: el SQL se envía tal cual
+            conn.connection.cursor().execute(path.read_text())
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name) "
+                     "VALUES (:v, :n)"),
+                {"v": version, "n": path.stem},
+            )
+            applied_now.append(path.stem)
+    return applied_now
+
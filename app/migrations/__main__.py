@@ -0,0 +1,8 @@
+import logging
+
+from app.migrations import upgrade
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s | %(levelname)s | %(message)s")
+done = upgrade()
+print("✅ Esquema al día." if not done else f"✅ Aplicadas: {', '.join(done)}")
@@ -1,12 +1,38 @@
-
-from sqlalchemy import Column, String, Float, DateTime, Integer
+from sqlalchemy import BigInteger, Column, DateTime, Float, Integer, String
 from app.database import Base
-import datetime
+
+# El esquema lo gestionan las migraciones de app/migrations (no create_all).
+
+
+class SensorDevice(Base):
+    """Diccionario devEUI → id compacto."""
+    __tablename__ = "sensor_device"
+    id = Column(Integer, primary_key=True)
+    dev_eui = Column(String, unique=True, nullable=False)
+
+
+class SensorKey(Base):
+    """Diccionario nombre de magnitud → id compacto."""
+    __tablename__ = "sensor_key"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
 
 class SensorData(Base):
     __tablename__ = "sensor_data"
-    id = Column(Integer, primary_key=True, index=True)
-    device_id = Column(String, index=True)
-    key = Column(String, index=True)
+    # En la BD `id` es IDENTITY sin PRIMARY KEY (hypertable); el ORM lo
+    # necesita como identidad de la fila.
+    id = Column(BigInteger, primary_key=True)
+    device_ref = Column(Integer, nullable=False)
+    key_ref = Column(Integer, nullable=False)
+    value = Column(Float)
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+
+
+class SensorLatest(Base):
+    """Último valor de cada (device, key); lo mantiene la ingesta (UPSERT)."""
+    __tablename__ = "sensor_latest"
+    device_ref = Column(Integer, primary_key=True)
+    key_ref = Column(Integer, primary_key=True)
     value = Column(Float)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    timestamp = Column(DateTime(timezone=True), nullable=False)
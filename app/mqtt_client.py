@@ -2,13 +2,13 @@
 
 """
 Cliente MQTT con reconexión automática y soporte TLS opcional.
-Escucha uplinks de ChirpStack, almacena los valores numéricos en TimescaleDB
+Escucha uplinks de ChirpStack y los entrega al pool de parseo (app/workers.py),
+que encola los valores numéricos para su volcado por lotes (app/ingest.py)
 y publica el estado de la conexión a través de app/status.py
 """
 
 from __future__ import annotations
 
-import json
 import logging
 import os
 import ssl
@@ -17,8 +17,9 @@ from typing import Any, Dict
 
 import paho.mqtt.client as mqtt
 
-from app.database import SessionLocal
-from app.models import SensorData
+from app import metrics
+from app.ingest import get_pipeline
+from app.workers import get_pool
 from app.status import update as update_status
 
 # ───────────────────────── Config ────────────────────────── #
@@ -31,6 +32,11 @@ MAX_DELAY: int = int(os.getenv("MQTT_MAX_DELAY", "60"))          # tope backoff
 
 TOPIC: str = os.getenv("MQTT_TOPIC", "application/+/device/+/event/up")
 SYS_TOPIC: str = "$SYS/#"
+# Los mensajes $SYS del broker no se almacenan; sólo sirven para depurar
+MQTT_SUBSCRIBE_SYS: bool = os.getenv("MQTT_SUBSCRIBE_SYS", "0") == "1"
+# Suscripción compartida MQTT v5 (`$share/<grupo>/TOPIC`): el broker reparte
+# los uplinks entre todas las instancias del grupo. Vacío → suscripción normal
+MQTT_SHARE_GROUP: str = os.getenv("MQTT_SHARE_GROUP", "")
 
 CTX_DIR = os.getenv("MQTT_CTX_DIR", "/app/ctx")
 CA_FILE = os.getenv("MQTT_CA", os.path.join(CTX_DIR, "ca.crt"))
@@ -44,60 +50,67 @@ logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s | %(levelname)s | %(message)s")
 logger = logging.getLogger("mqtt_client")
 
+
+def subscription() -> str:
+    """Filtro al que se suscribe la ingesta (compartido si hay grupo)."""
+    if MQTT_SHARE_GROUP:
+        return f"$share/{MQTT_SHARE_GROUP}/{TOPIC}"
+    return TOPIC
+
+
+def protocol() -> int:
+    """MQTT v5 con suscripción compartida; 3.1.1 en otro caso."""
+    return mqtt.MQTTv5 if MQTT_SHARE_GROUP else mqtt.MQTTv311
+
+
+def _rc(rc) -> int:
+    # MQTT v5 entrega ReasonCode en lugar de int
+    return getattr(rc, "value", rc)
+
 # ──────────────────────── Callbacks ───────────────────────── #
 
+_connected_once = False
+
+
 def on_connect(client: mqtt.Client, userdata: Any,
-               flags: Dict[str, Any], rc: int):
+               flags: Dict[str, Any], rc: int, properties: Any = None):
+    global _connected_once
+    rc = _rc(rc)
     icon = "🟢" if rc == 0 else "⚠️"
     logger.info("%s Conectado al broker (rc=%s)", icon, rc)
     update_status(connected=(rc == 0), rc=rc)
-
-    client.subscribe(TOPIC)
-    client.subscribe(SYS_TOPIC)
-    logger.info("📡 Subscrito a ‘%s’ y ‘%s’", TOPIC, SYS_TOPIC)
+    if rc == 0:
+        if _connected_once:
+            metrics.mqtt_reconnects.inc()
+        _connected_once = True
+
+    client.subscribe(subscription())
+    if MQTT_SUBSCRIBE_SYS:
+        client.subscribe(SYS_TOPIC)
+        logger.info("📡 Subscrito a ‘%s’ y ‘%s’", subscription(), SYS_TOPIC)
+    else:
+        logger.info("📡 Subscrito a ‘%s’", subscription())
 
 
-def on_disconnect(client: mqtt.Client, userdata: Any, rc: int):
+def on_disconnect(client: mqtt.Client, userdata: Any, rc: int, properties: Any = None):
+    rc = _rc(rc)
     logger.warning("🔴 Desconectado del broker (rc=%s)", rc)
     update_status(connected=False, rc=rc)
 
 
 def on_message(client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage):
-
-    if 'device' in msg.topic:
-        print("📨 TOPIC:", msg.topic)
-        print("📨 PAYLOAD:", msg.payload.decode())
-
     if msg.topic.startswith("$SYS/"):
         return          # ignoramos mensajes de sistema
 
-    session = SessionLocal()
-    try:
-        payload = json.loads(msg.payload.decode())
-        device_id = (payload.get("devEUI")
-                     or payload.get("deviceInfo", {}).get("devEui"))
-        ts = (payload.get("receivedAt") or payload.get("time")
-              or time.strftime("%Y-%m-%dT%H:%M:%S"))
-        object_data = payload.get("objectJSON") or payload.get("object", {})
-
-        for key, value in object_data.items():
-            if isinstance(value, (int, float)):
-                logger.info("[DB] %s %s %s = %s", device_id, ts, key, value)
-                session.add(SensorData(device_id=device_id,
-                                       timestamp=ts,
-                                       key=key,
-                                       value=value))
-        session.commit()
-    except Exception as exc:        # pragma: no cover
-        logger.exception("❌ Error procesando mensaje: %s", exc)
-        session.rollback()
-    finally:
-        session.close()
+    metrics.messages_received.inc(1, metrics.application(msg.topic))
+    # El parseo y el volcado se hacen fuera del hilo de red de paho:
+    # app/workers.py (parseo) → app/ingest.py (escritura por lotes)
+    get_pool().submit(msg.topic, msg.payload)
 
 # ─────────────────────── Helper de cliente ─────────────────── #
 
 def build_client() -> mqtt.Client:
-    client = mqtt.Client(protocol=mqtt.MQTTv311)
+    client = mqtt.Client(protocol=protocol())
 
     if all(os.path.exists(p) for p in (CA_FILE, CERT_FILE, KEY_FILE)):
         client.tls_set(ca_certs=CA_FILE,
@@ -124,6 +137,8 @@ def build_client() -> mqtt.Client:
 def run() -> None:
     delay = RETRY_DELAY
     client = build_client()
+    pipeline = get_pipeline()
+    pool = get_pool()
 
     while True:
         try:
@@ -137,6 +152,8 @@ def run() -> None:
             delay = min(delay * 2, MAX_DELAY)     # back-off exponencial
         except KeyboardInterrupt:
             logger.info("⏹️  CTRL-C – cerrando conexión…")
+            pool.stop()
+            pipeline.stop()
             break
         finally:
             try:
@@ -146,4 +163,8 @@ def run() -> None:
 
 
 if __name__ == "__main__":
-    run()
+    # La ingesta se lanza siempre a través de app/ingest_service.py, que
+    # respeta INGEST_MODE/INGEST_BACKEND y evita arrancarla dos veces.
+    from app.ingest_service import main
+
+    raise SystemExit(main())
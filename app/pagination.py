@@ -0,0 +1,75 @@
+"""
+app/pagination.py
+Paginación por *keyset* de `/data/` y `/measurements/`.
+
+Cada página se pide con `limit` (como mucho PAGE_MAX_ROWS) y, salvo la
+primera, con el `cursor` que devolvió la anterior en la cabecera
+X-Next-Cursor (ausente en la última página). El cursor es opaco: codifica
+el (timestamp, id) de la última fila entregada y la página siguiente
+empieza justo después con
+
+    WHERE (timestamp, id) < (:ts, :id) ORDER BY timestamp DESC, id DESC
+
+(al revés en /measurements/, que va en orden cronológico). Los índices de la
+migración 0005 siguen ese orden, así que cada página es un recorrido de
+rango del índice de `limit + 1` filas, sea cual sea su profundidad; no hay
+OFFSET. Las filas ya archivadas en Parquet entran en la misma página con
+`archive.read_page`, que aplica el mismo orden y límite tramo a tramo.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import datetime as dt
+import os
+import struct
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+
+PAGE_MAX_ROWS: int = int(os.getenv("PAGE_MAX_ROWS", "10000"))
+NEXT_HEADER = "X-Next-Cursor"
+
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_FORMAT = struct.Struct(">qq")      # µs desde epoch, id
+
+
+class Cursor(NamedTuple):
+    timestamp: dt.datetime
+    id: int
+
+
+def encode(timestamp: dt.datetime, id_: int) -> str:
+    micros = (timestamp - EPOCH) // dt.timedelta(microseconds=1)
+    return base64.urlsafe_b64encode(_FORMAT.pack(micros, id_)).rstrip(b"=").decode()
+
+
+def decode(token: str) -> Optional[Cursor]:
+    """Cursor de `token`; None si no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        micros, id_ = _FORMAT.unpack(raw)
+        return Cursor(EPOCH + dt.timedelta(microseconds=micros), id_)
+    except (binascii.Error, struct.error, ValueError, OverflowError):
+        return None
+
+
+def invalid(token: Optional[str]) -> Optional[JSONResponse]:
+    """400 si `token` no es un cursor de esta API."""
+    if token is not None and decode(token) is None:
+        return JSONResponse(status_code=400, content={"error": "Invalid cursor."})
+    return None
+
+
+def page(rows: Sequence[tuple], limit: int,
+         key: Callable[[tuple], Tuple[dt.datetime, int]]) -> Tuple[List[tuple], Optional[str]]:
+    """
+    Primeras `limit` filas de `rows` (se piden `limit + 1`) y el cursor de la
+    página siguiente, o None si no la hay.
+    """
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode(*key(rows[-1]))
@@ -0,0 +1,293 @@
+"""
+app/push.py
+Envío en vivo de mediciones por WebSocket (`/subscribe/ws`) y Server-Sent
+Events (`/subscribe/sse`), en lugar de sondear `/latest_measurements*`.
+
+    ingesta ──commit──▶ on_commit ──▶ Hub ──▶ buffer de cada suscriptor ──▶ cliente
+
+Las filas llegan del listener de app/ingest.py si la ingesta corre en este
+proceso (INGEST_MODE=lifespan) o, si corre aparte, por pub/sub del backend
+compartido (PUSH_REDIS_URL, por defecto el de la caché): la ingesta
+publica cada lote confirmado desde un hilo propio, sin frenar el volcado.
+
+Cada fila se serializa una vez y se reparte a los suscriptores cuyo filtro
+(device_id / key, `*` o ausente = todos) coincide. Cada suscriptor tiene un
+buffer acotado (PUSH_BUFFER mensajes) con una política para clientes lentos:
+
+    drop     → se descartan los más antiguos y se avisa con `{"dropped": n}`
+    coalesce → sólo se guarda el último valor de cada (device_id, key)
+
+El envío agrupa lo pendiente en un único mensaje (array JSON), así que con
+miles de conexiones el coste por lote es una escritura por cliente.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Deque, Dict, Iterable, Optional, Sequence, Set, Tuple
+
+from fastapi.responses import JSONResponse
+from starlette.websockets import WebSocketDisconnect
+
+from app import cache, metrics
+from app.streaming import dumps
+
+try:
+    import orjson
+except ImportError:             # pragma: no cover
+    orjson = None
+
+PUSH_BUFFER: int = int(os.getenv("PUSH_BUFFER", "1000"))             # mensajes por suscriptor
+PUSH_MAX_SUBSCRIBERS: int = int(os.getenv("PUSH_MAX_SUBSCRIBERS", "10000"))
+PUSH_HEARTBEAT: float = float(os.getenv("PUSH_HEARTBEAT", "15"))      # s entre pings
+PUSH_REDIS_URL: str = os.getenv("PUSH_REDIS_URL", cache.CACHE_REDIS_URL)
+PUSH_CHANNEL: str = cache.CACHE_PREFIX + "push"
+
+SHARED: bool = bool(PUSH_REDIS_URL) and cache.redis is not None
+POLICIES = ("drop", "coalesce")
+
+logger = logging.getLogger("push")
+
+Series = Tuple[str, str]        # (device_id, key)
+
+published = metrics.Counter("push_messages_total", "Mediciones entregadas a suscriptores")
+dropped = metrics.Counter("push_dropped_total",
+                          "Mediciones descartadas por suscriptores lentos")
+
+
+class Subscriber:
+    """Filtro + buffer acotado de un cliente."""
+
+    def __init__(self, devices: Set[str], keys: Set[str],
+                 policy: str = "drop", size: int = PUSH_BUFFER):
+        self.devices = devices      # vacío → todos
+        self.keys = keys
+        self.policy = policy
+        self.size = max(1, size)
+        self.dropped = 0
+        self.closed = False
+        self._queue: Deque[bytes] = collections.deque()
+        self._latest: "collections.OrderedDict[Series, bytes]" = collections.OrderedDict()
+        self._ready = asyncio.Event()
+
+    def offer(self, series: Series, message: bytes) -> None:
+        if self.keys and series[1] not in self.keys:
+            return
+        if self.policy == "coalesce":
+            self._latest[series] = message
+            self._latest.move_to_end(series)
+            if len(self._latest) > self.size:
+                self._latest.popitem(last=False)
+                self._drop()
+        else:
+            if len(self._queue) >= self.size:
+                self._queue.popleft()
+                self._drop()
+            self._queue.append(message)
+        self._ready.set()
+
+    def _drop(self) -> None:
+        self.dropped += 1
+        dropped.inc()
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def next_batch(self, timeout: float) -> Optional[bytes]:
+        """
+        Array JSON con lo pendiente; b"" si vence `timeout` sin datos (toca
+        heartbeat) y None si el suscriptor se ha cerrado.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return b""
+        if self.closed:
+            return None
+        self._ready.clear()
+        if self.policy == "coalesce":
+            items = list(self._latest.values())
+            self._latest.clear()
+        else:
+            items = list(self._queue)
+            self._queue.clear()
+        if self.dropped:
+            items.append(dumps({"dropped": self.dropped}))
+            self.dropped = 0
+        published.inc(len(items))
+        return b"[" + b",".join(items) + b"]"
+
+
+class Hub:
+    """Suscriptores indexados por dispositivo (`*` = todos). Sólo en el bucle."""
+
+    def __init__(self):
+        self._by_device: Dict[str, Set[Subscriber]] = collections.defaultdict(set)
+        self.count = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, sub: Subscriber) -> None:
+        for device in sub.devices or ("*",):
+            self._by_device[device].add(sub)
+        self.count += 1
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        for device in sub.devices or ("*",):
+            subs = self._by_device.get(device)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._by_device[device]
+        self.count -= 1
+
+    def publish(self, rows: Sequence[tuple]) -> None:
+        """Reparte filas `(device_id, key, value, timestamp)` confirmadas."""
+        if not self.count:
+            return
+        everyone = self._by_device.get("*", ())
+        for device_id, key, value, ts in rows:
+            targets = self._by_device.get(device_id)
+            if not targets and not everyone:
+                continue
+            message = dumps({"device_id": device_id, "key": key,
+                             "value": value, "timestamp": ts})
+            series = (device_id, key)
+            for sub in everyone:
+                sub.offer(series, message)
+            for sub in targets or ():
+                sub.offer(series, message)
+
+    def close(self) -> None:
+        for subs in list(self._by_device.values()):
+            for sub in list(subs):
+                sub.close()
+
+
+hub = Hub()
+
+metrics.Gauge("push_subscribers", "Suscriptores WebSocket/SSE conectados",
+              lambda: hub.count)
+
+
+def parse_filter(values: Optional[Iterable[str]]) -> Set[str]:
+    """Lista de la query string → conjunto (vacío si falta o contiene `*`)."""
+    values = set(values or ())
+    return set() if not values or "*" in values else values
+
+
+# ─────────────────────────── Fuentes ─────────────────────────── #
+
+def on_commit(rows: Sequence[tuple]) -> None:
+    """Listener de ingesta en este proceso (puede llamarse desde otro hilo)."""
+    loop = hub.loop
+    if loop is not None and hub.count:
+        loop.call_soon_threadsafe(hub.publish, list(rows))
+
+
+class Publisher:
+    """Publica los lotes confirmados en el canal compartido desde un hilo."""
+
+    def __init__(self, url: str = PUSH_REDIS_URL, maxsize: int = 1000):
+        self._client = cache.redis.Redis.from_url(url, socket_timeout=2)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        threading.Thread(target=self._run, name="push-publisher", daemon=True).start()
+
+    def __call__(self, rows: Sequence[tuple]) -> None:
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            dropped.inc(len(rows))
+
+    def _run(self) -> None:
+        while True:
+            rows = self._queue.get()
+            try:
+                self._client.publish(PUSH_CHANNEL, dumps(
+                    [[d, k, v, ts] for d, k, v, ts in rows]))
+            except Exception as exc:
+                logger.warning("⚠️  No se pudo publicar en %s (%s)", PUSH_CHANNEL, exc)
+
+
+async def _relay() -> None:
+    """Recibe del canal compartido los lotes que publica la ingesta."""
+    client = cache.aioredis.Redis.from_url(PUSH_REDIS_URL)
+    loads = orjson.loads if orjson is not None else json.loads
+    while True:
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(PUSH_CHANNEL)
+                logger.info("📡 Push suscrito a %s", PUSH_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        hub.publish(loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("⚠️  Canal de push no disponible (%s); reintento en 5 s", exc)
+            await asyncio.sleep(5)
+
+
+def start() -> Optional[asyncio.Task]:
+    """Prepara el hub en el bucle actual; con backend compartido, escucha el canal."""
+    hub.loop = asyncio.get_running_loop()
+    if SHARED:
+        return asyncio.create_task(_relay(), name="push-relay")
+    return None
+
+
+# ─────────────────────────── Conexiones ─────────────────────────── #
+
+def invalid(policy: str) -> Optional[JSONResponse]:
+    """400 si la política no existe; 503 si se alcanzó PUSH_MAX_SUBSCRIBERS."""
+    if policy not in POLICIES:
+        return JSONResponse(status_code=400, content={
+            "error": "Invalid policy. Use one of: drop, coalesce."})
+    if hub.count >= PUSH_MAX_SUBSCRIBERS:
+        return JSONResponse(status_code=503, content={"error": "Too many subscribers."})
+    return None
+
+
+async def sse(sub: Subscriber):
+    """Cuerpo `text/event-stream`: un evento por lote, comentario como ping."""
+    hub.subscribe(sub)
+    try:
+        yield b": subscribed\n\n"
+        while True:
+            batch = await sub.next_batch(PUSH_HEARTBEAT)
+            if batch is None:
+                return
+            yield (b"data: " + batch + b"\n\n") if batch else b": ping\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+
+async def websocket(ws, sub: Subscriber) -> None:
+    """Envía lotes por `ws` hasta que el cliente cierra."""
+    async def drain_client():
+        # Detecta el cierre aunque no haya datos que enviar
+        try:
+            while True:
+                await ws.receive_text()
+        except WebSocketDisconnect:
+            sub.close()
+
+    hub.subscribe(sub)
+    reader = asyncio.create_task(drain_client())
+    try:
+        while True:
+            batch = await sub.next_batch(PUSH_HEARTBEAT)
+            if batch is None:
+                return
+            await ws.send_text(batch.decode() if batch else "[]")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+        hub.unsubscribe(sub)
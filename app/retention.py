@@ -0,0 +1,413 @@
+"""
+app/retention.py
+Ciclo de vida de `sensor_data`: compresión, tiering a Parquet y borrado.
+
+    compress → comprime (TimescaleDB) los chunks más viejos que
+               RETENTION_COMPRESS_DAYS, segmentados por serie
+               (device_ref, key_ref) y ordenados por timestamp
+    tier     → exporta a Parquet en RETENTION_TIER_DIR los tramos más viejos
+               que RETENTION_TIER_DAYS y los quita de la tabla; la API los
+               sigue leyendo de disco (app/archive.py)
+    drop     → borra para siempre los datos crudos (tabla y Parquet) más
+               viejos que RETENTION_DROP_DAYS, sólo si los rollups existen
+               y están materializados hasta ese punto: los agregados
+               conservan la historia
+
+Con rollups (TimescaleDB), tier y drop sólo actúan por debajo de la ventana
+de refresco de sus políticas (start_offset + un bucket, migración 0006): una
+fila atrasada en un rango ya archivado o borrado haría que la política
+recalculara el bucket desde una tabla casi vacía.
+
+Cada política se desactiva con 0 días. Las aplica un planificador dentro
+del servicio (hilo en la API y en el servicio de ingesta) cada
+RETENTION_INTERVAL segundos; un advisory lock hace que sólo un proceso
+trabaje en cada pasada. El resultado queda en `retention_runs` y
+`GET /retention_status` lo muestra junto al estado del almacenamiento.
+
+Los tramos son los chunks de la hypertable; sin TimescaleDB, ventanas de
+TIER_WINDOW alineadas con los rollups (ahí sólo aplica el tiering: la
+compresión y los rollups son de TimescaleDB). Un tramo se exporta y se
+borra en la misma transacción REPEATABLE READ (con el chunk bloqueado
+frente a inserciones), así que una fila atrasada que llegue mientras tanto
+no se pierde: se archivará en la siguiente pasada.
+
+Ojo: refrescar a mano un rollup sobre un rango ya borrado lo vacía.
+
+    python -m app.retention      # una pasada ahora
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app import archive, cache, rollups
+from app.database import engine
+
+RETENTION_INTERVAL: float = float(os.getenv("RETENTION_INTERVAL", "3600"))   # s entre pasadas
+RETENTION_COMPRESS_DAYS: float = float(os.getenv("RETENTION_COMPRESS_DAYS", "0"))
+RETENTION_TIER_DAYS: float = float(os.getenv("RETENTION_TIER_DAYS", "0"))
+RETENTION_DROP_DAYS: float = float(os.getenv("RETENTION_DROP_DAYS", "0"))
+RETENTION_TIER_DIR: str = os.getenv("RETENTION_TIER_DIR", "")
+
+TIER_WINDOW = dt.timedelta(days=7)      # = chunk_time_interval de la migración 0001
+TIER_BATCH_ROWS = 50_000
+START_DELAY = 60.0                      # s tras el arranque hasta la primera pasada
+RUNS_KEPT = "30 days"
+LOCK_ID = 7310422                       # ≠ migraciones (7310420) e ingesta (7310421)
+
+logger = logging.getLogger("retention")
+
+Window = Tuple[dt.datetime, dt.datetime, Optional[str]]   # (inicio, fin, chunk)
+
+
+def enabled() -> bool:
+    return RETENTION_INTERVAL > 0 and any(
+        days > 0 for days in (RETENTION_COMPRESS_DAYS, RETENTION_TIER_DAYS,
+                              RETENTION_DROP_DAYS))
+
+
+def _cutoff(now: dt.datetime, days: float) -> Optional[dt.datetime]:
+    return now - dt.timedelta(days=days) if days > 0 else None
+
+
+def _timescale(conn) -> bool:
+    return bool(conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb')")).scalar())
+
+
+# ─────────────────────────── Políticas ─────────────────────────── #
+
+def compress(conn, cutoff: dt.datetime) -> int:
+    """Comprime los chunks que terminan antes de `cutoff`; devuelve cuántos."""
+    enabled_ = conn.execute(text(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables "
+        "WHERE hypertable_name = 'sensor_data'")).scalar()
+    if not enabled_:
+        conn.execute(text(
+            "ALTER TABLE sensor_data SET (timescaledb.compress, "
+            "timescaledb.compress_segmentby = 'device_ref, key_ref', "
+            "timescaledb.compress_orderby = 'timestamp DESC')"))
+        conn.commit()
+        logger.info("🗜️  Compresión activada en sensor_data")
+    chunks = conn.execute(text(
+        "SELECT format('%I.%I', chunk_schema, chunk_name) "
+        "FROM timescaledb_information.chunks "
+        "WHERE hypertable_name = 'sensor_data' AND NOT is_compressed "
+        "  AND range_end <= :cutoff ORDER BY range_start"),
+        {"cutoff": cutoff}).scalars().all()
+    for chunk in chunks:
+        conn.execute(text("SELECT compress_chunk(CAST(:c AS regclass), "
+                          "if_not_compressed => true)"), {"c": chunk})
+        conn.commit()
+    return len(chunks)
+
+
+def _windows(conn, cutoff: dt.datetime, timescale: bool) -> List[Window]:
+    if timescale:
+        return [tuple(row) for row in conn.execute(text(
+            "SELECT range_start, range_end, format('%I.%I', chunk_schema, chunk_name) "
+            "FROM timescaledb_information.chunks "
+            "WHERE hypertable_name = 'sensor_data' AND range_end <= :cutoff "
+            "ORDER BY range_start"), {"cutoff": cutoff})]
+    # Sólo las ventanas completas anteriores a `cutoff` que tienen filas
+    last = rollups.floor_to(cutoff, TIER_WINDOW)
+    found = conn.execute(text(
+        "SELECT DISTINCT floor(extract(epoch FROM timestamp - :origin) / :width)::bigint AS n "
+        "FROM sensor_data WHERE timestamp < :last ORDER BY n"),
+        {"origin": rollups.ORIGIN, "width": TIER_WINDOW.total_seconds(),
+         "last": last}).scalars().all()
+    return [(rollups.ORIGIN + n * TIER_WINDOW, rollups.ORIGIN + (n + 1) * TIER_WINDOW, None)
+            for n in found]
+
+
+def _tier_window(start: dt.datetime, end: dt.datetime, chunk: Optional[str]) -> int:
+    """Exporta [start, end) a Parquet y lo borra de la tabla; devuelve filas."""
+    name = (f"sensor_data_{rollups.as_utc(start):%Y%m%dT%H%M%SZ}_"
+            f"{rollups.as_utc(end):%Y%m%dT%H%M%SZ}_{time.time_ns()}.parquet")
+    path = os.path.join(RETENTION_TIER_DIR, name)
+    bounds = {"start": start, "end": end}
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            if chunk is not None:
+                conn.execute(text(f"LOCK TABLE {chunk} IN SHARE MODE"))
+            result = conn.execute(text(
+                "SELECT id, device_ref, key_ref, timestamp, value FROM sensor_data "
+                "WHERE timestamp >= :start AND timestamp < :end "
+                "ORDER BY device_ref, key_ref, timestamp"), bounds,
+                execution_options={"stream_results": True})
+            rows, size = archive.write(path, result.partitions(TIER_BATCH_ROWS))
+            try:
+                if rows:
+                    conn.execute(text(
+                        "INSERT INTO sensor_data_archive "
+                        "(path, range_start, range_end, row_count, size_bytes) "
+                        "VALUES (:path, :start, :end, :rows, :size)"),
+                        dict(bounds, path=path, rows=rows, size=size))
+                if chunk is not None:
+                    conn.execute(text("SELECT drop_chunks('sensor_data', "
+                                      "older_than => :end, newer_than => :start)"), bounds)
+                else:
+                    conn.execute(text("DELETE FROM sensor_data "
+                                      "WHERE timestamp >= :start AND timestamp < :end"), bounds)
+            except BaseException:
+                if rows:
+                    os.remove(path)
+                raise
+    return rows
+
+
+def tier(conn, cutoff: dt.datetime, timescale: bool) -> Tuple[int, int]:
+    """Archiva los tramos que terminan antes de `cutoff`: (tramos, filas)."""
+    os.makedirs(RETENTION_TIER_DIR, exist_ok=True)
+    windows, rows = 0, 0
+    for start, end, chunk in _windows(conn, cutoff, timescale):
+        moved = _tier_window(start, end, chunk)
+        windows += 1
+        rows += moved
+        if moved:
+            logger.info("🧊 %s – %s archivado (%d filas)", start, end, moved)
+    archive.invalidate()
+    if rows:
+        cache.purge()
+    return windows, rows
+
+
+def refresh_blocker(conn, cutoff: dt.datetime) -> Optional[str]:
+    """
+    Motivo para no quitar de la tabla lo anterior a `cutoff`: la política de
+    algún rollup puede refrescar buckets de ese rango (start_offset NULL o
+    demasiado grande).
+    """
+    widths = {iv.rollup: iv.width for iv in rollups.INTERVALS.values()}
+    now = dt.datetime.now(dt.timezone.utc)
+    for view, job, offset in conn.execute(text(
+            "SELECT ca.view_name, j.job_id, "
+            "       CAST(j.config ->> 'start_offset' AS interval) "
+            "FROM timescaledb_information.continuous_aggregates ca "
+            "LEFT JOIN timescaledb_information.jobs j "
+            "  ON j.proc_name = 'policy_refresh_continuous_aggregate' "
+            " AND j.hypertable_schema = ca.materialization_hypertable_schema "
+            " AND j.hypertable_name = ca.materialization_hypertable_name "
+            "WHERE ca.hypertable_name = 'sensor_data'")):
+        if job is None:
+            continue
+        if offset is None:
+            return f"la política de {view} refresca todo el histórico (start_offset NULL)"
+        if now - offset - widths.get(view, dt.timedelta(0)) < cutoff:
+            return f"la política de {view} refresca hasta {offset} atrás"
+    return None
+
+
+def drop_blocker(conn, cutoff: dt.datetime, timescale: bool) -> Optional[str]:
+    """Motivo para no borrar todavía (sin rollups que conserven la historia)."""
+    if not timescale:
+        return "sin TimescaleDB no hay rollups"
+    for iv in rollups.INTERVALS.values():
+        if not rollups.available(conn, iv.rollup):
+            return f"{iv.rollup} no disponible"
+        mark = rollups.watermark(conn, iv.rollup, iv.width)
+        if mark is None or mark < cutoff:
+            return f"{iv.rollup} no materializado hasta {cutoff.isoformat()}"
+    return refresh_blocker(conn, cutoff)
+
+
+def drop(conn, cutoff: dt.datetime) -> Tuple[int, int]:
+    """Borra chunks y tramos archivados anteriores a `cutoff`: (chunks, tramos)."""
+    chunks = len(conn.execute(text(
+        "SELECT drop_chunks('sensor_data', older_than => :cutoff)"),
+        {"cutoff": cutoff}).all())
+    paths = conn.execute(text("DELETE FROM sensor_data_archive "
+                              "WHERE range_end <= :cutoff RETURNING path"),
+                         {"cutoff": cutoff}).scalars().all()
+    conn.commit()
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    archive.invalidate()
+    if chunks or paths:
+        cache.purge()
+    return chunks, len(paths)
+
+
+# ─────────────────────────── Pasada ─────────────────────────── #
+
+def run_once() -> Optional[Dict[str, Any]]:
+    """Aplica las políticas; None si otro proceso tiene la pasada en curso."""
+    started = time.time()
+    now = dt.datetime.now(dt.timezone.utc)
+    result: Dict[str, Any] = {
+        "compressed_chunks": 0, "tiered_windows": 0, "tiered_rows": 0,
+        "dropped_chunks": 0, "dropped_segments": 0, "skipped": [], "errors": [],
+    }
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:id)"),
+                            {"id": LOCK_ID}).scalar():
+            return None
+        conn.commit()
+        try:
+            timescale = _timescale(conn)
+            policies = (
+                ("compress", RETENTION_COMPRESS_DAYS, _compress_step),
+                ("tier", RETENTION_TIER_DAYS, _tier_step),
+                ("drop", RETENTION_DROP_DAYS, _drop_step),
+            )
+            for name, days, step in policies:
+                cutoff = _cutoff(now, days)
+                if cutoff is None:
+                    continue
+                try:
+                    skipped = step(conn, cutoff, timescale, result)
+                    if skipped:
+                        result["skipped"].append(f"{name}: {skipped}")
+                except Exception as exc:
+                    conn.rollback()
+                    logger.warning("⚠️  Retención %s falló: %s", name, exc)
+                    result["errors"].append(f"{name}: {exc}")
+
+            duration_ms = (time.time() - started) * 1000
+            conn.execute(text(
+                "INSERT INTO retention_runs (started_at, duration_ms, result) "
+                "VALUES (:started, :ms, CAST(:result AS jsonb))"),
+                {"started": now, "ms": duration_ms, "result": json.dumps(result)})
+            conn.execute(text("DELETE FROM retention_runs "
+                              f"WHERE started_at < now() - INTERVAL '{RUNS_KEPT}'"))
+            conn.commit()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": LOCK_ID})
+            conn.commit()
+    result.update(started_at=now.isoformat(), duration_ms=round(duration_ms, 1))
+    return result
+
+
+def _compress_step(conn, cutoff, timescale, result) -> Optional[str]:
+    if not timescale:
+        return "sin TimescaleDB"
+    result["compressed_chunks"] = compress(conn, cutoff)
+    return None
+
+
+def _tier_step(conn, cutoff, timescale, result) -> Optional[str]:
+    if not RETENTION_TIER_DIR:
+        return "RETENTION_TIER_DIR vacío"
+    if archive.pa is None:
+        return "pyarrow no está instalado"
+    if timescale and (blocker := refresh_blocker(conn, cutoff)):
+        return blocker
+    result["tiered_windows"], result["tiered_rows"] = tier(conn, cutoff, timescale)
+    return None
+
+
+def _drop_step(conn, cutoff, timescale, result) -> Optional[str]:
+    blocker = drop_blocker(conn, cutoff, timescale)
+    if blocker:
+        return blocker
+    result["dropped_chunks"], result["dropped_segments"] = drop(conn, cutoff)
+    return None
+
+
+# ─────────────────────────── Planificador ─────────────────────────── #
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _loop() -> None:
+    _stop.wait(min(START_DELAY, RETENTION_INTERVAL))
+    while not _stop.is_set():
+        try:
+            result = run_once()
+            if result is not None:
+                logger.info("🧹 Retención aplicada en %.0f ms", result["duration_ms"])
+        except Exception as exc:
+            logger.warning("⚠️  Pasada de retención fallida: %s", exc)
+        _stop.wait(RETENTION_INTERVAL)
+
+
+def start() -> None:
+    """Lanza el planificador si hay alguna política activa."""
+    global _thread
+    if not enabled() or _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="retention", daemon=True)
+    _thread.start()
+    logger.info("🧹 Retención cada %.0f s (compress=%s d, tier=%s d, drop=%s d)",
+                RETENTION_INTERVAL, RETENTION_COMPRESS_DAYS, RETENTION_TIER_DAYS,
+                RETENTION_DROP_DAYS)
+
+
+def stop() -> None:
+    global _thread
+    _stop.set()
+    _thread = None
+
+
+# ─────────────────────────── Estado ─────────────────────────── #
+
+def status(db: Session) -> Dict[str, Any]:
+    """Políticas, última pasada (de cualquier proceso) y almacenamiento."""
+    timescale = _timescale(db)
+    last = db.execute(text(
+        "SELECT started_at, duration_ms, CAST(result AS text) AS result FROM retention_runs "
+        "ORDER BY started_at DESC LIMIT 1")).first()
+
+    storage: Dict[str, Any] = {}
+    if timescale:
+        storage["table_bytes"] = db.execute(text(
+            "SELECT hypertable_size('sensor_data')")).scalar()
+        chunks, compressed = db.execute(text(
+            "SELECT count(*), count(*) FILTER (WHERE is_compressed) "
+            "FROM timescaledb_information.chunks "
+            "WHERE hypertable_name = 'sensor_data'")).one()
+        storage.update(chunks=chunks, compressed_chunks=compressed)
+        if compressed:
+            before, after = db.execute(text(
+                "SELECT sum(before_compression_total_bytes), "
+                "       sum(after_compression_total_bytes) "
+                "FROM hypertable_compression_stats('sensor_data')")).one()
+            storage.update(bytes_before_compression=before,
+                           bytes_after_compression=after)
+    else:
+        storage["table_bytes"] = db.execute(text(
+            "SELECT pg_total_relation_size('sensor_data')")).scalar()
+    segments, rows, size, oldest, newest = db.execute(text(
+        "SELECT count(*), coalesce(sum(row_count), 0), coalesce(sum(size_bytes), 0), "
+        "       min(range_start), max(range_end) FROM sensor_data_archive")).one()
+    storage["archive"] = {"segments": segments, "rows": rows, "bytes": size,
+                          "oldest": oldest, "newest": newest}
+
+    return {
+        "policies": {
+            "interval_s": RETENTION_INTERVAL,
+            "compress_after_days": RETENTION_COMPRESS_DAYS,
+            "tier_after_days": RETENTION_TIER_DAYS,
+            "drop_after_days": RETENTION_DROP_DAYS,
+            "tier_dir": RETENTION_TIER_DIR or None,
+        },
+        "scheduler": enabled(),
+        "timescaledb": timescale,
+        "last_run": None if last is None else {
+            "started_at": last.started_at,
+            "duration_ms": round(last.duration_ms, 1),
+            **json.loads(last.result),
+        },
+        "storage": storage,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from app import migrations
+    migrations.upgrade()
+    print(json.dumps(run_once(), indent=2, default=str))
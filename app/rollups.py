@@ -0,0 +1,406 @@
+"""
+app/rollups.py
+Agregados continuos (TimescaleDB) detrás de `/timeseries/aggregated/*`.
+
+La migración 0002 crea `sensor_data_hourly`, `sensor_data_daily` y
+`sensor_data_weekly` con (total, samples, maximum, minimum) por bucket.
+Para cada petición se elige el rollup más grueso cuyo ancho divide el
+intervalo pedido y el rango se parte en tres tramos:
+
+    [start, body_start)      → datos crudos (bucket parcial inicial)
+    [body_start, body_end)   → rollup, hasta su marca de materialización
+    [body_end, end]          → datos crudos (bucket parcial final + cola
+                               aún no materializada)
+
+Los tramos crudos incluyen también las filas ya archivadas en Parquet
+(app/archive.py): `aggregate_async` / `aggregate_series_async`, que es lo
+que usa la API, las leen fuera del bucle de eventos, las agrupan en Python
+por bucket y las suman a la consulta como una parte más. El cuerpo no las
+necesita: los rollups conservan la historia tras el tiering.
+
+El resultado se re-agrupa al intervalo pedido; la media se recompone como
+sum(total) / sum(samples), igual que AVG sobre los datos crudos. Con `fill`
+se devuelven también los buckets vacíos (time_bucket_gapfill + locf /
+interpolate, o app/gapfill.py sin TimescaleDB).
+
+Sin rollups (ROLLUPS_ENABLED=0 o sin TimescaleDB) todo sale de
+`sensor_data` y del archivo. Sin la extensión tampoco hay time_bucket: los
+buckets se calculan sobre el epoch, anclados en ORIGIN igual que `floor_to`
+(`_bucket`), y los huecos los rellena app/gapfill.py.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+ROLLUPS_ENABLED: bool = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+WATERMARK_TTL: float = float(os.getenv("ROLLUPS_WATERMARK_TTL", "30"))
+
+# Origen de time_bucket en TimescaleDB (lunes): alinea también las semanas
+ORIGIN = dt.datetime(2000, 1, 3, tzinfo=dt.timezone.utc)
+
+logger = logging.getLogger("rollups")
+
+
+class Interval(NamedTuple):
+    width: dt.timedelta         # argumento de time_bucket
+    rollup: Optional[str]       # vista con ese ancho de bucket
+
+
+# Vistas de la migración 0002 (nombre de intervalo de la API → rollup)
+INTERVALS: Dict[str, Interval] = {
+    "hour": Interval(dt.timedelta(hours=1), "sensor_data_hourly"),
+    "day": Interval(dt.timedelta(days=1), "sensor_data_daily"),
+    "week": Interval(dt.timedelta(weeks=1), "sensor_data_weekly"),
+}
+
+
+def floor_to(ts: dt.datetime, width: dt.timedelta) -> dt.datetime:
+    return ORIGIN + ((ts - ORIGIN) // width) * width
+
+
+def ceil_to(ts: dt.datetime, width: dt.timedelta) -> dt.datetime:
+    floored = floor_to(ts, width)
+    return floored if floored == ts else floored + width
+
+
+def as_utc(ts: dt.datetime) -> dt.datetime:
+    """Las fechas sin zona de la query string se interpretan en UTC."""
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=dt.timezone.utc)
+    return ts.astimezone(dt.timezone.utc)
+
+
+# ─────────────────── Disponibilidad y marca de agua ─────────────────── #
+
+_lock = threading.Lock()
+_available: Dict[str, bool] = {}
+_gapfill: List[bool] = []
+_watermarks: Dict[str, Tuple[float, Optional[dt.datetime]]] = {}
+
+
+def available(db: Session, rollup: str) -> bool:
+    if not ROLLUPS_ENABLED:
+        return False
+    with _lock:
+        if rollup in _available:
+            return _available[rollup]
+    exists = db.execute(text("SELECT to_regclass(:n) IS NOT NULL"),
+                        {"n": rollup}).scalar()
+    with _lock:
+        _available[rollup] = bool(exists)
+    return bool(exists)
+
+
+def gapfill_sql(db: Session) -> bool:
+    """True si la base tiene time_bucket_gapfill (TimescaleDB; ver `_bucket`)."""
+    with _lock:
+        if _gapfill:
+            return _gapfill[0]
+    exists = bool(db.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'time_bucket_gapfill')")).scalar())
+    with _lock:
+        _gapfill[:] = [exists]
+    return exists
+
+
+def watermark(db: Session, rollup: str, width: dt.timedelta) -> Optional[dt.datetime]:
+    """Fin del último bucket materializado (cacheado WATERMARK_TTL s)."""
+    now = time.monotonic()
+    with _lock:
+        cached = _watermarks.get(rollup)
+    if cached and now - cached[0] < WATERMARK_TTL:
+        return cached[1]
+    last = db.execute(text(f"SELECT max(bucket) FROM {rollup}")).scalar()
+    mark = as_utc(last) + width if last is not None else None
+    with _lock:
+        _watermarks[rollup] = (now, mark)
+    return mark
+
+
+Layout = Tuple[Optional[Interval], Optional[dt.datetime], Optional[dt.datetime]]
+
+
+def choose(db: Session, intervals: Dict[str, Interval],
+           wanted: Interval) -> Optional[Interval]:
+    """Rollup disponible más grueso cuyo ancho divide el intervalo pedido."""
+    width = wanted.width
+    candidates = sorted(
+        (iv for iv in intervals.values()
+         if iv.rollup and iv.width <= width and width % iv.width == dt.timedelta(0)),
+        key=lambda iv: iv.width, reverse=True,
+    )
+    for iv in candidates:
+        if available(db, iv.rollup):
+            return iv
+    return None
+
+
+# ─────────────────────────── Consulta ─────────────────────────── #
+
+def _bucket(column: str, timescale: bool) -> str:
+    """Bucket de `column` en SQL: time_bucket, o su equivalente sobre el epoch."""
+    if timescale:
+        return f"time_bucket(:interval, {column})"
+    # En segundos y no con aritmética de intervalos: un día no siempre
+    # dura 24 h fuera de UTC, y time_bucket trabaja en UTC
+    return (f"to_timestamp(floor((extract(epoch FROM {column}) - :origin_s) / :width_s)"
+            f" * :width_s + :origin_s)")
+
+
+_RAW = """
+    SELECT device_ref, key_ref, {bucket} AS bucket,
+           sum(value) AS total, count(value) AS samples,
+           max(value) AS maximum, min(value) AS minimum
+    FROM sensor_data
+    WHERE {series} AND {range}
+    GROUP BY device_ref, key_ref, bucket
+"""
+
+# Filas archivadas ya agrupadas por bucket (ver `_archived_part`)
+_ARCHIVED = """
+    SELECT * FROM unnest(CAST(:a_devices AS integer[]), CAST(:a_keys AS integer[]),
+                         CAST(:a_buckets AS timestamptz[]), CAST(:a_totals AS float8[]),
+                         CAST(:a_samples AS bigint[]), CAST(:a_maxima AS float8[]),
+                         CAST(:a_minima AS float8[]))
+        AS archived (device_ref, key_ref, bucket, total, samples, maximum, minimum)
+"""
+
+_ROLLUP = """
+    SELECT device_ref, key_ref, bucket, total, samples, maximum, minimum
+    FROM {rollup}
+    WHERE {series} AND bucket >= :body_start AND bucket < :body_end
+"""
+
+_OUTER = """
+    SELECT {columns}, {bucket} AS b,
+           sum(total) / NULLIF(sum(samples), 0) AS average,
+           max(maximum) AS maximum,
+           min(minimum) AS minimum
+    FROM ({parts}) AS parts
+    GROUP BY device_ref, key_ref, b
+    ORDER BY device_ref, key_ref, b
+"""
+
+# Igual, con todos los buckets de [start, end]; {fill} = "", locf o interpolate
+_OUTER_GAPFILL = """
+    SELECT {columns}, time_bucket_gapfill(:interval, bucket, :start, :finish) AS b,
+           {fill}(sum(total) / NULLIF(sum(samples), 0)) AS average,
+           {fill}(max(maximum)) AS maximum,
+           {fill}(min(minimum)) AS minimum
+    FROM ({parts}) AS parts
+    GROUP BY device_ref, key_ref, b
+    ORDER BY device_ref, key_ref, b
+"""
+_SQL_FILL = {"null": "", "previous": "locf", "linear": "interpolate"}
+
+# Filtro de series: varios dispositivos con una clave, o pares arbitrarios
+# (device_ref, key_ref) pasados como dos arrays paralelos
+_ONE_KEY = "device_ref = ANY(:device_refs) AND key_ref = :key_ref"
+_PAIRS = ("(device_ref, key_ref) IN (SELECT * FROM unnest("
+          "CAST(:device_refs AS integer[]), CAST(:key_refs AS integer[])))")
+
+
+def aggregate(db: Session,
+              intervals: Dict[str, Interval],
+              wanted: Interval,
+              device_refs: Sequence[int],
+              key_ref: int,
+              start: Optional[dt.datetime],
+              end: Optional[dt.datetime],
+              fill: str = "none",
+              archived: Sequence[tuple] = (),
+              layout: Optional[Layout] = None) -> List[tuple]:
+    """
+    Filas (device_ref, bucket, average, maximum, minimum) con buckets de
+    `wanted` (uno de `intervals` o cualquier múltiplo de sus anchos),
+    ordenadas por dispositivo y bucket. `fill` ≠ "none" añade los buckets
+    vacíos (None, valor anterior o interpolación lineal). `archived` son
+    filas (device_ref, key_ref, timestamp, value) de Parquet leídas para
+    `layout` (ver `aggregate_async`).
+    """
+    if not device_refs:
+        return []
+    return _aggregate(db, intervals, wanted, _ONE_KEY, "device_ref",
+                      {"device_refs": list(device_refs), "key_ref": key_ref},
+                      sorted((ref,) for ref in set(device_refs)),
+                      start, end, fill, archived, layout)
+
+
+def aggregate_series(db: Session,
+                     intervals: Dict[str, Interval],
+                     wanted: Interval,
+                     series: Sequence[Tuple[int, int]],
+                     start: Optional[dt.datetime],
+                     end: Optional[dt.datetime],
+                     fill: str = "none",
+                     archived: Sequence[tuple] = (),
+                     layout: Optional[Layout] = None) -> List[tuple]:
+    """
+    Como `aggregate`, pero para pares (device_ref, key_ref) cualesquiera en
+    una única consulta: filas (device_ref, key_ref, bucket, average,
+    maximum, minimum) ordenadas por serie y bucket.
+    """
+    if not series:
+        return []
+    device_refs, key_refs = zip(*series)
+    pairs = set(series)
+    return _aggregate(db, intervals, wanted, _PAIRS, "device_ref, key_ref",
+                      {"device_refs": list(device_refs), "key_refs": list(key_refs)},
+                      sorted(pairs), start, end, fill,
+                      [row for row in archived if (row[0], row[1]) in pairs], layout)
+
+
+async def aggregate_async(db: AsyncSession,
+                          intervals: Dict[str, Interval],
+                          wanted: Interval,
+                          device_refs: Sequence[int],
+                          key_ref: int,
+                          start: Optional[dt.datetime],
+                          end: Optional[dt.datetime],
+                          fill: str = "none") -> List[tuple]:
+    """`aggregate` con las filas archivadas de los tramos crudos."""
+    if not device_refs or start is None or end is None:
+        return []
+    layout, archived = await _read_archived(db, intervals, wanted, device_refs,
+                                            [key_ref], start, end)
+    return await db.run_sync(aggregate, intervals, wanted, device_refs, key_ref,
+                             start, end, fill, archived, layout)
+
+
+async def aggregate_series_async(db: AsyncSession,
+                                 intervals: Dict[str, Interval],
+                                 wanted: Interval,
+                                 series: Sequence[Tuple[int, int]],
+                                 start: Optional[dt.datetime],
+                                 end: Optional[dt.datetime],
+                                 fill: str = "none") -> List[tuple]:
+    """`aggregate_series` con las filas archivadas de los tramos crudos."""
+    if not series or start is None or end is None:
+        return []
+    layout, archived = await _read_archived(
+        db, intervals, wanted, {d for d, _ in series}, {k for _, k in series},
+        start, end)
+    return await db.run_sync(aggregate_series, intervals, wanted, series,
+                             start, end, fill, archived, layout)
+
+
+def plan(db: Session, intervals: Dict[str, Interval], wanted: Interval,
+         start: dt.datetime, end: dt.datetime) -> Layout:
+    """(rollup, body_start, body_end); sin cuerpo si body_end <= body_start."""
+    iv = choose(db, intervals, wanted)
+    if iv is None:
+        return None, None, None
+    body_start = ceil_to(start, iv.width)
+    body_end = floor_to(end, iv.width)
+    mark = watermark(db, iv.rollup, iv.width)
+    body_end = min(body_end, mark) if mark is not None else body_start
+    return iv, body_start, body_end
+
+
+def _has_body(layout: Layout) -> bool:
+    iv, body_start, body_end = layout
+    return iv is not None and body_end > body_start
+
+
+async def _read_archived(db: AsyncSession, intervals: Dict[str, Interval],
+                         wanted: Interval, device_refs: Iterable[int],
+                         key_refs: Iterable[int], start: dt.datetime,
+                         end: dt.datetime) -> Tuple[Layout, List[tuple]]:
+    """Plan de la consulta y filas archivadas de sus tramos crudos."""
+    from app import archive     # importa este módulo
+
+    start, end = as_utc(start), as_utc(end)
+    layout = await db.run_sync(plan, intervals, wanted, start, end)
+    ranges = ([(start, layout[1]), (layout[2], end)] if _has_body(layout)
+              else [(start, end)])
+    archived: List[tuple] = []
+    for lo, hi in ranges:
+        archived += await archive.read(db, list(device_refs), list(key_refs), lo, hi,
+                                       ("device_ref", "key_ref", "timestamp", "value"))
+    return layout, archived
+
+
+def _archived_part(rows: Sequence[tuple], width: dt.timedelta,
+                   layout: Layout) -> dict:
+    """Parámetros de `_ARCHIVED`: filas archivadas agrupadas por bucket."""
+    body = layout[1:] if _has_body(layout) else None
+    acc: Dict[tuple, list] = {}
+    for device_ref, key_ref, ts, value in rows:
+        if value is None or (body is not None and body[0] <= ts < body[1]):
+            continue
+        slot = (device_ref, key_ref, floor_to(ts, width))
+        state = acc.get(slot)
+        if state is None:
+            acc[slot] = [value, 1, value, value]
+        else:
+            state[0] += value
+            state[1] += 1
+            state[2] = max(state[2], value)
+            state[3] = min(state[3], value)
+    slots, states = list(acc), list(acc.values())
+    return {"a_devices": [s[0] for s in slots], "a_keys": [s[1] for s in slots],
+            "a_buckets": [s[2] for s in slots], "a_totals": [s[0] for s in states],
+            "a_samples": [s[1] for s in states], "a_maxima": [s[2] for s in states],
+            "a_minima": [s[3] for s in states]}
+
+
+def _aggregate(db: Session, intervals: Dict[str, Interval], wanted: Interval,
+               series: str, columns: str, params: dict, keys: Sequence[tuple],
+               start: Optional[dt.datetime], end: Optional[dt.datetime],
+               fill: str = "none", archived: Sequence[tuple] = (),
+               layout: Optional[Layout] = None) -> List[tuple]:
+    if start is None or end is None:
+        return []
+    start, end = as_utc(start), as_utc(end)
+    params = dict(params, interval=wanted.width, start=start, end=end,
+                  origin_s=ORIGIN.timestamp(), width_s=wanted.width.total_seconds())
+    timescale = gapfill_sql(db)
+    raw = _bucket("timestamp", timescale)
+
+    if layout is None:
+        layout = plan(db, intervals, wanted, start, end)
+    iv, body_start, body_end = layout
+    if not _has_body(layout):
+        parts = [_RAW.format(bucket=raw, series=series,
+                             range="timestamp BETWEEN :start AND :end")]
+    else:
+        params.update(body_start=body_start, body_end=body_end)
+        parts = [
+            _RAW.format(bucket=raw, series=series,
+                        range="timestamp >= :start AND timestamp < :body_start"),
+            _ROLLUP.format(rollup=iv.rollup, series=series),
+            _RAW.format(bucket=raw, series=series,
+                        range="timestamp >= :body_end AND timestamp <= :end"),
+        ]
+    if archived:
+        params.update(_archived_part(archived, wanted.width, layout))
+        parts.append(_ARCHIVED)
+    parts = " UNION ALL ".join(parts)
+    outer = _OUTER.format(columns=columns, bucket=_bucket("bucket", timescale),
+                          parts=parts)
+
+    if fill == "none":
+        return db.execute(text(outer), params).all()
+    from app import gapfill     # importa este módulo
+
+    key_columns = len(keys[0])
+    if timescale:
+        # finish es exclusivo; el rango de la API incluye `end`
+        params["finish"] = end + dt.timedelta(microseconds=1)
+        sql = _OUTER_GAPFILL.format(columns=columns, parts=parts, fill=_SQL_FILL[fill])
+        rows = db.execute(text(sql), params).all()
+    else:
+        rows = db.execute(text(outer), params).all()
+        rows = gapfill.fill_buckets(rows, key_columns, start, end, wanted.width, fill)
+    # time_bucket_gapfill y fill_buckets sólo rellenan las series con filas
+    return gapfill.with_empty(rows, keys, key_columns, start, end, wanted.width)
@@ -0,0 +1,323 @@
+"""
+app/rules.py
+Reglas de decodificación y filtrado por aplicación / dispositivo.
+
+Sin reglas, cada uplink guarda los campos numéricos de primer nivel de
+`object` (app/decoder.py). INGEST_RULES_FILE apunta a un JSON con una lista
+de reglas que cambian eso para las aplicaciones o devEUIs indicados:
+
+    {"rules": [
+      {"application": "b2fe8cb4-…",              // opcional (`*` = todas)
+       "devices": ["2cf7f1c0443000f2"],          // opcional
+       "include": ["Temperatura", "gps.*"],      // patrones fnmatch
+       "exclude": ["Luz"],
+       "flatten": true,                          // {"gps": {"lat": 1}} → gps.lat
+       "scale": {"Presion": 0.01,                // valor × factor + offset
+                 "Temperatura": {"factor": 1.8, "offset": 32}},
+       "on_change": ["Lluvia_*"],                // o true: sólo si cambia
+       "deadband": {"Temperatura": 0.2},         // sólo si |Δ| > 0.2
+       "deadband_pct": {"Bateria": 1},           // sólo si |Δ| > 1 % del último
+       "heartbeat": 900,                         // …o si pasaron 900 s
+       "min_interval": {"*": 60}}                // o 60: como mucho 1 cada N s
+    ]}
+
+Las reglas se compilan una vez en tablas indexadas por (aplicación, devEUI):
+se elige la más específica (aplicación + dispositivo, dispositivo,
+aplicación, regla por defecto) y la resolución de cada par y de cada clave
+se memoriza, así que en régimen el coste por campo es una búsqueda en un
+diccionario.
+
+Banda muerta: con `on_change` / `deadband` / `deadband_pct` una muestra sólo
+se guarda si difiere del último valor almacenado en más de
+max(deadband, deadband_pct % · |último|); `heartbeat` fuerza a guardar al
+menos una cada N s aunque no cambie, así que la serie sigue viva y
+`/timeseries/?fill=previous|step` puede reconstruirla sin perder
+información. Los límites usan la marca de tiempo del uplink y el último
+valor almacenado de cada (devEUI, clave) vive en el worker: el reparto por
+devEUI (app/workers.py) hace que cada serie tenga un único dueño. Con
+MQTT_SHARE_GROUP el broker reparte los uplinks de un mismo dispositivo
+entre instancias sin afinidad, así que ese estado no sería fiable: las
+reglas con on_change / deadband* / min_interval se rechazan al cargarlas.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import fnmatch
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from app import metrics
+from app.decoder import Uplink
+from app.sinks import Row
+
+INGEST_RULES_FILE: str = os.getenv("INGEST_RULES_FILE", "")
+MQTT_SHARE_GROUP: str = os.getenv("MQTT_SHARE_GROUP", "")      # app/mqtt_client.py
+
+logger = logging.getLogger("rules")
+
+filtered = metrics.Counter("ingest_values_filtered_total",
+                           "Valores descartados por las reglas de ingesta", ("reason",))
+
+
+class Field(NamedTuple):
+    """Tratamiento compilado de una clave."""
+
+    factor: float = 1.0
+    offset: float = 0.0
+    gated: bool = False             # banda muerta (on_change / deadband*)
+    deadband: float = 0.0
+    deadband_pct: float = 0.0
+    heartbeat: float = 0.0
+    min_interval: float = 0.0
+
+
+def _is_pattern(name: str) -> bool:
+    return any(c in name for c in "*?[")
+
+
+class _Patterns:
+    """Nombres exactos + patrones fnmatch unidos en una expresión regular."""
+
+    def __init__(self, patterns: Sequence[str]):
+        self.exact = {p for p in patterns if not _is_pattern(p)}
+        wild = [fnmatch.translate(p) for p in patterns if p not in self.exact]
+        self.regex = re.compile("|".join(wild)) if wild else None
+
+    def __bool__(self) -> bool:
+        return bool(self.exact) or self.regex is not None
+
+    def match(self, key: str) -> bool:
+        return key in self.exact or (self.regex is not None
+                                     and self.regex.match(key) is not None)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_scale(value: Any) -> bool:
+    if isinstance(value, dict):
+        return (bool(value) and not set(value) - {"factor", "offset"}
+                and all(_is_number(v) for v in value.values()))
+    return _is_number(value)
+
+
+# Valores admitidos por opción (los dicts sólo en `scale`)
+_VALID = {
+    "scale": _is_scale,
+    "on_change": lambda v: isinstance(v, bool),
+    "deadband": lambda v: _is_number(v) and v >= 0,
+    "deadband_pct": lambda v: _is_number(v) and v >= 0,
+    "heartbeat": lambda v: _is_number(v) and v >= 0,
+    "min_interval": lambda v: _is_number(v) and v >= 0,
+}
+
+
+def _by_pattern(spec: Any, name: str) -> List[Tuple[_Patterns, Any]]:
+    """`valor` o `{patrón: valor}` → [(patrones, valor)], exactos primero."""
+    if not isinstance(spec, dict):
+        spec = {"*": spec}
+    table = sorted(((_Patterns([k]), v) for k, v in spec.items()),
+                   key=lambda item: item[0].regex is not None)
+    for _, value in table:
+        if not _VALID[name](value):
+            raise ValueError(f"'{name}': valor no válido {value!r}")
+    return table
+
+
+def _lookup(table: List[Tuple[_Patterns, Any]], key: str, default: Any) -> Any:
+    for patterns, value in table:
+        if patterns.match(key):
+            return value
+    return default
+
+
+class Rule:
+    """Una regla compilada; `field(key)` memoriza el tratamiento de cada clave."""
+
+    def __init__(self, spec: Dict[str, Any]):
+        unknown = set(spec) - {"application", "devices", "include", "exclude",
+                               "flatten", "scale", "on_change", "deadband",
+                               "deadband_pct", "heartbeat", "min_interval"}
+        if unknown:
+            raise ValueError(f"opciones desconocidas: {', '.join(sorted(unknown))}")
+        self.include = _Patterns(spec.get("include") or ())
+        self.exclude = _Patterns(spec.get("exclude") or ())
+        self.flatten = bool(spec.get("flatten", False))
+        on_change = spec.get("on_change", False)
+        if isinstance(on_change, list):
+            on_change = {k: True for k in on_change}
+        self._scale = _by_pattern(spec.get("scale") or {}, "scale")
+        self._on_change = _by_pattern(on_change, "on_change")
+        self._deadband = _by_pattern(spec.get("deadband", {}), "deadband")
+        self._deadband_pct = _by_pattern(spec.get("deadband_pct", {}), "deadband_pct")
+        self._heartbeat = _by_pattern(spec.get("heartbeat", 0), "heartbeat")
+        self._interval = _by_pattern(spec.get("min_interval", 0), "min_interval")
+        self.limited = (any(v for _, v in self._on_change + self._interval)
+                        or bool(self._deadband) or bool(self._deadband_pct))
+        self._fields: Dict[str, Optional[Field]] = {}
+
+    def field(self, key: str) -> Optional[Field]:
+        """Tratamiento de `key`; None si la regla la descarta."""
+        try:
+            return self._fields[key]
+        except KeyError:
+            pass
+        if (self.include and not self.include.match(key)) or self.exclude.match(key):
+            found = None
+        else:
+            scale = _lookup(self._scale, key, 1.0)
+            if isinstance(scale, dict):
+                factor, offset = scale.get("factor", 1.0), scale.get("offset", 0.0)
+            else:
+                factor, offset = scale, 0.0
+            deadband = _lookup(self._deadband, key, None)
+            deadband_pct = _lookup(self._deadband_pct, key, None)
+            gated = (bool(_lookup(self._on_change, key, False))
+                     or deadband is not None or deadband_pct is not None)
+            found = Field(float(factor), float(offset), gated,
+                          float(deadband or 0), float(deadband_pct or 0),
+                          float(_lookup(self._heartbeat, key, 0)) if gated else 0.0,
+                          float(_lookup(self._interval, key, 0)))
+        self._fields[key] = found
+        return found
+
+    def values(self, obj: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """(clave, valor) candidatos de `object`, aplanados si procede."""
+        if not self.flatten:
+            return iter(obj.items())
+        return _flatten(obj, "")
+
+
+def _flatten(obj: Dict[str, Any], prefix: str) -> Iterator[Tuple[str, Any]]:
+    for key, value in obj.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield prefix + key, value
+
+
+class RuleSet:
+    """Reglas indexadas por (aplicación, devEUI); `None` = comodín."""
+
+    def __init__(self, specs: Sequence[Dict[str, Any]]):
+        self._table: Dict[Tuple[Optional[str], Optional[str]], Rule] = {}
+        for i, spec in enumerate(specs):
+            try:
+                rule = Rule(spec)
+            except (ValueError, TypeError) as exc:
+                raise ValueError(f"{INGEST_RULES_FILE or 'reglas'}: regla {i}: {exc}") from None
+            application = spec.get("application")
+            application = None if application in (None, "*") else str(application)
+            for device in spec.get("devices") or (None,):
+                target = (application, device.lower() if device else None)
+                if target in self._table:
+                    raise ValueError(f"regla {i}: selector repetido {target}")
+                self._table[target] = rule
+        self._resolved: Dict[Tuple[Optional[str], Optional[str]], Optional[Rule]] = {}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    @property
+    def limited(self) -> bool:
+        """True si alguna regla guarda estado por serie (banda muerta o frecuencia)."""
+        return any(rule.limited for rule in self._table.values())
+
+    def lookup(self, application: Optional[str], device: Optional[str]) -> Optional[Rule]:
+        pair = (application, device)
+        try:
+            return self._resolved[pair]
+        except KeyError:
+            pass
+        dev = device.lower() if device else None
+        table = self._table
+        rule = (table.get((application, dev)) or table.get((None, dev))
+                or table.get((application, None)) or table.get((None, None)))
+        self._resolved[pair] = rule
+        return rule
+
+
+def load(path: str = INGEST_RULES_FILE) -> Optional[RuleSet]:
+    """Compila el fichero de reglas (None si no hay)."""
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as fh:
+        spec = json.load(fh)
+    rules = RuleSet(spec["rules"] if isinstance(spec, dict) else spec)
+    if rules.limited and MQTT_SHARE_GROUP:
+        raise ValueError(f"{path}: on_change, deadband, deadband_pct y min_interval "
+                         "necesitan que todos los uplinks de un dispositivo pasen por "
+                         "el mismo proceso, y MQTT_SHARE_GROUP los reparte entre "
+                         "instancias")
+    logger.info("📐 %d selectores de reglas de ingesta cargados de %s", len(rules), path)
+    return rules
+
+
+_ruleset: Optional[RuleSet] = None
+_loaded = False
+
+
+def ruleset() -> Optional[RuleSet]:
+    """Reglas del proceso, compiladas la primera vez."""
+    global _ruleset, _loaded
+    if not _loaded:
+        _ruleset, _loaded = load(), True
+    return _ruleset
+
+
+class Filter:
+    """Reglas compartidas + últimos valores almacenados de un worker."""
+
+    def __init__(self, rules: RuleSet):
+        self.rules = rules
+        self._last: Dict[Tuple[str, str], Tuple[Any, dt.datetime]] = {}
+
+    def rows(self, up: Uplink) -> List[Row]:
+        rule = self.rules.lookup(up.application_id, up.dev_eui)
+        if rule is None:
+            return [(up.dev_eui, key, value, up.time)
+                    for key, value in up.object.items()
+                    if isinstance(value, (int, float))]
+        rows = []
+        for key, value in rule.values(up.object):
+            if not isinstance(value, (int, float)):
+                continue
+            field = rule.field(key)
+            if field is None:
+                filtered.inc(1, "excluded")
+                continue
+            if field.factor != 1.0 or field.offset:
+                value = value * field.factor + field.offset
+            if rule.limited and not self._allow(up.dev_eui, key, value, up.time, field):
+                continue
+            rows.append((up.dev_eui, key, value, up.time))
+        return rows
+
+    def _allow(self, device: str, key: str, value: Any, ts: dt.datetime,
+               field: Field) -> bool:
+        series = (device, key)
+        last = self._last.get(series)
+        if last is not None:
+            elapsed = (ts - last[1]).total_seconds()
+            if field.min_interval and elapsed < field.min_interval:
+                filtered.inc(1, "rate")
+                return False
+            if field.gated and not (field.heartbeat and elapsed >= field.heartbeat):
+                band = max(field.deadband, abs(last[0]) * field.deadband_pct / 100)
+                if abs(value - last[0]) <= band:
+                    filtered.inc(1, "deadband")
+                    return False
+        if field.gated or field.min_interval:
+            self._last[series] = (value, ts)
+        return True
+
+
+def new_filter() -> Optional[Filter]:
+    """Filtro nuevo para un worker (None si no hay reglas)."""
+    rules = ruleset()
+    return Filter(rules) if rules is not None else None
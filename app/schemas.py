@@ -1,5 +1,10 @@
+import os
 from datetime import datetime
-from pydantic import BaseModel
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+# Máximo de series (device_id, key) por petición a /timeseries/aggregated/batch/
+BATCH_MAX_SERIES = int(os.getenv("BATCH_MAX_SERIES", "500"))
 
 class SensorDataBase(BaseModel):
     device_id: str
@@ -14,3 +19,20 @@ class SensorDataCreate(SensorDataBase):
 
 class SensorDataResponse(SensorDataBase):
     id: int
+
+class SensorLatestResponse(SensorDataBase):
+    id: Optional[int] = None   # la caché de últimos valores no guarda el id
+
+class SensorSeriesResponse(SensorDataBase):
+    id: Optional[int] = None   # los puntos promediados (method=avg) no tienen id
+
+class SeriesRef(BaseModel):
+    device_id: str
+    key: str
+
+class BatchAggregateRequest(BaseModel):
+    series: List[SeriesRef] = Field(..., min_length=1, max_length=BATCH_MAX_SERIES)
+    start: datetime
+    end: datetime
+    interval: str = "hour"
+    fill: str = "none"
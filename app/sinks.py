@@ -0,0 +1,199 @@
+"""
+app/sinks.py
+Destinos de escritura para las filas de `sensor_data`.
+
+Todas las escrituras (pipeline de ingesta y herramientas de backfill) pasan
+por un `Sink`, que traduce device_id/key a sus ids de diccionario
+(app/dictionary.py) antes de insertar. La estrategia de inserción se elige
+en un único punto con la variable INGEST_SINK:
+
+    orm   → INSERT … SELECT unnest(arrays) a través de la sesión SQLAlchemy
+    copy  → COPY FROM STDIN (psycopg2) a una tabla temporal de staging y
+            INSERT … SELECT desde ella
+
+Todas insertan con `ON CONFLICT DO NOTHING` sobre el índice único
+(device_ref, key_ref, timestamp) y contabilizan las filas repetidas
+(ver app/dedup.py).
+
+Si LATEST_CACHE=table, cada lote actualiza también `sensor_latest` (UPSERT)
+en la misma transacción (ver app/latest.py).
+
+El servicio de ingesta asíncrono (app/ingest_service.py) usa `AsyncpgSink`,
+que hace COPY binario (también a través de staging) sobre un pool de asyncpg.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import io
+import os
+from typing import Sequence, Tuple
+
+from sqlalchemy import text
+
+from app import dictionary, latest
+from app.database import SessionLocal, engine
+from app.models import SensorData
+from app.status import update_ingest
+
+SINK: str = os.getenv("INGEST_SINK", "copy")
+
+# (device_id, key, value, timestamp)
+Row = Tuple[str, str, float, dt.datetime]
+
+COLUMNS = ("device_ref", "key_ref", "value", "timestamp")
+_COLS = ", ".join(COLUMNS)
+TABLE = SensorData.__tablename__
+STAGE = "sensor_data_stage"
+
+# Staging por conexión; ON COMMIT DELETE ROWS la deja vacía tras cada lote
+CREATE_STAGE = f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGE} (
+        device_ref INTEGER, key_ref INTEGER,
+        value DOUBLE PRECISION, timestamp TIMESTAMPTZ
+    ) ON COMMIT DELETE ROWS
+"""
+INSERT_STAGE = (f"INSERT INTO {TABLE} ({_COLS}) SELECT {_COLS} FROM {STAGE} "
+                "ON CONFLICT DO NOTHING")
+INSERT_ARRAYS = f"""
+    INSERT INTO {TABLE} ({_COLS})
+    SELECT * FROM unnest(CAST(:devices AS int[]), CAST(:keys AS int[]),
+                         CAST(:values AS float8[]), CAST(:stamps AS timestamptz[]))
+    ON CONFLICT DO NOTHING
+"""
+
+
+def _count_duplicates(total: int, inserted: int) -> None:
+    if inserted < total:
+        update_ingest(duplicates=total - inserted)
+
+
+class Sink:
+    """Interfaz común: `write` persiste las filas y hace commit."""
+
+    name = "base"
+
+    def write(self, rows: Sequence[Row]) -> int:
+        """Escribe las filas en una sola transacción y devuelve cuántas."""
+        raise NotImplementedError
+
+
+class OrmSink(Sink):
+    """INSERT de arrays columnares (`unnest`) mediante la sesión ORM."""
+
+    name = "orm"
+
+    def write(self, rows: Sequence[Row]) -> int:
+        if not rows:
+            return 0
+        # Diccionarios en su propia transacción (ver app/dictionary.py)
+        refs = dictionary.to_refs(rows)
+        session = SessionLocal()
+        try:
+            result = session.execute(
+                text(INSERT_ARRAYS),
+                {"devices": [r[0] for r in refs], "keys": [r[1] for r in refs],
+                 "values": [r[2] for r in refs], "stamps": [r[3] for r in refs]},
+            )
+            _count_duplicates(len(refs), result.rowcount)
+            if latest.PERSIST:
+                devices, keys, values, stamps = latest.upsert_params(refs)
+                session.execute(
+                    text(latest.UPSERT_ORM),
+                    {"devices": devices, "keys": keys,
+                     "values": values, "stamps": stamps},
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return len(rows)
+
+
+def _copy_text(value) -> str:
+    """Escapa un valor para el formato texto de COPY."""
+    if value is None:
+        return r"\N"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+class CopySink(Sink):
+    """`COPY ... FROM STDIN` en formato texto desde un StringIO (vía staging)."""
+
+    name = "copy"
+    columns = COLUMNS
+
+    def write(self, rows: Sequence[Row]) -> int:
+        if not rows:
+            return 0
+        refs = dictionary.to_refs(rows)
+        buf = io.StringIO()
+        buf.writelines(
+            f"{d}\t{k}\t{_copy_text(v)}\t{_copy_text(ts)}\n"
+            for d, k, v, ts in refs
+        )
+        buf.seek(0)
+
+        conn = engine.raw_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(CREATE_STAGE)
+                cur.copy_expert(f"COPY {STAGE} ({_COLS}) FROM STDIN", buf)
+                cur.execute(INSERT_STAGE)
+                _count_duplicates(len(refs), cur.rowcount)
+                if latest.PERSIST:
+                    cur.execute(latest.UPSERT_PSYCOPG, latest.upsert_params(refs))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return len(rows)
+
+
+class AsyncpgSink:
+    """COPY binario (`copy_records_to_table`) sobre un pool de asyncpg."""
+
+    name = "asyncpg"
+    columns = CopySink.columns
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def write(self, rows: Sequence[Row]) -> int:
+        if not rows:
+            return 0
+        async with self.pool.acquire() as conn:
+            # Diccionarios antes y fuera de la transacción de los datos
+            records = [(d, k, float(v), ts) for d, k, v, ts
+                       in await dictionary.to_refs_async(conn, rows)]
+            async with conn.transaction():
+                await conn.execute(CREATE_STAGE)
+                await conn.copy_records_to_table(STAGE, records=records,
+                                                 columns=self.columns)
+                status = await conn.execute(INSERT_STAGE)      # "INSERT 0 <n>"
+                _count_duplicates(len(records), int(status.rsplit(" ", 1)[-1]))
+                if latest.PERSIST:
+                    await conn.execute(latest.UPSERT_ASYNCPG,
+                                       *latest.upsert_params(records))
+        return len(rows)
+
+
+SINKS = {cls.name: cls for cls in (OrmSink, CopySink)}
+
+
+def get_sink(name: str = SINK) -> Sink:
+    """Instancia el sink configurado (INGEST_SINK)."""
+    try:
+        return SINKS[name]()
+    except KeyError:
+        raise ValueError(
+            f"INGEST_SINK desconocido: {name!r}. Usa uno de: {', '.join(SINKS)}"
+        ) from None
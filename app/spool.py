@@ -0,0 +1,334 @@
+"""
+app/spool.py
+Spool local en disco para no perder filas cuando la BD cae o va lenta.
+
+El pipeline de ingesta (app/ingest.py) escribe aquí, en lugar de descartar:
+
+    * los lotes cuyo volcado falla, y
+    * los uplinks que no caben en la cola, sin bloquear al cliente MQTT.
+
+Formato: segmentos append-only `SPOOL_DIR/<secuencia>.seg` de hasta
+SPOOL_SEGMENT_BYTES, con registros `<longitud u32><crc32 u32><payload>`;
+cada payload es un array JSON de filas `[device_id, key, value, µs epoch]`.
+Escritura secuencial con buffer y `flush` por registro (sobrevive a la
+caída del proceso); SPOOL_FSYNC decide cuándo se fuerza a disco:
+
+    always   → fsync tras cada registro
+    interval → como mucho cada SPOOL_FSYNC_INTERVAL segundos (por defecto)
+    never    → lo decide el sistema operativo
+
+El reproductor (`replay`) lee los segmentos cerrados en lotes de
+SPOOL_REPLAY_BATCH filas y borra cada segmento cuando se ha volcado entero.
+Entrega *at-least-once*: un reinicio a mitad de segmento lo repite. Un lote
+que falla por algo que no es la conexión (datos que la BD rechaza) se
+reintenta SPOOL_REPLAY_ATTEMPTS veces y después se aparta a
+`SPOOL_DIR/dead/` con el mismo formato, para que no bloquee al resto; para
+reinyectarlo basta moverlo de vuelta a SPOOL_DIR.
+Superado SPOOL_MAX_BYTES se rechazan registros nuevos (y se contabilizan
+como descartados).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import pathlib
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from app.sinks import Row
+from app.status import update_ingest
+
+try:
+    import orjson
+except ImportError:             # pragma: no cover
+    orjson = None
+
+try:
+    from asyncpg.exceptions import (InterfaceError, OperatorInterventionError,
+                                    PostgresConnectionError)
+    _ASYNCPG_TRANSIENT: tuple = (InterfaceError, OperatorInterventionError,
+                                 PostgresConnectionError)
+except ImportError:             # pragma: no cover
+    _ASYNCPG_TRANSIENT = ()
+
+try:
+    import psycopg2
+    _PSYCOPG_TRANSIENT: tuple = (psycopg2.OperationalError, psycopg2.InterfaceError)
+except ImportError:             # pragma: no cover
+    _PSYCOPG_TRANSIENT = ()
+
+SPOOL_DIR: str = os.getenv("SPOOL_DIR", "")                 # vacío → sin spool
+SPOOL_MAX_BYTES: int = int(os.getenv("SPOOL_MAX_BYTES", str(1024 ** 3)))
+SPOOL_SEGMENT_BYTES: int = int(os.getenv("SPOOL_SEGMENT_BYTES", str(64 * 1024 ** 2)))
+SPOOL_FSYNC: str = os.getenv("SPOOL_FSYNC", "interval")     # always | interval | never
+SPOOL_FSYNC_INTERVAL: float = float(os.getenv("SPOOL_FSYNC_INTERVAL", "1.0"))
+SPOOL_REPLAY_BATCH: int = int(os.getenv("SPOOL_REPLAY_BATCH", "50000"))   # filas
+SPOOL_RETRY_MAX: float = float(os.getenv("SPOOL_RETRY_MAX", "30"))        # segundos
+SPOOL_REPLAY_ATTEMPTS: int = int(os.getenv("SPOOL_REPLAY_ATTEMPTS", "5"))
+
+logger = logging.getLogger("spool")
+
+_HEADER = struct.Struct("<II")
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_US = dt.timedelta(microseconds=1)
+
+if orjson is not None:
+    _dumps, _loads = orjson.dumps, orjson.loads
+else:                           # pragma: no cover
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+    _loads = json.loads
+
+
+def encode(rows: Sequence[Row]) -> bytes:
+    return _dumps([[d, k, v, (ts - _EPOCH) // _US] for d, k, v, ts in rows])
+
+
+def decode(payload: bytes) -> List[Row]:
+    return [(d, k, v, _EPOCH + dt.timedelta(microseconds=us))
+            for d, k, v, us in _loads(payload)]
+
+
+def _transient(exc: BaseException) -> bool:
+    """True si el fallo es de conexión / disponibilidad (no del lote)."""
+    if isinstance(exc, (OperationalError, OSError, asyncio.TimeoutError)
+                  + _ASYNCPG_TRANSIENT + _PSYCOPG_TRANSIENT):
+        return True
+    return isinstance(exc, DBAPIError) and exc.connection_invalidated
+
+
+class Spool:
+    """Segmentos append-only en `path`; seguro entre hilos."""
+
+    def __init__(self,
+                 path: str,
+                 max_bytes: int = SPOOL_MAX_BYTES,
+                 segment_bytes: int = SPOOL_SEGMENT_BYTES,
+                 fsync: str = SPOOL_FSYNC,
+                 fsync_interval: float = SPOOL_FSYNC_INTERVAL):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._active: Optional[pathlib.Path] = None
+        self._last_sync = 0.0
+        self._offsets = {}          # segmento → bytes ya reproducidos
+        self._failures = {}         # (segmento, offset) → intentos fallidos
+        existing = self.segments()
+        self._seq = int(existing[-1].stem) + 1 if existing else 0
+        self._bytes = sum(p.stat().st_size for p in existing)
+        if existing:
+            logger.warning("💾 Spool con %d segmentos pendientes (%d bytes)",
+                           len(existing), self._bytes)
+
+    # ─────────────────────────── Escritura ─────────────────────────── #
+
+    def append(self, rows: Sequence[Row]) -> bool:
+        """Añade un registro; False si el spool está lleno."""
+        if not rows:
+            return True
+        payload = encode(rows)
+        size = _HEADER.size + len(payload)
+        with self._lock:
+            if self._bytes + size > self.max_bytes:
+                logger.error("🛑 Spool lleno (%d bytes): descartadas %d filas",
+                             self._bytes, len(rows))
+                update_ingest(dropped=len(rows))
+                return False
+            if self._file is None or self._file.tell() + size > self.segment_bytes:
+                self._rotate()
+            self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+            self._file.write(payload)
+            self._file.flush()
+            self._bytes += size
+            self._sync()
+        update_ingest(spooled=len(rows), spool_bytes=self._bytes)
+        return True
+
+    def _sync(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or self.fsync == "always" or (
+                self.fsync == "interval" and now - self._last_sync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def _rotate(self) -> None:
+        """Cierra el segmento activo (queda listo para reproducir) y abre otro."""
+        self._close_active()
+        self._active = self.path / f"{self._seq:012d}.seg"
+        self._seq += 1
+        self._file = open(self._active, "ab", buffering=1024 * 1024)
+
+    def _close_active(self) -> None:
+        if self._file is not None:
+            if self.fsync != "never":
+                self._sync(force=True)
+            self._file.close()
+            self._file = None
+            self._active = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_active()
+
+    # ─────────────────────────── Lectura ─────────────────────────── #
+
+    def segments(self) -> List[pathlib.Path]:
+        return sorted(self.path.glob("*.seg"))
+
+    def pending(self) -> bool:
+        return self._bytes > 0
+
+    def _closed_segments(self) -> List[pathlib.Path]:
+        """Segmentos cerrados; si sólo queda el activo con datos, lo cierra."""
+        with self._lock:
+            closed = [p for p in self.segments() if p != self._active]
+            if not closed and self._file is not None and self._file.tell() > 0:
+                closed = [self._active]
+                self._close_active()
+            return closed
+
+    def batches(self, size: int = SPOOL_REPLAY_BATCH
+                ) -> Iterator[Tuple[pathlib.Path, int, List[Row]]]:
+        """
+        (segmento, offset final, filas) en lotes de ~`size` filas, empezando
+        en lo ya confirmado de cada segmento. Un registro truncado o con CRC
+        incorrecto (escritura cortada) termina el segmento.
+        """
+        for seg in self._closed_segments():
+            rows: List[Row] = []
+            with open(seg, "rb") as fh:
+                fh.seek(self._offsets.get(seg, 0))
+                while True:
+                    header = fh.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    length, crc = _HEADER.unpack(header)
+                    payload = fh.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        logger.error("⚠️  Registro corrupto en %s (offset %d): "
+                                     "se descarta el resto del segmento",
+                                     seg.name, fh.tell())
+                        break
+                    rows.extend(decode(payload))
+                    if len(rows) >= size:
+                        yield seg, fh.tell(), rows
+                        rows = []
+                end = fh.tell()
+            yield seg, end, rows
+            self.ack(seg, done=True)
+
+    def ack(self, seg: pathlib.Path, offset: int = 0, done: bool = False) -> None:
+        """Confirma lo reproducido hasta `offset`; `done` borra el segmento."""
+        with self._lock:
+            self._failures.pop((seg, offset), None)
+            if not done:
+                self._offsets[seg] = offset
+                return
+            if not seg.exists():
+                return
+            self._bytes = max(0, self._bytes - seg.stat().st_size)
+            self._offsets.pop(seg, None)
+            seg.unlink()
+        update_ingest(spool_bytes=self._bytes)
+
+    def failed(self, seg: pathlib.Path, offset: int, rows: Sequence[Row],
+               exc: BaseException, attempts: int = SPOOL_REPLAY_ATTEMPTS) -> bool:
+        """
+        Anota un fallo al reproducir el lote que termina en `offset`. Los
+        fallos de conexión no cuentan; al llegar a `attempts` el lote se
+        aparta a `dead/` y se confirma. True si se apartó.
+        """
+        if _transient(exc):
+            return False
+        with self._lock:
+            count = self._failures.get((seg, offset), 0) + 1
+            self._failures[(seg, offset)] = count
+        if count < attempts:
+            return False
+        dead = self.path / "dead"
+        dead.mkdir(exist_ok=True)
+        payload = encode(rows)
+        with open(dead / f"{seg.stem}-{offset:012d}.seg", "wb") as fh:
+            fh.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+            fh.write(payload)
+            fh.flush()
+            os.fsync(fh.fileno())
+        logger.error("☠️  Lote de %d filas de %s apartado a dead/ tras %d intentos: %s",
+                     len(rows), seg.name, count, exc)
+        update_ingest(dead_lettered=len(rows))
+        self.ack(seg, offset)
+        return True
+
+
+# ─────────────────────────── Reproducción ─────────────────────────── #
+
+def replay(spool: Spool, write) -> int:
+    """
+    Vuelca el spool con `write(rows)` (síncrono). Devuelve las filas
+    reproducidas; la excepción del sink se propaga y el lote se reintenta
+    (ver `Spool.failed`).
+    """
+    total = 0
+    for seg, offset, rows in spool.batches():
+        if rows:
+            try:
+                write(rows)
+            except Exception as exc:
+                if not spool.failed(seg, offset, rows, exc):
+                    raise
+                continue
+            total += len(rows)
+            update_ingest(replayed=len(rows))
+        spool.ack(seg, offset)
+    return total
+
+
+async def replay_async(spool: Spool, write) -> int:
+    """
+    Como `replay` con un `write` asíncrono; la lectura de segmentos, las
+    confirmaciones y el borrado van a un hilo para no bloquear el bucle.
+    """
+    total = 0
+    batches = spool.batches()
+    while True:
+        item = await asyncio.to_thread(next, batches, None)
+        if item is None:
+            return total
+        seg, offset, rows = item
+        if rows:
+            try:
+                await write(rows)
+            except Exception as exc:
+                if not await asyncio.to_thread(spool.failed, seg, offset, rows, exc):
+                    raise
+                continue
+            total += len(rows)
+            update_ingest(replayed=len(rows))
+        await asyncio.to_thread(spool.ack, seg, offset)
+
+
+def get_spool() -> Optional[Spool]:
+    """Spool del proceso si SPOOL_DIR está configurado."""
+    global _spool
+    with _spool_lock:
+        if _spool is None and SPOOL_DIR:
+            _spool = Spool(SPOOL_DIR)
+        return _spool
+
+
+_spool: Optional[Spool] = None
+_spool_lock = threading.Lock()
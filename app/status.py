@@ -23,3 +23,61 @@ def update(connected: bool, rc: int) -> None:
     mqtt_status["connected"] = connected
     mqtt_status["last_rc"] = rc
     mqtt_status["last_ts"] = time.time()
+
+
+ingest_status = {
+    "queue_depth": 0,     # int   (mensajes pendientes en la cola)
+    "rows_written": 0,    # int
+    "flushes": 0,         # int   (lotes volcados)
+    "last_flush_ms": None,  # float (latencia del último volcado)
+    "max_flush_ms": None,   # float
+    "dropped_rows": 0,    # int   (descartadas por cola llena)
+    "dropped_messages": 0,  # int (uplinks descartados con la cola de parseo llena)
+    "flush_errors": 0,    # int
+    "last_flush_ts": None,  # float (epoch segundos)
+    "spooled_rows": 0,    # int   (filas enviadas al spool en disco)
+    "replayed_rows": 0,   # int   (filas del spool ya volcadas)
+    "spool_bytes": 0,     # int   (tamaño pendiente del spool)
+    "dead_lettered_rows": 0,  # int (filas del spool apartadas a dead/)
+    "duplicates_dropped": 0,  # int (uplinks/filas repetidos descartados)
+}
+
+def update_ingest(queue_depth: int = None, rows: int = 0,
+                  flush_ms: float = None, dropped: int = 0,
+                  errors: int = 0, dropped_messages: int = 0,
+                  spooled: int = 0, replayed: int = 0,
+                  spool_bytes: int = None, duplicates: int = 0,
+                  dead_lettered: int = 0) -> None:
+    """
+    Actualiza las métricas del pipeline de ingesta (app/ingest.py).
+
+    queue_depth : profundidad actual de la cola
+    rows        : filas escritas en el último volcado
+    flush_ms    : latencia del último volcado en milisegundos
+    dropped     : filas descartadas por backpressure
+    errors      : volcados fallidos
+    dropped_messages : uplinks descartados antes de parsear
+    spooled     : filas escritas en el spool (app/spool.py)
+    replayed    : filas del spool volcadas a la BD
+    spool_bytes : tamaño actual del spool
+    duplicates  : uplinks (ventana) o filas (ON CONFLICT) duplicados
+    dead_lettered : filas del spool que la BD rechaza, apartadas a dead/
+    """
+    if queue_depth is not None:
+        ingest_status["queue_depth"] = queue_depth
+    if flush_ms is not None:
+        ingest_status["flushes"] += 1
+        ingest_status["rows_written"] += rows
+        ingest_status["last_flush_ms"] = round(flush_ms, 3)
+        ingest_status["max_flush_ms"] = round(
+            max(flush_ms, ingest_status["max_flush_ms"] or 0.0), 3)
+        ingest_status["last_flush_ts"] = time.time()
+    ingest_status["dropped_rows"] += dropped
+    ingest_status["flush_errors"] += errors
+    ingest_status["dropped_messages"] += dropped_messages
+    ingest_status["spooled_rows"] += spooled
+    ingest_status["replayed_rows"] += replayed
+    if spool_bytes is not None:
+        ingest_status["spool_bytes"] = spool_bytes
+    ingest_status["duplicates_dropped"] += duplicates
+    ingest_status["dead_lettered_rows"] += dead_lettered
@@ -0,0 +1,118 @@
+"""
+app/streaming.py
+Respuestas en streaming para consultas de rango grande (`?stream=`).
+
+    ndjson → un objeto JSON por línea (application/x-ndjson)
+    array  → un array JSON enviado por trozos (application/json)
+
+Las filas salen de un cursor del lado del servidor (`stream_results`) en
+particiones de STREAM_CHUNK_ROWS y se serializan directamente desde las
+tuplas, sin objetos ORM ni validación Pydantic: la memoria del worker no
+depende del tamaño del rango y el primer byte sale con la primera partición.
+
+El generador asíncrono abre su propia conexión del pool de lectura (la
+sesión de `get_read_db` puede cerrarse antes de que termine de enviarse el
+cuerpo) con un `statement_timeout` propio, STREAM_STATEMENT_TIMEOUT_MS, más
+holgado que el de las consultas normales.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import os
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Sequence
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.sql import Select
+
+from app import metrics
+from app.database import read_engine, statement_timeout
+
+try:
+    import orjson
+except ImportError:             # pragma: no cover
+    orjson = None
+
+STREAM_CHUNK_ROWS: int = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+STREAM_STATEMENT_TIMEOUT_MS: int = int(os.getenv("STREAM_STATEMENT_TIMEOUT_MS", "300000"))
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "array": "application/json"}
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (dt.datetime, dt.date)):
+        return obj.isoformat()
+    raise TypeError(f"{type(obj).__name__} no serializable")
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_UTC_Z)
+else:                           # pragma: no cover
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def invalid(mode: Optional[str]) -> Optional[JSONResponse]:
+    """Respuesta 400 si `mode` no es un modo de streaming válido."""
+    if mode is None or mode in MEDIA_TYPES:
+        return None
+    return JSONResponse(
+        status_code=400,
+        content={"error": "Invalid stream. Use one of: ndjson, array."},
+    )
+
+
+async def partitions(stmt: Optional[Select],
+                     size: int = STREAM_CHUNK_ROWS) -> AsyncIterator[Sequence[tuple]]:
+    """Particiones de `size` filas de un cursor del lado del servidor."""
+    if stmt is None:
+        return
+    async with read_engine.connect() as conn:
+        await statement_timeout(conn, STREAM_STATEMENT_TIMEOUT_MS)
+        result = await conn.stream(stmt.execution_options(yield_per=size))
+        async for part in result.partitions():
+            yield part
+
+
+async def with_head(head: Sequence[tuple],
+                    stmt: Optional[Select]) -> AsyncIterator[Sequence[tuple]]:
+    """Como `partitions`, precedidas de `head` (filas ya leídas) si hay."""
+    if head:
+        yield head
+    async for part in partitions(stmt):
+        yield part
+
+
+async def _chunks(stmt: Optional[Select],
+                  to_dict: Callable[[tuple], Dict[str, Any]],
+                  mode: str,
+                  head: Sequence[tuple] = ()) -> AsyncIterator[bytes]:
+    sep = b"\n" if mode == "ndjson" else b","
+    first = True
+    if mode == "array":
+        yield b"["
+    async for part in with_head(head, stmt):
+        metrics.add_returned(len(part))
+        body = sep.join(dumps(to_dict(row)) for row in part)
+        if mode == "ndjson":
+            yield body + b"\n"
+        else:
+            yield body if first else b"," + body
+        first = False
+    if mode == "array":
+        yield b"]"
+
+
+def respond(mode: str,
+            stmt: Optional[Select],
+            to_dict: Callable[[tuple], Dict[str, Any]],
+            head: Sequence[tuple] = ()) -> StreamingResponse:
+    """
+    Envía en streaming las filas de `stmt` convertidas con `to_dict`;
+    `stmt=None` produce una respuesta vacía (filtro sin coincidencias).
+    `head` son filas ya leídas (tramos archivados) que salen antes.
+    """
+    return StreamingResponse(_chunks(stmt, to_dict, mode, head),
+                             media_type=MEDIA_TYPES[mode])
@@ -0,0 +1,224 @@
+"""
+app/workers.py
+Pool de parseo de uplinks fuera del hilo de red de paho.
+
+El callback MQTT sólo entrega los bytes crudos `(topic, payload)` a `submit`.
+Cada mensaje se asigna a un worker según el devEUI del tópico, así que los
+uplinks de un mismo dispositivo se procesan siempre en orden y por el mismo
+worker. Los workers pueden ser hilos o procesos (INGEST_WORKER_MODE); en modo
+proceso las filas vuelven por una cola compartida a un hilo colector que las
+entrega al pipeline de escritura (app/ingest.py), y por la misma cola, como
+mucho cada METRICS_FLUSH_INTERVAL segundos, los incrementos de sus métricas
+(app/metrics.py), que el colector suma a las del proceso padre.
+
+Cada worker descarta los uplinks repetidos con su propia ventana de
+deduplicación (app/dedup.py) y aplica las reglas de ingesta (app/rules.py)
+con su propio estado de límite de frecuencia: el reparto por devEUI
+garantiza que todas las copias de un uplink, y todas las muestras de una
+serie, pasan por el mismo worker.
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import List, Optional
+
+from app import metrics
+from app.decoder import decode_uplink, uplink_rows
+from app.dedup import DedupWindow, new_window, uplink_key
+from app.metrics import application, messages_parsed, parse_errors, parse_seconds
+from app.ingest import IngestPipeline, get_pipeline
+from app.rules import Filter, new_filter, ruleset
+from app.status import update_ingest
+
+# ───────────────────────── Config ────────────────────────── #
+
+WORKERS: int = int(os.getenv("INGEST_WORKERS", "2"))
+WORKER_MODE: str = os.getenv("INGEST_WORKER_MODE", "thread")     # thread|process
+WORKER_QUEUE_SIZE: int = int(os.getenv("INGEST_WORKER_QUEUE_SIZE", "5000"))
+PUT_TIMEOUT: float = float(os.getenv("INGEST_PUT_TIMEOUT", "5"))
+METRICS_FLUSH_INTERVAL: float = 1.0     # segundos (modo proceso)
+
+logger = logging.getLogger("workers")
+
+
+def shard_key(topic: str) -> str:
+    """devEUI de `application/<app>/device/<devEUI>/event/up` (o el tópico)."""
+    parts = topic.split("/", 4)
+    if len(parts) > 3 and parts[2] == "device":
+        return parts[3]
+    return topic
+
+
+def _parse(topic: str, payload: bytes,
+           window: Optional[DedupWindow] = None,
+           rules: Optional[Filter] = None) -> Optional[List]:
+    """Filas del uplink; None si es un duplicado ya visto por `window`."""
+    try:
+        with parse_seconds.time():
+            up = decode_uplink(payload)
+        messages_parsed.inc(1, application(topic))
+        if window is not None and window.seen(uplink_key(up, payload), up.time):
+            return None
+        return uplink_rows(up, rules)
+    except Exception as exc:
+        parse_errors.inc()
+        logger.exception("❌ Error procesando mensaje de %s: %s", topic, exc)
+        return []
+
+
+def _process_worker(inbox, outbox) -> None:
+    """
+    Bucle de un worker en modo proceso: parsea y devuelve las filas. Los
+    duplicados se notifican con un entero y las métricas con el dict de
+    `metrics.drain()` (los contadores viven en el padre).
+    """
+    window, rules = new_window(), new_filter()
+    metrics.drain()         # con fork, lo que el hilo padre ya había contado
+    flushed = time.monotonic()
+    while True:
+        try:
+            item = inbox.get(timeout=METRICS_FLUSH_INTERVAL)
+        except queue.Empty:
+            item = ()
+        if item is None:
+            break
+        if item:
+            rows = _parse(*item, window, rules)
+            if rows is None:
+                outbox.put(1)
+            elif rows:
+                outbox.put(rows)
+        if time.monotonic() - flushed >= METRICS_FLUSH_INTERVAL:
+            _send_metrics(outbox)
+            flushed = time.monotonic()
+    _send_metrics(outbox)
+
+
+def _send_metrics(outbox) -> None:
+    deltas = metrics.drain()
+    if deltas:
+        outbox.put(deltas)
+
+
+class ParserPool:
+    """Workers con una cola por shard; el shard se elige por devEUI."""
+
+    def __init__(self,
+                 pipeline: Optional[IngestPipeline] = None,
+                 workers: int = WORKERS,
+                 mode: str = WORKER_MODE,
+                 queue_size: int = WORKER_QUEUE_SIZE,
+                 put_timeout: float = PUT_TIMEOUT):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"INGEST_WORKER_MODE desconocido: {mode!r}")
+        self.pipeline = pipeline or get_pipeline()
+        self.workers = max(workers, 1)
+        self.mode = mode
+        self.put_timeout = put_timeout
+        self._queue_size = queue_size
+        self._inboxes: list = []
+        self._handles: list = []
+        self._outbox = None
+        self._collector: Optional[threading.Thread] = None
+
+    # ─────────────────────── Productores ─────────────────────── #
+
+    def submit(self, topic: str, payload: bytes) -> bool:
+        """Encola el mensaje crudo en el shard de su dispositivo."""
+        inbox = self._inboxes[zlib.crc32(shard_key(topic).encode()) % self.workers]
+        try:
+            inbox.put((topic, payload), timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning("⚠️  Cola de parseo llena: descartado uplink de %s",
+                           topic)
+            update_ingest(dropped_messages=1)
+            return False
+        return True
+
+    # ──────────────────────── Ciclo de vida ──────────────────── #
+
+    def start(self) -> "ParserPool":
+        if self._handles:
+            return self
+        ruleset()       # reglas no válidas → error al arrancar, no en los workers
+        if self.mode == "thread":
+            for i in range(self.workers):
+                inbox: "queue.Queue" = queue.Queue(maxsize=self._queue_size)
+                t = threading.Thread(target=self._thread_worker, args=(inbox,),
+                                     name=f"ingest-parser-{i}", daemon=True)
+                self._inboxes.append(inbox)
+                self._handles.append(t)
+        else:
+            self._outbox = mp.Queue(maxsize=self._queue_size)
+            for i in range(self.workers):
+                inbox = mp.Queue(maxsize=self._queue_size)
+                p = mp.Process(target=_process_worker,
+                               args=(inbox, self._outbox),
+                               name=f"ingest-parser-{i}", daemon=True)
+                self._inboxes.append(inbox)
+                self._handles.append(p)
+            self._collector = threading.Thread(target=self._collect,
+                                               name="ingest-collector",
+                                               daemon=True)
+            self._collector.start()
+
+        for handle in self._handles:
+            handle.start()
+        logger.info("🧵 Pool de parseo: %d workers (%s)", self.workers, self.mode)
+        return self
+
+    def stop(self) -> None:
+        """Procesa lo pendiente y detiene los workers."""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for handle in self._handles:
+            handle.join()
+        if self._outbox is not None:
+            self._outbox.put(None)
+            self._collector.join()
+        self._inboxes, self._handles = [], []
+        self._outbox = self._collector = None
+
+    def _thread_worker(self, inbox: "queue.Queue") -> None:
+        window, rules = new_window(), new_filter()
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            rows = _parse(*item, window, rules)
+            if rows is None:
+                update_ingest(duplicates=1)
+            elif rows:
+                self.pipeline.submit(rows)
+
+    def _collect(self) -> None:
+        while True:
+            rows = self._outbox.get()
+            if rows is None:
+                break
+            if isinstance(rows, int):
+                update_ingest(duplicates=rows)
+            elif isinstance(rows, dict):
+                metrics.merge(rows)
+            else:
+                self.pipeline.submit(rows)
+
+
+_pool: Optional[ParserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ParserPool:
+    """Devuelve el pool del proceso, arrancando los workers la 1ª vez."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ParserPool().start()
+        return _pool
@@ -0,0 +1,82 @@
+"""
+bench/common.py
+Utilidades compartidas por los benchmarks: percentiles, memoria y salida
+JSON comparable entre ejecuciones.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+from typing import Any, Dict, Optional, Sequence
+
+DEVICE_PREFIX = "bench-"
+
+
+def cleanup() -> None:
+    """Borra las filas de los dispositivos `bench-*` (datos y últimos valores)."""
+    from sqlalchemy import text
+
+    from app.database import engine
+
+    with engine.begin() as conn:
+        for table in ("sensor_data", "sensor_latest"):
+            conn.execute(text(f"""
+                DELETE FROM {table} WHERE device_ref IN (
+                    SELECT id FROM sensor_device WHERE dev_eui LIKE :p)
+            """), {"p": f"{DEVICE_PREFIX}%"})
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Percentil `q` (0–100) por rango más cercano; None sin datos."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso (ru_maxrss está en KiB en Linux)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_json(path: Optional[str], bench: str,
+               params: Dict[str, Any], results: Any) -> None:
+    """Guarda `{bench, meta, params, results}` en `path` ('-' → stdout)."""
+    if not path:
+        return
+    doc = {
+        "bench": bench,
+        "meta": {
+            "timestamp": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(doc, indent=2, default=str)
+    if path == "-":
+        print(text)
+    else:
+        with open(path, "w") as fh:
+            fh.write(text + "\n")
+        print(f"\n📄 Resultados en {path}")
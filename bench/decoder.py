@@ -0,0 +1,75 @@
+"""
+bench/decoder.py
+Micro-benchmark del decodificador de uplinks sobre payloads capturados
+(bench/payloads/*.json).
+
+    python -m bench.decoder [--number 20000]
+
+Compara el camino original (`json.loads` + cadena de `.get`) con el de
+app/decoder.py usando cada librería disponible.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import time
+import timeit
+
+from app import decoder
+
+PAYLOADS = pathlib.Path(__file__).with_name("payloads")
+
+
+def legacy_rows(raw: bytes):
+    """Extracción tal y como la hacía `on_message` antes de app/decoder.py."""
+    payload = json.loads(raw.decode())
+    device_id = (payload.get("devEUI")
+                 or payload.get("deviceInfo", {}).get("devEui"))
+    ts = (payload.get("receivedAt") or payload.get("time")
+          or time.strftime("%Y-%m-%dT%H:%M:%S"))
+    object_data = payload.get("objectJSON") or payload.get("object", {})
+    if isinstance(object_data, str):
+        object_data = json.loads(object_data)
+    return [(device_id, k, v, ts) for k, v in object_data.items()
+            if isinstance(v, (int, float))]
+
+
+def dict_rows(loads):
+    def rows(raw: bytes):
+        d = loads(raw)
+        up = (decoder._from_dict_v4(d) if "deviceInfo" in d
+              else decoder._from_dict_v3(d))
+        return [(up.dev_eui, k, v, up.time) for k, v in up.object.items()
+                if isinstance(v, (int, float))]
+    return rows
+
+
+def candidates():
+    yield "legacy (json + .get)", legacy_rows
+    yield "stdlib json", dict_rows(json.loads)
+    if decoder.orjson is not None:
+        yield "orjson", dict_rows(decoder.orjson.loads)
+    if decoder.msgspec is not None:
+        yield "msgspec (esquema)", decoder.extract_rows
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del decoder")
+    parser.add_argument("--number", type=int, default=20_000)
+    args = parser.parse_args(argv)
+
+    for path in sorted(PAYLOADS.glob("*.json")):
+        raw = json.dumps(json.loads(path.read_text())).encode()
+        print(f"\n{path.name} ({len(raw)} bytes)")
+        print(f"  {'decoder':<22} {'µs/msg':>8} {'msg/s':>12}")
+        for name, fn in candidates():
+            fn(raw)     # calentamiento (y detección de forma)
+            secs = timeit.timeit(lambda: fn(raw), number=args.number)
+            per = secs / args.number
+            print(f"  {name:<22} {per * 1e6:>8.2f} {1 / per:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+bench/ingest.py
+Benchmark extremo a extremo de la ingesta: uplinks sintéticos
+(bench/loadgen.py) → parseo → pipeline → PostgreSQL.
+
+    python -m bench.ingest --mode inprocess --devices 200 --keys 8 \\
+        --rate 0 --duration 10 [--version v3] [--json out.json]
+    python -m bench.ingest --mode mqtt --host localhost --port 1884 ...
+
+    inprocess → llama a `app.mqtt_client.on_message` directamente (pool de
+                parseo + IngestPipeline, sin broker)
+    mqtt      → publica en un Mosquitto local y consume con IngestService
+                (aiomqtt + asyncpg), el camino de producción
+
+Mide msgs/s, filas/s, latencia p50/p99 desde el `time` del uplink hasta
+su commit y el pico de memoria. Usa la BD de las variables DB_* habituales
+y borra las filas `bench-*` al terminar. Conviene lanzarlo con
+INGEST_MODE=off para que la API no arranque su propia ingesta.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from bench.common import cleanup, peak_rss_mb, percentile, write_json
+from bench.loadgen import TEMPLATES, UplinkFactory, paced, publish
+
+DRAIN_TIMEOUT = 60.0     # segundos máximos esperando a que se vacíe la ingesta
+
+
+class LagRecorder:
+    """Listener de ingesta: latencia por uplink (filas que comparten ts)."""
+
+    def __init__(self):
+        self.lags: List[float] = []
+        self.rows = 0
+
+    def __call__(self, rows) -> None:
+        now = time.time()
+        last = None
+        for row in rows:
+            if row[3] is not last:
+                last = row[3]
+                self.lags.append(now - last.timestamp())
+        self.rows += len(rows)
+
+
+def run_inprocess(factory: UplinkFactory, rate: float, duration: float,
+                  recorder: LagRecorder) -> Dict[str, float]:
+    from app import ingest, mqtt_client, workers
+
+    ingest.add_listener(recorder)
+    pool = workers.get_pool()
+    pipeline = ingest.get_pipeline()
+
+    started = time.perf_counter()
+    sent = 0
+    for i in paced(rate, duration):
+        topic, payload = factory.uplink(i % factory.devices)
+        mqtt_client.on_message(None, None,
+                               SimpleNamespace(topic=topic, payload=payload))
+        sent += 1
+    published = time.perf_counter() - started
+
+    pool.stop()          # procesa lo pendiente en los workers…
+    pipeline.stop()      # …y vuelca la cola del escritor
+    return {"sent": sent, "publish_s": published,
+            "total_s": time.perf_counter() - started}
+
+
+def run_mqtt(factory: UplinkFactory, host: str, port: int, rate: float,
+             duration: float, qos: int, recorder: LagRecorder) -> Dict[str, float]:
+    # mqtt_client lee el broker al importarse: hay que fijarlo antes
+    os.environ["MQTT_BROKER"] = host
+    os.environ["MQTT_PORT"] = str(port)
+    os.environ.setdefault("MQTT_TOPIC", "application/bench/device/+/event/up")
+    from app import ingest
+    from app.ingest_service import IngestService
+    from app.status import mqtt_status
+
+    ingest.add_listener(recorder)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(IngestService().run())
+    thread = threading.Thread(target=loop.run_until_complete, args=(task,),
+                              name="bench-ingest", daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + 30
+    while not mqtt_status["connected"]:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise SystemExit(f"❌ IngestService no conecta con {host}:{port}")
+        time.sleep(0.1)
+    time.sleep(0.5)      # la suscripción llega tras el CONNACK
+
+    started = time.perf_counter()
+    sent = publish(factory, host, port, rate, duration, qos)
+    published = time.perf_counter() - started
+
+    # Espera a que lleguen todas las filas o a que la ingesta deje de avanzar
+    expected = sent * len(factory.keys)
+    last, idle_since = -1, time.monotonic()
+    while recorder.rows < expected and time.monotonic() - idle_since < 5:
+        if recorder.rows != last:
+            last, idle_since = recorder.rows, time.monotonic()
+        time.sleep(0.05)
+    total = time.perf_counter() - started
+
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(DRAIN_TIMEOUT)
+    return {"sent": sent, "publish_s": published, "total_s": total}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta extremo a extremo")
+    parser.add_argument("--mode", choices=("inprocess", "mqtt"), default="inprocess")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1884)
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--keys", type=int, default=8)
+    parser.add_argument("--version", choices=sorted(TEMPLATES), default="v4")
+    parser.add_argument("--rate", type=float, default=0, help="uplinks/s (0 = máx.)")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--json", help="fichero de resultados ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    factory = UplinkFactory(args.devices, args.keys, args.version)
+    recorder = LagRecorder()
+    cleanup()
+    try:
+        if args.mode == "inprocess":
+            timing = run_inprocess(factory, args.rate, args.duration, recorder)
+        else:
+            timing = run_mqtt(factory, args.host, args.port, args.rate,
+                              args.duration, args.qos, recorder)
+    finally:
+        cleanup()
+
+    from app.status import ingest_status
+
+    total_s = timing["total_s"]
+    results = {
+        "uplinks_sent": timing["sent"],
+        "uplinks_committed": len(recorder.lags),
+        "rows_committed": recorder.rows,
+        "offered_msgs_per_s": round(timing["sent"] / timing["publish_s"]),
+        "msgs_per_s": round(len(recorder.lags) / total_s),
+        "rows_per_s": round(recorder.rows / total_s),
+        "lag_p50_ms": _ms(percentile(recorder.lags, 50)),
+        "lag_p99_ms": _ms(percentile(recorder.lags, 99)),
+        "lag_max_ms": _ms(max(recorder.lags, default=None)),
+        "elapsed_s": round(total_s, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "dropped_rows": ingest_status["dropped_rows"],
+        "dropped_messages": ingest_status["dropped_messages"],
+        "duplicates_dropped": ingest_status["duplicates_dropped"],
+    }
+
+    print(f"\n📊 Ingesta ({args.mode}, {args.version}, "
+          f"{args.devices} dispositivos × {args.keys} keys)")
+    for name, value in results.items():
+        print(f"  {name:<20} {value}")
+    write_json(args.json, "ingest", vars(args), results)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+if __name__ == "__main__":
+    main()
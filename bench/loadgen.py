@@ -0,0 +1,127 @@
+"""
+bench/loadgen.py
+Generador de uplinks ChirpStack sintéticos (v3 o v4) para N dispositivos
+con K magnitudes, a partir de los payloads capturados en bench/payloads.
+
+    python -m bench.loadgen --host localhost --port 1884 \\
+        --devices 200 --keys 8 --rate 500 --duration 30 [--count N] [--version v3]
+
+Publica en `application/bench/device/<devEUI>/event/up` del broker indicado
+(el Mosquitto de desarrollo de mosquitto/config escucha en 1884). Cada
+uplink lleva como `time` el instante de generación, de modo que la ingesta
+puede medir la latencia extremo a extremo.
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import datetime as dt
+import json
+import pathlib
+import random
+import time
+from typing import Iterator, Tuple
+
+from bench.common import DEVICE_PREFIX
+
+PAYLOADS = pathlib.Path(__file__).with_name("payloads")
+TEMPLATES = {"v4": "v4_weather_station.json", "v3": "v3_lht65.json"}
+
+
+class UplinkFactory:
+    """Construye (topic, payload) de uplinks para un parque de dispositivos."""
+
+    def __init__(self, devices: int = 100, keys: int = 8, version: str = "v4"):
+        if version not in TEMPLATES:
+            raise ValueError(f"versión desconocida: {version!r}")
+        self.devices = devices
+        self.keys = [f"key_{k}" for k in range(keys)]
+        self.version = version
+        self.template = json.loads((PAYLOADS / TEMPLATES[version]).read_text())
+        self.eui = [f"{DEVICE_PREFIX}{i:010d}" for i in range(devices)]
+        self._fcnt = [0] * devices
+
+    def topic(self, device: int) -> str:
+        return f"application/bench/device/{self.eui[device]}/event/up"
+
+    def payload(self, device: int, now: dt.datetime = None) -> bytes:
+        now = now or dt.datetime.now(dt.timezone.utc)
+        self._fcnt[device] += 1
+        obj = {k: round(random.random() * 100, 3) for k in self.keys}
+        up = copy.copy(self.template)
+        up["fCnt"] = self._fcnt[device]
+        if self.version == "v4":
+            up["deviceInfo"] = dict(up["deviceInfo"], devEui=self.eui[device],
+                                    applicationId="bench")
+            up["time"] = now.isoformat()
+            up["object"] = obj
+        else:
+            up["devEUI"] = self.eui[device]
+            up["applicationID"] = "bench"
+            up["receivedAt"] = now.isoformat()
+            up["objectJSON"] = json.dumps(obj)
+        return json.dumps(up).encode()
+
+    def uplink(self, device: int) -> Tuple[str, bytes]:
+        return self.topic(device), self.payload(device)
+
+
+def paced(rate: float, duration: float, count: int = 0) -> Iterator[int]:
+    """
+    Índices 0, 1, 2… a `rate` por segundo (0 = sin límite) durante
+    `duration` segundos o hasta `count` elementos.
+    """
+    started = time.perf_counter()
+    i = 0
+    while (not count or i < count) and time.perf_counter() - started < duration:
+        if rate:
+            ahead = started + i / rate - time.perf_counter()
+            if ahead > 0:
+                time.sleep(ahead)
+        yield i
+        i += 1
+
+
+def publish(factory: UplinkFactory, host: str, port: int,
+            rate: float, duration: float, qos: int = 0, count: int = 0) -> int:
+    """Publica uplinks en el broker; devuelve cuántos se enviaron."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(protocol=mqtt.MQTTv311)
+    client.connect(host, port)
+    client.loop_start()
+    sent = 0
+    try:
+        for i in paced(rate, duration, count):
+            client.publish(*factory.uplink(i % factory.devices), qos=qos)
+            sent += 1
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    return sent
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Generador de uplinks sintéticos")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1884)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--keys", type=int, default=8)
+    parser.add_argument("--version", choices=sorted(TEMPLATES), default="v4")
+    parser.add_argument("--rate", type=float, default=100, help="uplinks/s (0 = máx.)")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    parser.add_argument("--count", type=int, default=0, help="parar tras N uplinks (0 = sin tope)")
+    args = parser.parse_args(argv)
+
+    factory = UplinkFactory(args.devices, args.keys, args.version)
+    started = time.perf_counter()
+    sent = publish(factory, args.host, args.port, args.rate, args.duration, args.qos,
+                   args.count)
+    elapsed = time.perf_counter() - started
+    print(f"📤 {sent} uplinks en {elapsed:.1f}s ({sent / elapsed:,.0f} msg/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+bench/queries.py
+Latencia de los endpoints GET de app/main.py sobre un conjunto sembrado.
+
+    python -m bench.queries [--devices 10] [--keys 4] [--days 14] \\
+        [--step 300] [--repeat 20] [--cached] [--json out.json]
+
+Siembra devices × keys series de `days` días con una muestra cada `step`
+segundos (CopySink, dispositivos `bench-*`), refresca los rollups si
+existen y mide cada endpoint con TestClient (sin red): p50/p99 en ms y
+tamaño de la respuesta. Avisa de las rutas GET que no tengan caso aquí,
+para que el benchmark no se quede atrás cuando se añadan endpoints.
+Borra las filas sembradas al terminar.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import logging
+import math
+import random
+import time
+from typing import Dict, List, Tuple
+
+from bench.common import DEVICE_PREFIX, cleanup, peak_rss_mb, percentile, write_json
+
+SEED_BATCH = 50_000
+
+
+def seed(devices: int, keys: int, days: float, step: int) -> Tuple[int, dt.datetime, dt.datetime]:
+    """Inserta las series sintéticas; devuelve (filas, inicio, fin)."""
+    from app.sinks import CopySink
+
+    sink = CopySink()
+    end = dt.datetime.now(dt.timezone.utc).replace(second=0, microsecond=0)
+    start = end - dt.timedelta(days=days)
+    points = int(days * 86400 // step)
+    total = 0
+    batch: List[tuple] = []
+    for d in range(devices):
+        device_id = f"{DEVICE_PREFIX}{d:010d}"
+        for k in range(keys):
+            phase = random.random() * math.tau
+            for i in range(points):
+                ts = start + dt.timedelta(seconds=i * step)
+                value = 20 + 5 * math.sin(phase + i / 288) + random.random()
+                batch.append((device_id, f"key_{k}", round(value, 3), ts))
+                if len(batch) >= SEED_BATCH:
+                    total += sink.write(batch)
+                    batch = []
+    total += sink.write(batch)
+    return total, start, end
+
+
+def refresh_rollups() -> List[str]:
+    """Materializa los agregados continuos que existan (TimescaleDB)."""
+    from sqlalchemy import text
+
+    from app.database import engine
+    from app.main import _INTERVALS
+
+    refreshed = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for interval in _INTERVALS.values():
+            if interval.rollup and conn.execute(
+                    text("SELECT to_regclass(:n) IS NOT NULL"),
+                    {"n": interval.rollup}).scalar():
+                conn.execute(text(f"CALL refresh_continuous_aggregate("
+                                  f"'{interval.rollup}', NULL, NULL)"))
+                refreshed.append(interval.rollup)
+    return refreshed
+
+
+def cases(devices: int, start: dt.datetime, end: dt.datetime) -> List[Tuple[str, str, Dict]]:
+    """(nombre, ruta, parámetros) de cada consulta a medir."""
+    from app import pagination
+
+    device = f"{DEVICE_PREFIX}{0:010d}"
+    many = [f"{DEVICE_PREFIX}{d:010d}" for d in range(min(devices, 5))]
+    day = {"start": (end - dt.timedelta(days=1)).isoformat(), "end": end.isoformat()}
+    full = {"start": start.isoformat(), "end": end.isoformat()}
+    series = {"device_id": device, "key": "key_0"}
+    # Cursor a mitad del rango: una página profunda cuesta lo mismo que la primera
+    middle = pagination.encode(start + (end - start) / 2, 0)
+
+    out = [
+        ("health", "/health", {}),
+        ("mqtt_status", "/mqtt_status", {}),
+        ("ingest_status", "/ingest_status", {}),
+        ("retention_status", "/retention_status", {}),
+        ("metrics", "/metrics", {}),
+        ("data", "/data/", {"limit": 1000}),
+        ("data_ndjson", "/data/", {"limit": 1000, "stream": "ndjson"}),
+        ("data_deep_page", "/data/", {"limit": 1000, "cursor": middle}),
+        ("measurements_page", "/measurements/",
+         {"device_id": device, **full, "limit": 1000, "cursor": middle}),
+        ("measurements_day", "/measurements/", {"device_id": device, **day}),
+        ("measurements_full_ndjson", "/measurements/",
+         {"device_id": device, **full, "stream": "ndjson"}),
+        ("latest", "/latest_measurements/", {"device_id": device}),
+        ("latest_grouped", "/latest_measurements_grouped/", {"device_id": device}),
+        ("latest_all", "/latest_measurements_all/", {}),
+        ("latest_all_grouped", "/latest_measurements_all_grouped/", {}),
+        ("timeseries_day", "/timeseries/", {**series, **day}),
+        ("timeseries_full", "/timeseries/", {**series, **full}),
+        ("timeseries_full_array", "/timeseries/", {**series, **full, "stream": "array"}),
+        ("timeseries_lttb_500", "/timeseries/", {**series, **full, "max_points": 500}),
+        ("timeseries_minmax_500", "/timeseries/",
+         {**series, **full, "max_points": 500, "method": "minmax"}),
+        ("timeseries_avg_500", "/timeseries/",
+         {**series, **full, "max_points": 500, "method": "avg"}),
+        ("timeseries_fill_previous", "/timeseries/",
+         {**series, **day, "fill": "previous", "resolution": 60}),
+        ("timeseries_fill_step", "/timeseries/", {**series, **day, "fill": "step"}),
+    ]
+    for interval in ("hour", "day", "week"):
+        out += [
+            (f"aggregated_{interval}", "/timeseries/aggregated/",
+             {**series, **full, "interval": interval}),
+            (f"aggregated_full_{interval}", "/timeseries/aggregated/full/",
+             {**series, **full, "interval": interval}),
+            (f"aggregated_multi_{interval}", "/timeseries/aggregated/multi/",
+             {"device_ids": many, "key": "key_0", **full, "interval": interval}),
+        ]
+    out += [
+        ("aggregated_fill_linear", "/timeseries/aggregated/",
+         {**series, **full, "interval": "hour", "fill": "linear"}),
+        ("aggregated_multi_columns", "/timeseries/aggregated/multi/",
+         {"device_ids": many, "key": "key_0", **full, "interval": "hour",
+          "fill": "previous", "layout": "columns"}),
+    ]
+    for fmt in ("arrow", "parquet", "csv"):
+        out.append((f"export_{fmt}", "/export/",
+                    {"device_ids": many, "keys": ["key_0", "key_1"], **full,
+                     "format": fmt}))
+    return out
+
+
+def uncovered(app, measured: List[Tuple[str, str, Dict]]) -> List[str]:
+    """Rutas GET de la API sin caso en `cases` (salvo los flujos en vivo)."""
+    from fastapi.routing import APIRoute
+
+    paths = {path for _, path, _ in measured} | {"/subscribe/sse"}
+    return sorted(route.path for route in app.routes
+                  if isinstance(route, APIRoute) and "GET" in route.methods
+                  and route.path not in paths)
+
+
+def measure(client, path: str, params: Dict, repeat: int, cached: bool = False) -> Dict:
+    # Sin --cached se salta la caché HTTP (app/cache.py) para medir la consulta
+    headers = {} if cached else {"Cache-Control": "no-cache"}
+    client.get(path, params=params)          # calienta cachés y planes
+    timings, size, status = [], 0, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path, params=params, headers=headers)
+        timings.append(time.perf_counter() - started)
+        size, status = len(response.content), response.status_code
+    return {
+        "path": path,
+        "status": status,
+        "p50_ms": round(percentile(timings, 50) * 1000, 2),
+        "p99_ms": round(percentile(timings, 99) * 1000, 2),
+        "bytes": size,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de endpoints de consulta")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--days", type=float, default=14)
+    parser.add_argument("--step", type=int, default=300, help="segundos entre muestras")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--cached", action="store_true",
+                        help="medir con la caché HTTP (aciertos)")
+    parser.add_argument("--json", help="fichero de resultados ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)   # una línea por petición
+    cleanup()
+    try:
+        started = time.perf_counter()
+        rows, start, end = seed(args.devices, args.keys, args.days, args.step)
+        refreshed = refresh_rollups()
+        print(f"🌱 {rows:,} filas sembradas en {time.perf_counter() - started:.1f}s"
+              + (f" (rollups: {', '.join(refreshed)})" if refreshed else ""))
+
+        measured = cases(args.devices, start, end)
+        for path in uncovered(app, measured):
+            print(f"⚠️  Ruta GET sin caso en el benchmark: {path}")
+
+        results = {}
+        with TestClient(app) as client:
+            print(f"\n{'consulta':<28} {'estado':>6} {'p50 ms':>9} {'p99 ms':>9} {'bytes':>11}")
+            for name, path, params in measured:
+                res = results[name] = measure(client, path, params, args.repeat, args.cached)
+                print(f"{name:<28} {res['status']:>6} {res['p50_ms']:>9.2f} "
+                      f"{res['p99_ms']:>9.2f} {res['bytes']:>11,}")
+    finally:
+        cleanup()
+
+    print(f"\n🧠 Pico de memoria: {peak_rss_mb()} MB")
+    write_json(args.json, "queries", vars(args),
+               {"seeded_rows": rows, "rollups": refreshed,
+                "peak_rss_mb": peak_rss_mb(), "queries": results})
+
+
+if __name__ == "__main__":
+    main()
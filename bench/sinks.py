@@ -0,0 +1,66 @@
+"""
+bench/sinks.py
+Compara filas/segundo de los sinks de `app/sinks.py` contra un PostgreSQL
+local (variables DB_* habituales).
+
+    python -m bench.sinks [--rows 20000] [--batches 1 100 10000] [--json out.json]
+
+Escribe en `sensor_data` con device_id 'bench-*' y borra esas filas al final.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import random
+import time
+
+from app.sinks import SINKS
+from bench.common import DEVICE_PREFIX, cleanup, write_json
+
+
+def synth_rows(n: int):
+    base = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    return [
+        (f"{DEVICE_PREFIX}{i % 50:04d}", f"key_{i % 10}", random.random() * 100,
+         base + dt.timedelta(seconds=i))
+        for i in range(n)
+    ]
+
+
+def run(sink_name: str, rows, batch_size: int) -> float:
+    sink = SINKS[sink_name]()
+    started = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        sink.write(rows[i:i + batch_size])
+    return len(rows) / (time.perf_counter() - started)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de sinks")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--batches", type=int, nargs="+",
+                        default=[1, 100, 10_000])
+    parser.add_argument("--json", help="fichero de resultados ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    results = []
+
+    print(f"{'sink':<6} {'batch':>7} {'rows':>7} {'rows/s':>12}")
+    try:
+        for batch in args.batches:
+            # batch=1 es una transacción por fila: limitamos el volumen
+            rows = synth_rows(min(args.rows, 2_000) if batch == 1 else args.rows)
+            for name in SINKS:
+                rate = run(name, rows, batch)
+                print(f"{name:<6} {batch:>7} {len(rows):>7} {rate:>12,.0f}")
+                results.append({"sink": name, "batch": batch,
+                                "rows": len(rows), "rows_per_s": round(rate)})
+                cleanup()
+    finally:
+        cleanup()
+    write_json(args.json, "sinks", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,14 @@ fi
 echo "Esperando 15s a que la BD arranque..."
 sleep 15
 
+# Con varios workers de Gunicorn la ingesta NO puede ir en el lifespan de la
+# API (cada worker la duplicaría): se lanza una única vez como proceso aparte.
+INGEST_MODE=${INGEST_MODE:-standalone}
+export INGEST_MODE
+if [ "$INGEST_MODE" = "standalone" ]; then
+  python -m app.ingest_service >> "${LOG_DIR}/mqtt.err.log" 2>&1 &
+fi
+
 gunicorn "$APP_MODULE" --workers "$WORKERS" --worker-class uvicorn.workers.UvicornWorker \
   --bind "$HOST:$PORT" --log-level info \
   --access-logfile "$API_LOG" --error-logfile "$API_LOG"
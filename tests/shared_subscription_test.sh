@@ -0,0 +1,65 @@
+#!/usr/bin/env bash
+# tests/shared_subscription_test.sh
+# ──────────────────────────────────────────────────────────────────────────────
+#  Escalado horizontal de la ingesta: arranca el servicio standalone con
+#  INGEST_PROCESSES procesos en un grupo de suscripción compartida MQTT v5,
+#  publica N uplinks sintéticos en el broker de DESARROLLO (mosquitto_dev) y
+#  comprueba en el /metrics de cada proceso que todos han recibido trabajo y
+#  que la suma es exactamente N (ni perdidos ni duplicados).
+#  Necesita la BD configurada (DB_*) y el Mosquitto de docker-compose.dev.
+# ──────────────────────────────────────────────────────────────────────────────
+set -euo pipefail
+
+BROKER_HOST=${BROKER_HOST:-localhost}
+BROKER_PORT=${BROKER_PORT:-1884}
+PROCESSES=${PROCESSES:-3}
+UPLINKS=${UPLINKS:-600}
+METRICS_BASE=${METRICS_BASE:-9208}
+
+cd "$(dirname "$0")/.."
+
+cleanup() {
+  [[ -n "${SUPERVISOR:-}" ]] && kill "$SUPERVISOR" 2>/dev/null && wait "$SUPERVISOR" || true
+  python -c 'from bench.common import cleanup; cleanup()'
+}
+trap cleanup EXIT
+
+echo "🚀 Ingesta con ${PROCESSES} procesos en el grupo ‘test’ (mqtt://${BROKER_HOST}:${BROKER_PORT})"
+INGEST_MODE=standalone INGEST_PROCESSES="$PROCESSES" MQTT_SHARE_GROUP=test \
+MQTT_BROKER="$BROKER_HOST" MQTT_PORT="$BROKER_PORT" MQTT_CTX_DIR=/nonexistent \
+MQTT_TOPIC='application/bench/device/+/event/up' INGEST_METRICS_PORT="$METRICS_BASE" \
+SPOOL_DIR= python -m app.ingest_service &
+SUPERVISOR=$!
+
+received() {   # suma de ingest_messages_received_total de un proceso
+  curl -sf "http://localhost:$1/metrics" \
+    | awk '/^ingest_messages_received_total/ {s += $NF} END {print s + 0}'
+}
+
+echo "⏳ Esperando a los procesos de ingesta…"
+for i in $(seq 0 $((PROCESSES - 1))); do
+  for _ in $(seq 1 30); do
+    curl -sf "http://localhost:$((METRICS_BASE + i))/metrics" >/dev/null && break
+    sleep 1
+  done
+done
+sleep 2   # margen para que todos se suscriban al grupo
+
+python -m bench.loadgen --host "$BROKER_HOST" --port "$BROKER_PORT" \
+  --devices 50 --keys 2 --rate 200 --duration 60 --count "$UPLINKS" --qos 1
+sleep 3   # margen para que se consuma lo publicado
+
+TOTAL=0
+for i in $(seq 0 $((PROCESSES - 1))); do
+  N=$(received $((METRICS_BASE + i)))
+  echo "📊 Proceso $i: ${N} uplinks"
+  if [[ "$N" -eq 0 ]]; then
+    echo "❌ El proceso $i no recibió ningún uplink"; exit 1
+  fi
+  TOTAL=$((TOTAL + N))
+done
+
+if [[ "$TOTAL" -ne "$UPLINKS" ]]; then
+  echo "❌ Recibidos ${TOTAL} uplinks en total; se publicaron ${UPLINKS}"; exit 1
+fi
+echo "✅ ${UPLINKS} uplinks repartidos entre ${PROCESSES} procesos sin duplicados."
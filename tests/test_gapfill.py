@@ -0,0 +1,105 @@
+"""
+tests/test_gapfill.py
+Buckets de `/timeseries/aggregated/*` en PostgreSQL sin TimescaleDB: la
+consulta de app/rollups.py agrupa con `_bucket(…, timescale=False)` y
+app/gapfill.py rellena el resultado. Comprueba que los buckets de la BD
+coinciden con `floor_to` (también con una zona horaria con cambio de hora)
+y que `fill_buckets` / `with_empty` los rellenan bien.
+
+Necesita la BD configurada (DB_*); no escribe nada en ella.
+
+    python -m unittest tests.test_gapfill
+"""
+
+import datetime as dt
+import unittest
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import gapfill, rollups
+from app.database import engine
+
+HOUR = dt.timedelta(hours=1)
+DAY = dt.timedelta(days=1)
+
+
+def at(*args) -> dt.datetime:
+    return dt.datetime(*args, tzinfo=dt.timezone.utc)
+
+
+class PortableBucketsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.conn = engine.connect()
+        except OperationalError as exc:
+            raise unittest.SkipTest(f"BD no disponible: {exc}")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def setUp(self):
+        # Un día no dura 24 h en esta zona: los buckets deben seguir en UTC
+        self.conn.execute(text("SET timezone = 'Europe/Madrid'"))
+
+    def tearDown(self):
+        self.conn.rollback()
+
+    def aggregate(self, rows, width):
+        """`_OUTER` sobre (device_ref, key_ref, timestamp, value) sin agrupar."""
+        outer = rollups._OUTER.format(columns="device_ref, key_ref",
+                                      bucket=rollups._bucket("bucket", False),
+                                      parts=rollups._ARCHIVED)
+        return self.conn.execute(text(outer), {
+            "a_devices": [r[0] for r in rows], "a_keys": [r[1] for r in rows],
+            "a_buckets": [r[2] for r in rows], "a_totals": [r[3] for r in rows],
+            "a_samples": [1] * len(rows), "a_maxima": [r[3] for r in rows],
+            "a_minima": [r[3] for r in rows],
+            "origin_s": rollups.ORIGIN.timestamp(),
+            "width_s": width.total_seconds(),
+        }).all()
+
+    def test_buckets_match_floor_to(self):
+        stamps = [at(2024, 3, 30, 23, 59, 59, 999999), at(2024, 3, 31, 0, 30),
+                  at(2024, 3, 31, 1, 0), at(2024, 10, 27, 0, 59, 59),
+                  at(2024, 10, 27, 1, 0, 0, 1), at(1999, 12, 31, 12)]
+        for width in (dt.timedelta(minutes=15), HOUR, DAY, dt.timedelta(weeks=1)):
+            rows = self.aggregate([(1, 1, ts, 1.0) for ts in stamps], width)
+            self.assertEqual([row[2] for row in rows],
+                             sorted({rollups.floor_to(ts, width) for ts in stamps}))
+
+    def test_fill_buckets(self):
+        rows = self.aggregate([(1, 1, at(2024, 1, 1, 0, 10), 1.0),
+                               (1, 1, at(2024, 1, 1, 0, 50), 3.0),
+                               (1, 1, at(2024, 1, 1, 2, 40), 4.0)], HOUR)
+        self.assertEqual(rows, [(1, 1, at(2024, 1, 1, 0), 2.0, 3.0, 1.0),
+                                (1, 1, at(2024, 1, 1, 2), 4.0, 4.0, 4.0)])
+        start, end = at(2024, 1, 1, 0, 30), at(2024, 1, 1, 3, 5)
+        buckets = [at(2024, 1, 1, h) for h in range(4)]
+        expected = {
+            "null": [2.0, None, 4.0, None],
+            "previous": [2.0, 2.0, 4.0, 4.0],
+            "linear": [2.0, 3.0, 4.0, None],
+        }
+        for mode, averages in expected.items():
+            filled = gapfill.fill_buckets(rows, 2, start, end, HOUR, mode)
+            self.assertEqual([row[2] for row in filled], buckets, mode)
+            self.assertEqual([row[3] for row in filled], averages, mode)
+
+    def test_with_empty(self):
+        rows = self.aggregate([(2, 1, at(2024, 1, 2, 6), 5.0)], DAY)
+        start, end = at(2024, 1, 1), at(2024, 1, 3)
+        filled = gapfill.fill_buckets(rows, 2, start, end, DAY, "previous")
+        out = gapfill.with_empty(filled, [(1, 1), (2, 1)], 2, start, end, DAY)
+        days = [at(2024, 1, d) for d in (1, 2, 3)]
+        self.assertEqual(out, [(1, 1, day, None, None, None) for day in days]
+                         + [(2, 1, days[0], None, None, None),
+                            (2, 1, days[1], 5.0, 5.0, 5.0),
+                            (2, 1, days[2], 5.0, 5.0, 5.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()